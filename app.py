@@ -2,67 +2,267 @@
 This module is the main web app loop
 """
 import os
+import uuid
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, Response, abort, g, has_request_context, render_template, request, redirect, url_for, \
+    jsonify, send_from_directory, stream_with_context
+from jinja2 import ChoiceLoader
+from werkzeug.local import LocalProxy
 from datetime import datetime
 from src.database.database import DatabaseOperation
 from src.page import Page
 from src.appointment import Appointment
-from src.notification import NotificationService
+from src.key_rotation import ReencryptionJob
+from src.archive import LeadArchiver, archive_path_for
+from src.rate_limit import create_limiter
+from src.compression import CompressionMiddleware
+from src.templating import configure_templates, precompile_templates, LazySequence
+from src.tenancy import create_registry, SiteFragmentCache, SiteTemplateLoader
+from src import metrics
+from src.logging_config import configure_logging
+
+configure_logging()
 
 app = Flask(__name__)
-notification_service = NotificationService()
+compression = CompressionMiddleware(app.wsgi_app)
+app.wsgi_app = compression
+configure_templates(app)
+
+
+def _compression_metrics() -> list[str]:
+    stats = compression.stats.snapshot()
+    return [
+        "# HELP http_compression_bytes_in_total Uncompressed bytes of compressed responses",
+        "# TYPE http_compression_bytes_in_total counter",
+        f"http_compression_bytes_in_total {stats['bytes_in']}",
+        "# HELP http_compression_bytes_out_total Compressed bytes sent",
+        "# TYPE http_compression_bytes_out_total counter",
+        f"http_compression_bytes_out_total {stats['bytes_out']}",
+        "# HELP http_compression_cpu_seconds_total Thread CPU time spent compressing",
+        "# TYPE http_compression_cpu_seconds_total counter",
+        f"http_compression_cpu_seconds_total {stats['cpu_seconds']}",
+        "# HELP http_compression_ratio Compressed size over original size",
+        "# TYPE http_compression_ratio gauge",
+        f"http_compression_ratio {stats['ratio']}",
+    ]
+
+
+metrics.registry.register_collector(_compression_metrics)
+notification_service = LocalProxy(lambda: current_site().notification_service)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Token buckets for the public forms; set RATE_LIMIT_DB to share them between worker processes
+ip_limiter = create_limiter(
+    rate=float(os.environ.get("RATE_LIMIT_IP_PER_MINUTE", "10")) / 60,
+    capacity=float(os.environ.get("RATE_LIMIT_IP_BURST", "10")),
+    path=os.environ.get("RATE_LIMIT_DB"),
+)
+identity_limiter = create_limiter(
+    rate=float(os.environ.get("RATE_LIMIT_IDENTITY_PER_MINUTE", "3")) / 60,
+    capacity=float(os.environ.get("RATE_LIMIT_IDENTITY_BURST", "3")),
+    path=os.environ.get("RATE_LIMIT_DB"),
+)
+
+
+def rate_limited(identity: str = None) -> float | None:
+    """
+    Checks the client IP and, when given, the submitted identity (email or phone) against their budgets.
+    Runs before any encryption or database work so rejected requests stay cheap.
+    @param identity: plain text email or phone number, hashed before it is used as a key; JSON clients may
+    send it as a number, which is validated later like any other field
+    @return: seconds to wait when the request must be rejected, otherwise None
+    """
+    allowed, retry_after = ip_limiter.allow(f"ip:{request.remote_addr}")
+    if allowed and identity:
+        allowed, retry_after = identity_limiter.allow(f"id:{database.hashing.hash(str(identity))}")
+    if allowed:
+        return None
+    metrics.RATE_LIMITED.inc(1, request.endpoint)
+    return retry_after
+
+
+def get_idempotency_key(data: dict) -> str | None:
+    """
+    Returns the client supplied idempotency key from the Idempotency-Key header or the submitted data
+    @param data: submitted form or json fields
+    @return: key or None when absent, not a string or implausibly long
+    """
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    if isinstance(key, str) and key and len(key) <= 128:
+        return key
+    return None
+
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-database = DatabaseOperation("contacts.db")
-database.create_leads_table("leads")
-database.create_appointment_table("appointments")
-database.create_pages_table("pages")
 
-# Seed default pages if they don't exist
-if not database.get_page_by_route("home"):
-    database.insert_page(Page(route="home", title="Welcome", content="Welcome to our website!"))
-if not database.get_page_by_route("services"):
-    database.insert_page(Page(route="services", title="Our Services", content="Here are our services."))
-if not database.get_page_by_route("gallery"):
-    database.insert_page(Page(route="gallery", title="Gallery", content="Check out our work."))
+def render_page(site, path: str) -> str | None:
+    """
+    Renders a page of a site, once per route table generation: later requests get the stored output
+    and concurrent first requests wait for a single render
+    @param site: Site serving the request
+    @param path: request path, e.g. "/" or "/services"
+    @return: str, None when no page is served at path
+    """
+    # Read before the lookup, see RouteTable.generation
+    generation = site.route_table.generation
+    entry = site.route_table.lookup(path)
+    if entry is None:
+        return None
+    template, page = entry
+    name = site.template(template)
+    return site.fragment_cache.get_or_render(f"page:{name}:{path}:{generation}",
+                                             lambda: render_template(name, page=page))
+
+
+def warm_up_site(site) -> None:
+    """
+    Renders a newly opened site's pages before any request is handed to it
+    @param site: Site
+    @return: null
+    """
+    with app.test_request_context("/"):
+        g.site = site
+        site.warm_up(render_page)
+
+
+DATABASE_FILE = os.environ.get("DATABASE_FILE", "contacts.db")
+# Sites are picked by Host header; without SITES_CONFIG a single site on DATABASE_FILE serves every host
+sites = create_registry(DATABASE_FILE, app.config['UPLOAD_FOLDER'], warm_up=warm_up_site)
+
+
+def current_site():
+    """
+    Returns the site of the current request, or the default site outside requests
+    @return: Site
+    """
+    if has_request_context() and "site" in g:
+        return g.site
+    return default_site
+
+
+database = LocalProxy(lambda: current_site().database)
+app.jinja_loader = ChoiceLoader([app.jinja_loader, SiteTemplateLoader(sites)])
+app.jinja_env.fragment_cache = SiteFragmentCache(current_site)
+# The default site stays open for the life of the process; it is warmed up before the worker serves
+default_site = sites.acquire_site(sites.default) if sites.default else None
 
 
-@app.route("/")
-def home():
+def reporting_database():
     """
-    Returns index template located in templates folder
+    Lends the database reporting reads should use for the duration of a with block
+    @return: context manager yielding the site's snapshot if enabled (REPORTING_SNAPSHOT_SECONDS), otherwise its
+    live database
+    """
+    return current_site().reporting_database()
+
+
+def render_site_template(name: str, **context) -> str:
+    """
+    Renders a template, preferring the current site's override of it
+    @param name: template name
+    @param context: template variables
     @return: str
     """
-    page = database.get_page_by_route("home")
-    return render_template("index.html", page=page)
+    return render_template(current_site().template(name), **context)
+
+
+def _site_metrics() -> list[str]:
+    lines = [
+        "# HELP sites_open Sites with an open database in this process",
+        "# TYPE sites_open gauge",
+        f"sites_open {len(sites.open_sites())}",
+    ]
+    reporting_snapshot = current_site().reporting_snapshot
+    if not reporting_snapshot:
+        return lines
+    stats = reporting_snapshot.stats()
+    return lines + [
+        "# HELP reporting_snapshot_age_seconds Seconds since the reporting snapshot was taken",
+        "# TYPE reporting_snapshot_age_seconds gauge",
+        f"reporting_snapshot_age_seconds {stats['age_seconds'] or 0}",
+        "# HELP reporting_snapshot_refresh_seconds Duration of the last snapshot refresh",
+        "# TYPE reporting_snapshot_refresh_seconds gauge",
+        f"reporting_snapshot_refresh_seconds {stats['last_seconds']}",
+        "# HELP reporting_snapshot_refreshes_total Snapshots taken",
+        "# TYPE reporting_snapshot_refreshes_total counter",
+        f"reporting_snapshot_refreshes_total {stats['refreshes']}",
+    ]
+
+
+metrics.registry.register_collector(_site_metrics)
+
+precompile_templates(app)
+
+
+@app.before_request
+def start_request_metrics():
+    metrics.begin_request()
+
 
-@app.route("/services")
-def services():
+@app.before_request
+def select_site():
+    site = sites.acquire(request.host)
+    if site is None:
+        abort(404)
+    g.site = site
+
+
+@app.teardown_request
+def release_site(exception):
+    site = g.pop("site", None)
+    if site is not None:
+        # Ends a transaction an unexpected error left open, which would keep the write connection from other requests
+        site.database.connection.rollback()
+        sites.release(site)
+
+
+@app.after_request
+def finish_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.end_request(request.method, route, response.status_code)
+    return response
+
+
+@app.route("/metrics")
+def metrics_endpoint():
     """
-    Returns services template
+    Returns request, SQL, encryption and provider metrics in the Prometheus text format
     @return: str
     """
-    page = database.get_page_by_route("services")
-    return render_template("services.html", page=page)
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
 
 
-@app.route("/gallery")
-def gallery():
+@app.route("/ready")
+def ready():
     """
-    Returns gallery template
+    Readiness probe: 200 once the site of the request has been warmed up and its database answers
+    @return: JSON with the warm-up and cache stats, 503 while not ready
+    """
+    site = current_site()
+    body = {"site": site.name, "ready": site.ready(), "warm_up": site.warm_stats,
+            "cache": site.fragment_cache.stats()}
+    return jsonify(body), 200 if body["ready"] else 503
+
+
+@app.route("/", defaults={"path": ""})
+@app.route("/<path:path>")
+def page(path: str):
+    """
+    Serves any row of the pages table from the in-memory route table; explicit routes take precedence
+    @param path: request path without the leading slash
     @return: str
     """
-    page = database.get_page_by_route("gallery")
-    return render_template("gallery.html", page=page)
+    html = render_page(current_site(), f"/{path}")
+    if html is None:
+        abort(404)
+    return html
 
 
 @app.route("/appointments")
@@ -71,7 +271,7 @@ def appointments():
     Returns appointments template
     @return: str
     """
-    return render_template("appointments.html")
+    return render_site_template("appointments.html")
 
 
 @app.route("/save_appointment", methods=["POST"])
@@ -79,7 +279,16 @@ def save_appointment():
     """
     Saves a new appointment
     """
-    data = request.json
+    data = request.get_json(silent=True) or {}
+    retry_after = rate_limited(data.get("phone_number"))
+    if retry_after is not None:
+        response = jsonify({"success": False, "error": "Too many requests"})
+        return response, 429, {"Retry-After": str(int(retry_after) + 1)}
+    idempotency_key = get_idempotency_key(data)
+    if idempotency_key:
+        previous = database.get_idempotent_result("appointment", idempotency_key)
+        if previous is not None:
+            return jsonify(previous)
     try:
         # Expected date format YYYY-MM-DD from the frontend
         # But Appointment model expects datetime object and we store isoformat.
@@ -99,7 +308,9 @@ def save_appointment():
             message=data.get("message")
         )
 
-        if database.insert_appointment(appointment):
+        if database.insert_appointment(appointment, idempotency_key=idempotency_key):
+            if current_site().reminder_scheduler:
+                current_site().reminder_scheduler.wake()
             return jsonify({"success": True})
         else:
             return jsonify({"success": False, "error": "Database error"})
@@ -115,12 +326,16 @@ def contact_me():
     @return:
     """
     if request.method == "POST":
+        retry_after = rate_limited(request.form.get("email"))
+        if retry_after is not None:
+            return "Too many requests", 429, {"Retry-After": str(int(retry_after) + 1)}
         data = dict(request.form)
+        idempotency_key = get_idempotency_key(data)
+        data.pop("idempotency_key", None)
         data["visible"] = 1
-        database.insert_contact_data(data)
-        return render_template("contact.html")
-    else:
-        return render_template("contact.html")
+        if not (idempotency_key and database.get_idempotent_result("contact", idempotency_key)):
+            database.insert_contact_data(data, idempotency_key=idempotency_key)
+    return render_site_template("contact.html", idempotency_key=uuid.uuid4().hex)
 
 
 @app.route("/admin")
@@ -129,9 +344,47 @@ def admin():
     Returns admin page template with all contacts and pages
     @return:
     """
-    contacts = database.get_all_contacts()
-    pages = database.get_all_pages()
-    return render_template("admin.html", contacts=contacts, pages=pages)
+    # The reporting snapshot, with the feed resuming where it was copied. Lists are only loaded when their
+    # cached fragment is stale, which happens while rendering, so the snapshot is held until then
+    with current_site().admin_database() as (source, since):
+        contacts = LazySequence(source.get_all_contacts)
+        pages = LazySequence(source.get_all_pages)
+        versions = source.get_cache_versions()
+        return render_site_template("admin.html", contacts=contacts, pages=pages, versions=versions, since=since)
+
+
+@app.route("/admin/feed")
+def admin_feed():
+    """
+    Streams contact and page changes to the admin page as Server-Sent Events
+    @return: text/event-stream response
+    """
+    change_feed = current_site().change_feed
+    if not change_feed.accepting():
+        return "Too many admin streams", 503, {"Retry-After": "30"}
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("since")
+    # The request context, and with it the site, stays open for as long as the stream
+    return Response(
+        stream_with_context(change_feed.stream(last_event_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/admin/search")
+def search_contacts():
+    """
+    Searches contacts by free text (q), exact email and/or exact phone without decrypting the table
+    @return: json list of contacts
+    """
+    with reporting_database() as database:
+        contacts = database.search_contacts(
+            query=request.args.get("q"),
+            email=request.args.get("email"),
+            phone_number=request.args.get("phone"),
+            limit=max(1, min(request.args.get("limit", 50, type=int), 500)),
+        )
+    return jsonify(contacts)
 
 
 @app.route("/admin/notify", methods=["POST"])
@@ -153,12 +406,129 @@ def notify():
     else:
         return jsonify({"success": False, "error": "Invalid notification type"})
 
+    if request.accept_mimetypes.best == "application/json":
+        # Sent from the live admin page, which stays open instead of being reloaded
+        return jsonify({"success": success}), 200 if success else 500
     if success:
         return redirect(url_for('admin'))
     else:
         return "Failed to send notification", 500
 
 
+@app.route("/admin/compression")
+def compression_stats():
+    """
+    Returns response compression counters (ratio, bytes saved, CPU time)
+    """
+    return jsonify(compression.stats.snapshot())
+
+
+@app.route("/admin/diagnostics")
+def diagnostics():
+    """
+    Returns the slow query log with query plans
+    """
+    # Slow query tracing is opt-in: set SLOW_QUERY_MS to the latency threshold in milliseconds
+    query_tracer = current_site().query_tracer
+    entries = query_tracer.entries() if query_tracer else []
+    summary = query_tracer.summary() if query_tracer else []
+    return render_site_template("diagnostics.html", enabled=query_tracer is not None, entries=entries, summary=summary)
+
+
+@app.route("/admin/snapshot", methods=["GET", "POST"])
+def snapshot():
+    """
+    Refreshes the reporting snapshot right away (POST) and reports its state
+    @return: json stats
+    """
+    reporting_snapshot = current_site().reporting_snapshot
+    if reporting_snapshot is None:
+        return jsonify({"enabled": False})
+    if request.method == "POST":
+        reporting_snapshot.refresh()
+    return jsonify({"enabled": True, **reporting_snapshot.stats()})
+
+
+@app.route("/admin/reminders")
+def reminders():
+    """
+    Reports the appointment reminder scheduler (enabled by REMINDER_OFFSETS)
+    @return: json stats
+    """
+    reminder_scheduler = current_site().reminder_scheduler
+    if reminder_scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **reminder_scheduler.stats()})
+
+
+@app.route("/admin/digests")
+def digests():
+    """
+    Reports the outbox relay sending admin digests (enabled by DIGEST_EMAIL or DIGEST_SMS)
+    @return: json stats
+    """
+    outbox_relay = current_site().outbox_relay
+    if outbox_relay is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **outbox_relay.stats()})
+
+
+@app.route("/admin/key_rotation", methods=["GET", "POST"])
+def key_rotation():
+    """
+    Starts (POST) or reports (GET) re-encryption of stored fields with the primary key
+    @return: json progress
+    """
+    site = current_site()
+    if request.method == "POST":
+        if site.reencryption_job is None:
+            # The job gets its own connection so its batches never interleave with request transactions
+            site.reencryption_job = ReencryptionJob(
+                DatabaseOperation(site.config.database),
+                batch_size=request.form.get("batch_size", 200, type=int),
+                rows_per_second=request.form.get("rate", None, type=float),
+                archive_path=archive_path_for(site.config.database, site.name),
+            )
+        site.reencryption_job.start()
+    if site.reencryption_job is None:
+        return jsonify({"running": False, "rows": 0})
+    return jsonify(site.reencryption_job.progress())
+
+
+@app.route("/admin/archive", methods=["GET", "POST"])
+def archive_leads():
+    """
+    Starts (POST) or reports (GET) archiving of hidden leads, optionally all but the newest keep_latest,
+    followed by an incremental vacuum
+    @return: json report
+    """
+    site = current_site()
+    if request.method == "POST":
+        if site.lead_archiver is None:
+            # Own connection for the batches; removals still reach the admin feed through the site's bus
+            site.lead_archiver = LeadArchiver(
+                DatabaseOperation(site.config.database, events=site.database.events),
+                archive_path_for(site.config.database, site.name),
+                keep_latest=request.form.get("keep_latest", None, type=int),
+                batch_size=request.form.get("batch_size", 500, type=int),
+                rows_per_second=request.form.get("rate", None, type=float),
+            )
+        site.lead_archiver.start()
+    if site.lead_archiver is None:
+        return jsonify({"running": False, "archived": 0})
+    return jsonify(site.lead_archiver.report())
+
+
+@app.route("/uploads/<path:filename>")
+def upload(filename):
+    """
+    Serves a file from the current site's upload folder
+    @param filename: uploaded file name
+    @return: file response
+    """
+    return send_from_directory(os.path.abspath(current_site().upload_folder), filename)
+
+
 @app.route("/admin/edit_page/<route>", methods=["GET", "POST"])
 def edit_page(route):
     """
@@ -176,15 +546,37 @@ def edit_page(route):
 
         if image and image.filename and allowed_file(image.filename):
             filename = secure_filename(image.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filepath = os.path.join(current_site().upload_folder, filename)
             image.save(filepath)
-            image_url = url_for('static', filename=f'uploads/{filename}')
+            image_url = url_for('upload', filename=filename)
 
         updated_page = Page(route=route, title=title, content=content, image_url=image_url)
         database.update_page(updated_page)
         return redirect(url_for('admin'))
 
-    return render_template("edit_page.html", page=page)
+    return render_site_template("edit_page.html", page=page, revisions=database.get_page_revisions(route))
+
+
+@app.route("/admin/page_revision/<route>/<int:revision>")
+def page_revision(route, revision):
+    """
+    Returns a past version of a page
+    @return: json page
+    """
+    page = database.get_page_revision(route, revision)
+    if page is None:
+        return "Revision not found", 404
+    return jsonify({"revision": revision, "title": page.title, "content": page.content, "image_url": page.image_url})
+
+
+@app.route("/admin/rollback_page/<route>/<int:revision>", methods=["POST"])
+def rollback_page(route, revision):
+    """
+    Restores a past version of a page as a new revision; route table and cached fragments follow the update
+    """
+    if not database.rollback_page(route, revision):
+        return "Revision not found", 404
+    return redirect(url_for('edit_page', route=route))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,322 @@
+"""
+Reproducible load test for the routes in app.py.
+
+Seeds a throwaway database, boots the app in a separate process and drives a weighted mix of requests
+at fixed concurrency levels, then writes p50/p95/p99 latency and throughput per route to a JSON file.
+
+Usage:
+    python -m benchmarks.loadtest --leads 5000 --pages 50 --concurrency 1 8 32 --duration 10 --output load.json
+    python -m benchmarks.loadtest --baseline load.json --tolerance 0.2   # exit 1 on a p95 regression
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from cryptography.fernet import Fernet
+
+from src.database.seed import seed_database
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = "home=35,services=10,gallery=20,contact=15,appointment=15,admin=5"
+SEED_KEYS = {
+    "ENCRYPTION_KEY": Fernet.generate_key().decode(),
+    "HASH_KEY": "loadtest-hash-key",
+    "BLIND_INDEX_KEY": "loadtest-blind-index-key",
+}
+
+
+WORDS = ("deck", "patio", "roof", "kitchen", "estimate", "repair", "paint", "tile", "fence", "garden",
+         "window", "floor", "quote", "install", "weekend", "budget", "color", "cedar", "stone", "trim")
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def _lead(rng: random.Random, index: int) -> dict:
+    return {
+        "first_name": rng.choice(("Ana", "Ben", "Cara", "Dev", "Eli", "Fay")),
+        "last_name": rng.choice(("Lopez", "Smith", "Nguyen", "Okafor", "Berg", "Rossi")),
+        "phone_number": f"1800{rng.randrange(10 ** 7):07d}",
+        "email": f"lead{index}-{rng.randrange(10 ** 9)}@example.com",
+        "subject": _words(rng, 3),
+        "message": _words(rng, 25),
+        "visible": 1,
+    }
+
+
+def parse_mix(spec: str) -> list[tuple[str, int]]:
+    """
+    Parses "route=weight,..." into a list of (scenario, weight)
+    @param spec: mix specification
+    @return: list of tuples
+    """
+    mix = []
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}, expected one of {sorted(SCENARIOS)}")
+        mix.append((name.strip(), int(weight)))
+    return mix
+
+
+def _get(path: str):
+    return lambda rng, counter: ("GET", path, None, {})
+
+
+def _contact(rng: random.Random, counter: int):
+    body = urllib.parse.urlencode(_lead(rng, counter))
+    return "POST", "/ContactMe", body, {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+def _appointment(rng: random.Random, counter: int):
+    body = json.dumps({
+        "date": f"2026-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+        "event_name": _words(rng, 2),
+        "phone_number": f"1800{rng.randrange(10 ** 7):07d}",
+        "location": _words(rng, 2),
+        "message": _words(rng, 10),
+    })
+    return "POST", "/save_appointment", body, {"Content-Type": "application/json"}
+
+
+SCENARIOS = {
+    "home": _get("/"),
+    "services": _get("/services"),
+    "gallery": _get("/gallery"),
+    "appointments": _get("/appointments"),
+    "contact": _contact,
+    "appointment": _appointment,
+    "admin": _get("/admin"),
+}
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """
+    Nearest-rank percentile
+    @param sorted_values: ascending values
+    @param fraction: 0..1
+    @return: float, 0.0 for an empty list
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: list[tuple[str, float, int]], seconds: float) -> dict:
+    """
+    Aggregates (scenario, latency, status) samples
+    @param samples: recorded requests
+    @param seconds: wall time of the run
+    @return: dict with overall and per scenario statistics
+    """
+    def stats(latencies: list, errors: int) -> dict:
+        latencies = sorted(latencies)
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": len(latencies) / seconds if seconds else 0.0,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+
+    per_route = {}
+    for name, latency, status in samples:
+        entry = per_route.setdefault(name, ([], [0]))
+        entry[0].append(latency)
+        if status >= 400:
+            entry[1][0] += 1
+    return {
+        "overall": stats([s[1] for s in samples], sum(1 for s in samples if s[2] >= 400)),
+        "routes": {name: stats(latencies, errors[0]) for name, (latencies, errors) in sorted(per_route.items())},
+    }
+
+
+def run_level(port: int, mix: list, concurrency: int, duration: float, seed: int) -> dict:
+    """
+    Drives the mix with a fixed number of concurrent clients for a fixed time
+    @param port: server port
+    @param mix: list of (scenario, weight)
+    @param concurrency: number of client threads
+    @param duration: seconds
+    @param seed: base random seed, each client derives its own
+    @return: summary dict
+    """
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    samples = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(worker: int) -> None:
+        rng = random.Random(seed * 1000 + worker)
+        local = []
+        counter = worker * 10 ** 7
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            counter += 1
+            method, path, body, headers = SCENARIOS[name](rng, counter)
+            started = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                connection.close()
+            except (OSError, http.client.HTTPException):
+                status = 599
+            local.append((name, time.perf_counter() - started, status))
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    result = summarize(samples, time.perf_counter() - started)
+    result["concurrency"] = concurrency
+    return result
+
+
+def boot_server(workdir: str, database_path: str, port: int) -> subprocess.Popen:
+    """
+    Starts app.py in a child process and waits until it accepts connections
+    @param workdir: working directory (uploads, logs, key files)
+    @param database_path: seeded database
+    @param port: port to listen on
+    @return: the server process
+    """
+    env = dict(os.environ, **SEED_KEYS)
+    env.update({
+        "PYTHONPATH": REPO_ROOT,
+        "DATABASE_FILE": database_path,
+        "LOG_FILE": os.path.join(workdir, "app.log"),
+        # The load generator is a single client IP, so the per-IP budget must not throttle it
+        "RATE_LIMIT_IP_PER_MINUTE": "100000000",
+        "RATE_LIMIT_IP_BURST": "100000000",
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-c", f"from app import app; app.run(port={port}, threaded=True)"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("app.py exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("app.py did not start listening within 60s")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Lists routes whose p95 regressed by more than the tolerance at the same concurrency
+    @param result: current report
+    @param baseline: earlier report
+    @param tolerance: allowed relative increase, e.g. 0.2 for 20%
+    @return: list of human readable regressions
+    """
+    regressions = []
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in result["levels"]:
+        old_level = previous.get(level["concurrency"])
+        if not old_level:
+            continue
+        for route, stats in level["routes"].items():
+            old = old_level["routes"].get(route)
+            if old and old["p95_ms"] and stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"c={level['concurrency']} {route}: p95 {old['p95_ms']:.1f}ms -> {stats['p95_ms']:.1f}ms"
+                )
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test app.py routes")
+    parser.add_argument("--leads", type=int, default=1000)
+    parser.add_argument("--appointments", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted scenarios, default {DEFAULT_MIX}")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of unrecorded traffic first")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=5077)
+    parser.add_argument("--output", default="loadtest.json")
+    parser.add_argument("--baseline", help="earlier report to compare p95 against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    os.environ.update(SEED_KEYS)
+    with tempfile.TemporaryDirectory() as workdir:
+        database_path = os.path.join(workdir, "loadtest.db")
+        seed_started = time.perf_counter()
+        seed_database(database_path, args.leads, args.appointments, args.pages, args.seed)
+        seed_seconds = time.perf_counter() - seed_started
+        server = boot_server(workdir, database_path, args.port)
+        try:
+            if args.warmup:
+                run_level(args.port, mix, max(args.concurrency), args.warmup, args.seed - 1)
+            levels = []
+            for concurrency in args.concurrency:
+                level = run_level(args.port, mix, concurrency, args.duration, args.seed)
+                levels.append(level)
+                overall = level["overall"]
+                print(f"c={concurrency:<4} {overall['throughput_rps']:8.1f} req/s  p50 {overall['p50_ms']:7.1f}ms"
+                      f"  p95 {overall['p95_ms']:7.1f}ms  p99 {overall['p99_ms']:7.1f}ms  errors {overall['errors']}")
+        finally:
+            server.terminate()
+            server.wait(10)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "dataset": {"leads": args.leads, "appointments": args.appointments, "pages": args.pages,
+                    "seed": args.seed, "seed_seconds": seed_seconds},
+        "mix": dict(mix),
+        "duration": args.duration,
+        "levels": levels,
+    }
+    with open(args.output, "w", encoding="utf8") as output:
+        json.dump(report, output, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
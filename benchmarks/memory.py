@@ -0,0 +1,142 @@
+"""
+Memory and allocation benchmark for listing whole tables.
+
+Seeds an in-memory database with --rows leads, appointments and pages, then measures for each listing
+method the memory retained by the returned list, the peak during the call and the number of live
+allocations, using tracemalloc. The same rows held in the previous shapes (a dict per contact, plain
+classes with a per-instance __dict__) are measured alongside for comparison.
+
+Usage:
+    python -m benchmarks.memory --rows 100000
+"""
+import argparse
+import gc
+import json
+import logging
+import sqlite3
+import time
+import tracemalloc
+from datetime import datetime
+
+from src.database.database import DatabaseOperation, PAGE_COLUMNS
+from src.database.seed import Seeder
+
+LISTED_DATE = datetime(2026, 3, 2, 10, 30)
+
+
+class _DictPage:
+    """Plain class with a per-instance __dict__, the shape Page had before"""
+
+    def __init__(self, route, title, content, image_url="", content_html="", excerpt="", content_hash="", images=()):
+        self.route = route
+        self.title = title
+        self.content = content
+        self.image_url = image_url
+        self.content_html = content_html
+        self.excerpt = excerpt
+        self.content_hash = content_hash
+        self.images = images
+
+
+class _DictAppointment:
+    """Plain class with a per-instance __dict__, the shape Appointment had before"""
+
+    def __init__(self, date, event_name, phone_number, location, message):
+        self.date = date
+        self.event_name = event_name
+        self.phone_number = phone_number
+        self.location = location
+        self.message = message
+
+
+CONTACT_KEYS = ("first_name", "last_name", "phone_number", "email", "subject", "message")
+
+
+def measure(function) -> dict:
+    """
+    Calls function and measures the memory its result keeps alive
+    @param function: callable returning a list
+    @return: dict with rows, retained and peak MiB, live allocations and seconds
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    rows = len(result)
+    del result
+    return {
+        "rows": rows,
+        "retained_mib": round(current / 2 ** 20, 2),
+        "peak_mib": round(peak / 2 ** 20, 2),
+        "allocations": blocks,
+        "seconds": round(seconds, 3),
+    }
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Memory used by the listing methods")
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args(argv)
+    logging.disable(logging.CRITICAL)
+
+    database = DatabaseOperation(sqlite_connection=sqlite3.connect(":memory:"))
+    seeder = Seeder(database, seed=1)
+    seeder.create_tables()
+    seeder.seed_leads(args.rows)
+    seeder.seed_pages(args.rows - 3)
+    seeder.seed_appointments(args.rows)
+    # get_appointments lists one date, so put every appointment on it
+    database.connection.execute("UPDATE appointments SET date = ?", (LISTED_DATE.isoformat(),))
+    database.connection.commit()
+
+    decrypt = database.encryption.decrypt
+    connection = database.connection
+
+    def legacy_contacts():
+        rows = connection.execute(
+            "select first_name, last_name, phone_number, email, subject, message from leads where visible = 1"
+        ).fetchall()
+        contacts = []
+        for row in rows:
+            contact = dict(zip(CONTACT_KEYS, row))
+            contact["email"] = decrypt(contact["email"])
+            contact["phone_number"] = decrypt(contact["phone_number"])
+            contacts.append(contact)
+        return contacts
+
+    def legacy_pages():
+        # The same columns get_all_pages loads, so only the object shape differs
+        rows = connection.execute(f"select {PAGE_COLUMNS} from pages").fetchall()
+        return [_DictPage(*row[:7], tuple(json.loads(row[7]))) for row in rows]
+
+    def legacy_appointments():
+        rows = connection.execute(
+            "select date, event_name, phone_number, location, message from appointments where date = ?",
+            (LISTED_DATE.isoformat(),),
+        ).fetchall()
+        return [_DictAppointment(datetime.fromisoformat(r[0]), r[1], decrypt(r[2]), r[3], r[4]) for r in rows]
+
+    cases = (
+        ("get_all_contacts (dict per row)", legacy_contacts),
+        ("get_all_contacts", database.get_all_contacts),
+        ("get_all_pages (__dict__ class)", legacy_pages),
+        ("get_all_pages", database.get_all_pages),
+        ("get_appointments (__dict__ class)", legacy_appointments),
+        ("get_appointments", lambda: database.get_appointments(LISTED_DATE)),
+    )
+    print(f"{'':36}{'rows':>8}{'retained MiB':>14}{'peak MiB':>10}{'allocations':>13}{'seconds':>9}")
+    for name, function in cases:
+        result = measure(function)
+        print(f"{name:36}{result['rows']:>8}{result['retained_mib']:>14}{result['peak_mib']:>10}"
+              f"{result['allocations']:>13}{result['seconds']:>9}")
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Microbenchmarks for the DatabaseOperation, EncryptionService and hashing hot paths.
+
+Each benchmark is a function decorated with @bench taking (benchmark, size); it prepares its data and
+hands the code under test to benchmark(), which times it over several rounds, pytest-benchmark style.
+Database fixtures are built on tests.database_mock.MockDatabase, so they use the same in-memory schema
+as the unit tests.
+
+Usage:
+    python -m benchmarks.micro --sizes 100 1000 10000 --output micro.json
+    python -m benchmarks.micro --baseline micro.json --threshold 0.15   # exit 1 on a regression
+    python -m benchmarks.micro -k encrypt                                # only matching benchmarks
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from cryptography.fernet import Fernet
+
+from src.appointment import Appointment
+from src.encryption import EncryptionService
+from src.hashing import HashingService, get_hash
+from src.page import Page
+from tests.database_mock import MockDatabase
+
+BENCHMARKS = {}
+DEFAULT_SIZES = (100, 1000, 10000)
+START = datetime(2026, 1, 1, 9, 0)
+
+
+def bench(function):
+    """
+    Registers a benchmark function
+    @param function: callable(benchmark, size)
+    @return: the function
+    """
+    BENCHMARKS[function.__name__.removeprefix("bench_")] = function
+    return function
+
+
+class Benchmark:
+    """
+    Times a callable over a number of rounds after a warm-up and keeps per round statistics.
+    The callable receives the round number so writes can use unique values.
+    """
+
+    def __init__(self, rounds: int = 50, warmup: int = 3, min_time: float = 0.000005) -> None:
+        self.rounds = rounds
+        self.warmup = warmup
+        self.min_time = min_time
+        self.result = None
+
+    def __call__(self, function, operations: int = 1) -> None:
+        """
+        Measures function
+        @param function: callable(round_number)
+        @param operations: items processed per call, used to report per item time for batch benchmarks
+        @return: null
+        """
+        for i in range(self.warmup):
+            function(-1 - i)
+        timings = []
+        for i in range(self.rounds):
+            started = time.perf_counter()
+            function(i)
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        self.result = {
+            "rounds": self.rounds,
+            "operations": operations,
+            "min_us": min(timings) * 1e6,
+            "median_us": median * 1e6,
+            "mean_us": statistics.fmean(timings) * 1e6,
+            "stddev_us": statistics.pstdev(timings) * 1e6,
+            "per_operation_us": median / operations * 1e6,
+            "ops_per_second": operations / max(median, self.min_time),
+        }
+
+
+@contextmanager
+def mock_database():
+    """
+    Yields a DatabaseOperation on the MockDatabase in-memory schema
+    @return: DatabaseOperation
+    """
+    fixture = MockDatabase()
+    fixture.setUp()
+    try:
+        yield fixture.db_operation
+    finally:
+        fixture.tearDown()
+
+
+def seed_leads(database, count: int) -> None:
+    encryption = database.encryption
+    database.connection.executemany(
+        "INSERT INTO leads (first_name, last_name, phone_number, email, email_hash, subject, message, visible)"
+        " VALUES ('First', 'Last', ?, ?, ?, 'Subject', 'A message about a project', 1)",
+        (
+            (encryption.encrypt(f"1800{i:07d}"), encryption.encrypt(_email(i)), database.hashing.hash(_email(i)))
+            for i in range(count)
+        ),
+    )
+    database.connection.commit()
+
+
+def seed_appointments(database, count: int) -> None:
+    database.connection.executemany(
+        "INSERT INTO appointments (date, event_name, phone_number, location, message) VALUES (?, ?, ?, ?, ?)",
+        (
+            ((START + timedelta(hours=i)).isoformat(), "Event", database.encryption.encrypt(f"1800{i:07d}"),
+             "Location", "Message")
+            for i in range(count)
+        ),
+    )
+    database.connection.commit()
+
+
+def seed_pages(database, count: int) -> None:
+    database.connection.executemany(
+        "INSERT INTO pages (route, title, content, image_url) VALUES (?, ?, ?, '')",
+        ((f"page-{i}", f"Page {i}", "content " * 50) for i in range(count)),
+    )
+    database.connection.commit()
+
+
+def _email(i: int) -> str:
+    return f"lead{i}@example.com"
+
+
+def _lead(i: int) -> dict:
+    return {"first_name": "First", "last_name": "Last", "phone_number": f"1900{i:07d}",
+            "email": f"new{i}@example.com", "subject": "Subject", "message": "Message", "visible": 1}
+
+
+@bench
+def bench_insert_contact_data(benchmark, size):
+    with mock_database() as database:
+        seed_leads(database, size)
+        benchmark(lambda i: database.insert_contact_data(_lead(i + size)))
+
+
+@bench
+def bench_get_contact(benchmark, size):
+    with mock_database() as database:
+        seed_leads(database, size)
+        benchmark(lambda i: database.get_contact(_email(abs(i) * 7919 % size)))
+
+
+@bench
+def bench_get_all_contacts(benchmark, size):
+    with mock_database() as database:
+        seed_leads(database, size)
+        benchmark(lambda i: database.get_all_contacts(), operations=size)
+
+
+@bench
+def bench_insert_appointment(benchmark, size):
+    with mock_database() as database:
+        seed_appointments(database, size)
+        benchmark(lambda i: database.insert_appointment(
+            Appointment(START - timedelta(minutes=i + 10), "Event", "18005550100", "Location", "Message")
+        ))
+
+
+@bench
+def bench_get_appointments(benchmark, size):
+    with mock_database() as database:
+        seed_appointments(database, size)
+        benchmark(lambda i: database.get_appointments(START + timedelta(hours=abs(i) * 7919 % size)))
+
+
+@bench
+def bench_insert_page(benchmark, size):
+    with mock_database() as database:
+        seed_pages(database, size)
+        benchmark(lambda i: database.insert_page(Page(f"new-{i + size}", "Title", "content " * 50)))
+
+
+@bench
+def bench_get_page_by_route(benchmark, size):
+    with mock_database() as database:
+        seed_pages(database, size)
+        benchmark(lambda i: database.get_page_by_route(f"page-{abs(i) * 7919 % size}"))
+
+
+@bench
+def bench_get_all_pages(benchmark, size):
+    with mock_database() as database:
+        seed_pages(database, size)
+        benchmark(lambda i: database.get_all_pages(), operations=size)
+
+
+@bench
+def bench_encrypt(benchmark, size):
+    encryption = EncryptionService(Fernet.generate_key())
+    benchmark(lambda i: encryption.encrypt("someone@example.com"))
+
+
+@bench
+def bench_decrypt(benchmark, size):
+    encryption = EncryptionService(Fernet.generate_key())
+    token = encryption.encrypt("someone@example.com")
+    benchmark(lambda i: encryption.decrypt(token))
+
+
+@bench
+def bench_encrypt_batch(benchmark, size):
+    encryption = EncryptionService(Fernet.generate_key())
+    values = [_email(i) for i in range(size)]
+    benchmark(lambda i: [encryption.encrypt(value) for value in values], operations=size)
+
+
+@bench
+def bench_decrypt_batch(benchmark, size):
+    encryption = EncryptionService(Fernet.generate_key())
+    tokens = [encryption.encrypt(_email(i)) for i in range(size)]
+    benchmark(lambda i: [encryption.decrypt(token) for token in tokens], operations=size)
+
+
+@bench
+def bench_get_hash(benchmark, size):
+    benchmark(lambda i: get_hash("someone@example.com"))
+
+
+@bench
+def bench_hash_many(benchmark, size):
+    hashing = HashingService(b"benchmark-key")
+    values = [_email(i) for i in range(size)]
+    benchmark(lambda i: hashing.hash_many(values), operations=size)
+
+
+@bench
+def bench_page_construction(benchmark, size):
+    benchmark(lambda i: [Page(f"page-{n}", "Title", "Content", "") for n in range(size)], operations=size)
+
+
+@bench
+def bench_appointment_construction(benchmark, size):
+    benchmark(
+        lambda i: [Appointment(START, "Event", "18005550100", "Location", "Message") for n in range(size)],
+        operations=size,
+    )
+
+
+def run(sizes: list, rounds: int, pattern: str = None) -> list[dict]:
+    """
+    Runs every registered benchmark at every size
+    @param sizes: data sizes
+    @param rounds: timed rounds per benchmark
+    @param pattern: optional substring filter on benchmark names
+    @return: list of result dicts with name and size
+    """
+    results = []
+    for name, function in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        for size in sizes:
+            benchmark = Benchmark(rounds=rounds)
+            function(benchmark, size)
+            results.append({"name": name, "size": size, **benchmark.result})
+            print(f"{name:<28} n={size:<7} median {benchmark.result['median_us']:11.1f}us"
+                  f"  per op {benchmark.result['per_operation_us']:9.2f}us")
+    return results
+
+
+def compare(results: list, baseline: list, threshold: float) -> list[str]:
+    """
+    Lists benchmarks whose median grew by more than the threshold
+    @param results: current results
+    @param baseline: stored results
+    @param threshold: allowed relative slowdown, e.g. 0.15 for 15%
+    @return: list of human readable regressions
+    """
+    previous = {(entry["name"], entry["size"]): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        old = previous.get((entry["name"], entry["size"]))
+        if old and entry["median_us"] > old["median_us"] * (1 + threshold):
+            regressions.append(
+                f"{entry['name']} n={entry['size']}: {old['median_us']:.1f}us -> {entry['median_us']:.1f}us"
+                f" (+{(entry['median_us'] / old['median_us'] - 1) * 100:.0f}%)"
+            )
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the database, encryption and hashing code")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks whose name contains this")
+    parser.add_argument("--output", default="micro.json")
+    parser.add_argument("--baseline", help="earlier results to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    # The code under test logs every call; keep that out of the measurements
+    logging.disable(logging.CRITICAL)
+    results = run(args.sizes, args.rounds, args.pattern)
+    with open(args.output, "w", encoding="utf8") as output:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }, output, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as baseline_file:
+            regressions = compare(results, json.load(baseline_file)["results"], args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
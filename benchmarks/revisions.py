@@ -0,0 +1,149 @@
+"""
+Storage and latency benchmark for the page revision history.
+
+Applies --edits realistic admin edits (a few paragraphs changed, added or removed, now and then a new
+title or image) to one page, then reports the bytes the history takes compared with storing every
+version in full, plain and zlib compressed, the cost of update_page, and how long rebuilding and rolling
+back to past revisions takes, including the worst case at the end of a delta chain.
+
+Usage:
+    python -m benchmarks.revisions --edits 10000 --snapshot-every 16 32 64
+"""
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import statistics
+import time
+import zlib
+
+from src.database.database import DatabaseOperation
+from src.database.revisions import PAGE_REVISIONS_TABLE_NAME
+from src.database.seed import WORDS
+from src.page import Page
+
+ROUTE = "services"
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randrange(20, 80))).capitalize() + "."
+
+
+def generate_edits(seed: int, edits: int, paragraphs: int = 40):
+    """
+    Yields successive versions of a page
+    @param seed: random seed
+    @param edits: number of versions after the first
+    @param paragraphs: paragraphs of the first version
+    @return: generator of Page
+    """
+    rng = random.Random(seed)
+    title, image_url = "Our Services", "/uploads/services.png"
+    body = [_paragraph(rng) for _ in range(paragraphs)]
+    yield Page(ROUTE, title, "\n".join(body), image_url)
+    for edit in range(edits):
+        for _ in range(rng.randrange(1, 4)):
+            action = rng.random()
+            position = rng.randrange(len(body))
+            if action < 0.7:
+                words = body[position].split()
+                words[rng.randrange(len(words))] = rng.choice(WORDS)
+                body[position] = " ".join(words)
+            elif action < 0.85 or len(body) < 10:
+                body.insert(position, _paragraph(rng))
+            else:
+                del body[position]
+        if rng.random() < 0.02:
+            title = f"Our Services {edit}"
+        if rng.random() < 0.01:
+            image_url = f"/uploads/services-{edit}.png"
+        yield Page(ROUTE, title, "\n".join(body), image_url)
+
+
+def run(edits: int, snapshot_every: int, seed: int, samples: int) -> dict:
+    """
+    Writes every version through update_page and measures storage and read back
+    @return: dict of results
+    """
+    database = DatabaseOperation(sqlite_connection=sqlite3.connect(":memory:"))
+    database.create_pages_table("pages")
+    database.create_cache_versions_table()
+    database.create_page_revisions_table()
+    database.snapshot_every = snapshot_every
+
+    full_bytes = compressed_bytes = 0
+    write_seconds = []
+    versions = generate_edits(seed, edits)
+    first = next(versions)
+    database.insert_page(first)
+    for page in versions:
+        encoded = page_bytes(page)
+        full_bytes += len(encoded)
+        compressed_bytes += len(zlib.compress(encoded, 9))
+        started = time.perf_counter()
+        database.update_page(page)
+        write_seconds.append(time.perf_counter() - started)
+
+    stored = database.connection.execute(
+        f"select sum(length(data)), count(*), sum(1 - is_delta) from {PAGE_REVISIONS_TABLE_NAME}"
+    ).fetchone()
+    head = stored[1]
+    rng = random.Random(seed)
+    read_seconds = []
+    for revision in rng.sample(range(1, head + 1), min(samples, head)):
+        started = time.perf_counter()
+        database.get_page_revision(ROUTE, revision)
+        read_seconds.append(time.perf_counter() - started)
+    # The last revision before the newest snapshot has the longest chain to replay
+    worst = database.connection.execute(
+        f"select max(revision) - 1 from {PAGE_REVISIONS_TABLE_NAME} where route = ? and is_delta = 0", (ROUTE,)
+    ).fetchone()[0] or head
+    started = time.perf_counter()
+    database.get_page_revision(ROUTE, worst)
+    worst_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    database.rollback_page(ROUTE, head // 2)
+    rollback_seconds = time.perf_counter() - started
+    database.close()
+    return {
+        "edits": edits,
+        "snapshot_every": snapshot_every,
+        "revisions": head,
+        "snapshots": stored[2],
+        "history_kib": round(stored[0] / 1024, 1),
+        "full_copies_kib": round(full_bytes / 1024, 1),
+        "compressed_copies_kib": round(compressed_bytes / 1024, 1),
+        "bytes_per_revision": round(stored[0] / head, 1),
+        "update_p50_ms": round(statistics.median(write_seconds) * 1000, 3),
+        "update_p95_ms": round(statistics.quantiles(write_seconds, n=20)[-1] * 1000, 3),
+        "rebuild_p50_ms": round(statistics.median(read_seconds) * 1000, 3),
+        "rebuild_worst_ms": round(worst_seconds * 1000, 3),
+        "rollback_ms": round(rollback_seconds * 1000, 3),
+    }
+
+
+def page_bytes(page: Page) -> bytes:
+    return json.dumps([page.title, page.content, page.image_url]).encode("utf-8")
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Storage growth and latency of the page revision history")
+    parser.add_argument("--edits", type=int, default=10000)
+    parser.add_argument("--snapshot-every", type=int, nargs="+", default=[32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=500, help="random revisions rebuilt")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+    logging.disable(logging.CRITICAL)
+
+    results = [run(args.edits, every, args.seed, args.samples) for every in args.snapshot_every]
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
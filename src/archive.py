@@ -0,0 +1,517 @@
+"""
+Module for archiving hidden and aged leads and compacting the live database.
+
+disable_contact only hides a lead, so without archiving the leads table, its email_hash index, the
+search indexes and the database file keep every lead ever submitted. LeadArchiver moves hidden leads,
+and optionally every visible lead but the newest keep_latest, into a separate SQLite archive database
+in batches. Each batch is stored as one zlib compressed JSON blob, with the encrypted columns left
+encrypted, and an index of lead id and email hash points into the batches. The archive commit comes
+first and the live delete second, so a crash between the two only leaves a batch that is archived
+twice, never a lost lead. The delete triggers drop the rows from the search indexes, and the full
+text index is merged afterwards so its tombstones do not keep the space.
+
+Freed pages are returned to the file system by IncrementalVacuum, which runs
+PRAGMA incremental_vacuum a few pages at a time with pauses in between, instead of a VACUUM that
+rewrites and locks the whole file. New database files are created with auto_vacuum=INCREMENTAL. An
+existing file is converted once with the enable-incremental command, which does run a full VACUUM.
+On PostgreSQL, autovacuum reclaims the space and the vacuum step is skipped. The archive itself is
+always a SQLite file, one per site.
+
+Archived leads keep the ciphertext they had when archived. After an encryption key rotation, run the
+re-encryption job with the archive (python -m src.key_rotation run ... --archive <file>) before
+dropping the old key, or archived leads can no longer be decrypted.
+
+Leads carry no timestamp, so age is measured by insertion order (id).
+
+Usage:
+    python -m src.archive run contacts.db --keep-latest 50000 --batch-size 500 --rate 5000
+    python -m src.archive vacuum contacts.db --pages 256 --pause 0.05
+    python -m src.archive enable-incremental contacts.db
+    python -m src.archive benchmark --leads 100000 --hidden 0.6
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+
+from src.database.backends import DatabaseError, is_postgres_url
+from src.database.database import DatabaseOperation
+from src.database.seed import seed_database
+from src.events import CONTACT_CHANGED
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCHES_TABLE_NAME = "archived_lead_batches"
+ARCHIVE_INDEX_TABLE_NAME = "archived_leads"
+ARCHIVE_DATABASE_ENV = "ARCHIVE_DATABASE"
+LEAD_COLUMNS = ("id", "first_name", "last_name", "phone_number", "email", "email_hash", "subject", "message",
+                "visible")
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def archive_path_for(database_file: str, site: str = None) -> str:
+    """
+    Returns the default archive file of a database, e.g. contacts-archive.db next to contacts.db.
+    A PostgreSQL database gets <site>-archive.db, named after the site or else the database in the URL,
+    so tenants never share an archive.
+    @param database_file: sqlite database file or postgresql:// URL; $ARCHIVE_DATABASE takes precedence,
+    with {site} replaced by the site name
+    @param site: name of the site the database belongs to
+    @return: str
+    """
+    if os.environ.get(ARCHIVE_DATABASE_ENV):
+        return os.environ[ARCHIVE_DATABASE_ENV].replace("{site}", site or "default")
+    if is_postgres_url(database_file):
+        name = site or urlsplit(database_file).path.strip("/") or "leads"
+        return f"{name}-archive.db"
+    root, extension = os.path.splitext(database_file)
+    return f"{root}-archive{extension or '.db'}"
+
+
+def file_stats(database: DatabaseOperation) -> dict:
+    """
+    Returns the size of a SQLite database and its free pages
+    @param database: database to inspect
+    @return: dict with bytes, free_bytes and auto_vacuum, empty on PostgreSQL
+    """
+    if database.backend.name != "sqlite":
+        return {}
+    connection = database.connection
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    return {
+        "bytes": connection.execute("PRAGMA page_count").fetchone()[0] * page_size,
+        "free_bytes": connection.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+        "auto_vacuum": connection.execute("PRAGMA auto_vacuum").fetchone()[0],
+    }
+
+
+def scan_seconds(database: DatabaseOperation, repeat: int = 3) -> float:
+    """
+    Times the table scan behind get_all_contacts, without building or decrypting rows, best of repeat
+    @param database: database to scan
+    @param repeat: scans timed
+    @return: seconds
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        database.connection.execute("select count(*) from leads where visible = 1").fetchone()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def enable_incremental_vacuum(database: DatabaseOperation) -> bool:
+    """
+    Switches an existing SQLite database to auto_vacuum=INCREMENTAL. Only an empty file takes the
+    setting directly; otherwise this runs one full VACUUM, which locks and rewrites the whole file.
+    @param database: database to convert
+    @return: True if it was converted, False if it already was incremental or is not SQLite
+    """
+    if database.backend.name != "sqlite":
+        return False
+    connection = database.connection
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return False
+    connection.commit()
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    connection.execute("VACUUM")
+    logger.info("Database switched to incremental auto vacuum")
+    return True
+
+
+class IncrementalVacuum:
+    """
+    Returns free pages to the file system in small steps so writers are only briefly blocked
+    """
+
+    def __init__(self, database: DatabaseOperation, pages_per_step: int = 256, pause_seconds: float = 0.05,
+                 max_seconds: float = None) -> None:
+        """
+        @param database: SQLite database with auto_vacuum=INCREMENTAL
+        @param pages_per_step: pages freed per statement, each step holds the write lock
+        @param pause_seconds: sleep between steps, leaving room for live writes
+        @param max_seconds: stop after this long, the rest is freed on the next run
+        """
+        self.database = database
+        self.pages_per_step = pages_per_step
+        self.pause_seconds = pause_seconds
+        self.max_seconds = max_seconds
+        self._stop = threading.Event()
+
+    def run(self) -> dict:
+        """
+        Frees pages until the free list is empty, max_seconds passed or stop() was called
+        @return: dict with reclaimed_bytes, steps, seconds and the bytes still free
+        """
+        stats = file_stats(self.database)
+        if not stats or stats["auto_vacuum"] != AUTO_VACUUM_INCREMENTAL:
+            logger.warning("Incremental vacuum is not enabled for this database")
+            return {"enabled": False, "reclaimed_bytes": 0, "steps": 0, "seconds": 0.0}
+        connection = self.database.connection
+        started = time.perf_counter()
+        steps = 0
+        while not self._stop.is_set():
+            if connection.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+                break
+            if self.max_seconds is not None and time.perf_counter() - started > self.max_seconds:
+                break
+            # execute() would stop after the first page; executescript steps the pragma to completion
+            connection.executescript(f"PRAGMA incremental_vacuum({int(self.pages_per_step)})")
+            steps += 1
+            if self.pause_seconds:
+                self._stop.wait(self.pause_seconds)
+        after = file_stats(self.database)
+        result = {
+            "enabled": True,
+            "reclaimed_bytes": stats["bytes"] - after["bytes"],
+            "free_bytes": after["free_bytes"],
+            "steps": steps,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        logger.info("Incremental vacuum: %s", result)
+        return result
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class LeadArchiver:
+    """
+    Moves hidden and aged leads into the compressed archive in batches, then compacts the live database
+    """
+
+    def __init__(self, database: DatabaseOperation, archive_path: str, keep_latest: int = None,
+                 batch_size: int = 500, rows_per_second: float = None, vacuum: IncrementalVacuum = None) -> None:
+        """
+        @param database: live database; the job should own this connection
+        @param archive_path: sqlite file of the archive, created if missing
+        @param keep_latest: also archive visible leads except the newest keep_latest, None to keep all of them
+        @param batch_size: leads per archive batch and transaction
+        @param rows_per_second: optional cap so the job does not starve live writes
+        @param vacuum: compaction run after archiving, defaults to IncrementalVacuum on the live database
+        """
+        self.database = database
+        self.archive_path = archive_path
+        self.keep_latest = keep_latest
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+        self.vacuum = vacuum or IncrementalVacuum(database)
+        self._archive = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._report = {"running": False, "archived": 0, "batches": 0}
+
+    @property
+    def archive(self) -> sqlite3.Connection:
+        if self._archive is None:
+            self._archive = sqlite3.connect(self.archive_path, check_same_thread=False)
+            self._archive.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._archive.execute(
+                f"create table if not exists {ARCHIVE_BATCHES_TABLE_NAME}("
+                "id INTEGER PRIMARY KEY,"
+                "first_lead_id INTEGER NOT NULL,"
+                "last_lead_id INTEGER NOT NULL,"
+                "rows INTEGER NOT NULL,"
+                "raw_bytes INTEGER NOT NULL,"
+                "archived_at INTEGER NOT NULL,"
+                "data BLOB NOT NULL)"
+            )
+            self._migrate_index()
+            # Keyed by batch as well: leads.id is not AUTOINCREMENT, so once the newest leads are archived
+            # their ids are handed out again and the same lead_id can name different leads
+            self._archive.execute(
+                f"create table if not exists {ARCHIVE_INDEX_TABLE_NAME}("
+                "lead_id INTEGER NOT NULL,"
+                "email_hash TEXT,"
+                "batch_id INTEGER NOT NULL,"
+                "PRIMARY KEY (lead_id, batch_id))"
+            )
+            self._archive.execute(
+                f"create index if not exists {ARCHIVE_INDEX_TABLE_NAME}_email_hash"
+                f" on {ARCHIVE_INDEX_TABLE_NAME}(email_hash)"
+            )
+            self._archive.commit()
+        return self._archive
+
+    def _migrate_index(self) -> None:
+        """
+        Rebuilds an index table keyed by lead_id alone, created before lead ids could repeat in the archive
+        """
+        primary_key = [row[1] for row in self._archive.execute(f"PRAGMA table_info({ARCHIVE_INDEX_TABLE_NAME})")
+                       if row[5]]
+        if primary_key != ["lead_id"]:
+            return
+        self._archive.execute(f"ALTER TABLE {ARCHIVE_INDEX_TABLE_NAME} RENAME TO {ARCHIVE_INDEX_TABLE_NAME}_old")
+        self._archive.execute(f"DROP INDEX IF EXISTS {ARCHIVE_INDEX_TABLE_NAME}_email_hash")
+        self._archive.execute(
+            f"create table {ARCHIVE_INDEX_TABLE_NAME}(lead_id INTEGER NOT NULL, email_hash TEXT,"
+            " batch_id INTEGER NOT NULL, PRIMARY KEY (lead_id, batch_id))"
+        )
+        self._archive.execute(
+            f"INSERT INTO {ARCHIVE_INDEX_TABLE_NAME} (lead_id, email_hash, batch_id)"
+            f" select lead_id, email_hash, batch_id from {ARCHIVE_INDEX_TABLE_NAME}_old"
+        )
+        self._archive.execute(f"DROP TABLE {ARCHIVE_INDEX_TABLE_NAME}_old")
+        logger.info("Archive index %s is now keyed by lead and batch", ARCHIVE_INDEX_TABLE_NAME)
+
+    def _cutoff(self) -> int:
+        """
+        Returns the highest visible lead id that is archived, 0 when every visible lead is kept
+        """
+        if self.keep_latest is None:
+            return 0
+        row = self.database.connection.execute(
+            "select id from leads where visible = 1 order by id desc limit 1 offset ?", (self.keep_latest,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def run(self) -> dict:
+        """
+        Archives every matching lead, compacts the live database and reports what it gained
+        @return: report dict
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._report = {"running": True, "archived": 0, "batches": 0}
+        before = file_stats(self.database)
+        scan_before = scan_seconds(self.database)
+        try:
+            self._archive_leads(self._cutoff())
+            if self._report["archived"] and not self._stop.is_set():
+                # Deleted rows only leave tombstones in the full text index until it is merged
+                self.database.backend.optimize_text_index(self.database.connection)
+                self.database.connection.commit()
+            vacuum = self.vacuum.run() if not self._stop.is_set() else {}
+        except DatabaseError as error:
+            logger.error("Lead archiving failed: %s", error)
+            vacuum = {}
+        after = file_stats(self.database)
+        with self._lock:
+            report = self._report
+            report.update({
+                "running": False,
+                "seconds": round(time.perf_counter() - started, 3),
+                "bytes_before": before.get("bytes"),
+                "bytes_after": after.get("bytes"),
+                "reclaimed_bytes": vacuum.get("reclaimed_bytes", 0),
+                "free_bytes": after.get("free_bytes"),
+                "scan_ms_before": round(scan_before * 1000, 3),
+                "scan_ms_after": round(scan_seconds(self.database) * 1000, 3),
+                "archive_bytes": os.path.getsize(self.archive_path) if os.path.exists(self.archive_path) else 0,
+            })
+        logger.info("Lead archiving finished: %s", report)
+        return self.report()
+
+    def _archive_leads(self, cutoff: int) -> None:
+        connection = self.database.connection
+        condition = "(visible = 0 or id <= ?)"
+        last_id = 0
+        raw_bytes = stored_bytes = 0
+        while not self._stop.is_set():
+            batch_started = time.perf_counter()
+            rows = connection.execute(
+                f"select {', '.join(LEAD_COLUMNS)} from leads where id > ? and {condition} order by id limit ?",
+                (last_id, cutoff, self.batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            ids = [row[0] for row in rows]
+            raw = json.dumps([list(row) for row in rows]).encode("utf-8")
+            data = zlib.compress(raw, 9)
+            # Archived first: a crash before the delete below leaves a duplicate, never a lost lead
+            batch_id = self.archive.execute(
+                f"INSERT INTO {ARCHIVE_BATCHES_TABLE_NAME}"
+                " (first_lead_id, last_lead_id, rows, raw_bytes, archived_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (ids[0], ids[-1], len(rows), len(raw), int(time.time()), data),
+            ).lastrowid
+            self.archive.executemany(
+                f"INSERT INTO {ARCHIVE_INDEX_TABLE_NAME} (lead_id, email_hash, batch_id) VALUES (?, ?, ?)",
+                [(row[0], row[5], batch_id) for row in rows],
+            )
+            self.archive.commit()
+
+            placeholders = ", ".join("?" * len(ids))
+            try:
+                deleted = [row[0] for row in connection.execute(
+                    f"DELETE FROM leads WHERE id IN ({placeholders}) and {condition} RETURNING id", (*ids, cutoff)
+                ).fetchall()]
+                version = self.database._bump_version("contacts") if deleted else None
+                connection.commit()
+            except DatabaseError:
+                connection.rollback()
+                raise
+            # Leads shown again or updated since they were read stay live and leave the archive index
+            kept = set(ids).difference(deleted)
+            if kept:
+                self.archive.executemany(
+                    f"DELETE FROM {ARCHIVE_INDEX_TABLE_NAME} WHERE lead_id = ? and batch_id = ?",
+                    [(lead_id, batch_id) for lead_id in kept],
+                )
+                self.archive.commit()
+            for lead_id in deleted:
+                self.database.events.publish(CONTACT_CHANGED, lead_id=lead_id, contact=None, version=version)
+
+            raw_bytes += len(raw)
+            stored_bytes += len(data)
+            with self._lock:
+                self._report["archived"] += len(deleted)
+                self._report["batches"] += 1
+                self._report["compression_ratio"] = round(stored_bytes / raw_bytes, 3)
+            self._throttle(len(rows), time.perf_counter() - batch_started)
+
+    def _throttle(self, rows: int, elapsed: float) -> None:
+        if not self.rows_per_second:
+            return
+        wait = rows / self.rows_per_second - elapsed
+        if wait > 0:
+            self._stop.wait(wait)
+
+    def lookup(self, email: str) -> dict | None:
+        """
+        Finds an archived lead by email address
+        @param email: plain text email
+        @return: dict of the lead's columns, decrypted, or None
+        """
+        row = self.archive.execute(
+            f"select i.lead_id, b.data from {ARCHIVE_INDEX_TABLE_NAME} i"
+            f" join {ARCHIVE_BATCHES_TABLE_NAME} b on b.id = i.batch_id where i.email_hash = ?"
+            " order by i.batch_id desc limit 1",
+            (self.database.hashing.hash(email),),
+        ).fetchone()
+        if row is None:
+            return None
+        lead_id, data = row
+        for values in json.loads(zlib.decompress(data)):
+            if values[0] == lead_id:
+                lead = dict(zip(LEAD_COLUMNS, values))
+                lead["email"] = self.database.encryption.decrypt(lead["email"])
+                lead["phone_number"] = self.database.encryption.decrypt(lead["phone_number"])
+                return lead
+        return None
+
+    def report(self) -> dict:
+        """
+        Returns leads archived so far and, once finished, space reclaimed and scan times before and after
+        @return: dict
+        """
+        with self._lock:
+            return dict(self._report)
+
+    def start(self) -> None:
+        """
+        Runs the job on a daemon thread
+        @return: null
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="lead-archiver", daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Waits for the background thread
+        @param timeout: seconds to wait
+        @return: True while the job is still running
+        """
+        if self._thread:
+            self._thread.join(timeout)
+            return self._thread.is_alive()
+        return False
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Asks the job to stop after the current batch or vacuum step; running it again continues
+        @param timeout: seconds to wait for the thread
+        @return: null
+        """
+        self._stop.set()
+        self.vacuum.stop()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def close(self) -> None:
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+
+def benchmark(leads: int = 100000, hidden: float = 0.6, batch_size: int = 500) -> dict:
+    """
+    Seeds a database, hides a share of its leads and reports what archiving and vacuuming gain
+    @param leads: leads seeded
+    @param hidden: share of them hidden before archiving
+    @param batch_size: leads per batch
+    @return: report dict
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "contacts.db")
+        seed_database(path, leads=leads)
+        with DatabaseOperation(path) as database:
+            database.connection.execute("UPDATE leads SET visible = 0 WHERE id % 100 < ?", (int(hidden * 100),))
+            database.connection.commit()
+            started = time.perf_counter()
+            enable_incremental_vacuum(database)
+            convert_seconds = time.perf_counter() - started
+            archiver = LeadArchiver(database, os.path.join(directory, "contacts-archive.db"), batch_size=batch_size,
+                                    vacuum=IncrementalVacuum(database, pause_seconds=0))
+            report = archiver.run()
+            archiver.close()
+        report["leads"] = leads
+        report["convert_seconds"] = round(convert_seconds, 3)
+        return report
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Archive hidden and aged leads and compact the database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="archive leads, then free the space with incremental vacuum")
+    run.add_argument("database", help="sqlite database file or postgresql:// URL")
+    run.add_argument("--archive", help="archive sqlite file, defaults to <database>-archive.db")
+    run.add_argument("--keep-latest", type=int, default=None, help="also archive older visible leads")
+    run.add_argument("--batch-size", type=int, default=500)
+    run.add_argument("--rate", type=float, default=None, help="maximum leads per second")
+    vacuum = commands.add_parser("vacuum", help="free pages in small steps")
+    vacuum.add_argument("database", help="sqlite database file")
+    vacuum.add_argument("--pages", type=int, default=256, help="pages per step")
+    vacuum.add_argument("--pause", type=float, default=0.05, help="seconds between steps")
+    enable = commands.add_parser("enable-incremental", help="switch a database to auto_vacuum=INCREMENTAL")
+    enable.add_argument("database", help="sqlite database file")
+    bench = commands.add_parser("benchmark", help="measure archiving on a seeded database")
+    bench.add_argument("--leads", type=int, default=100000)
+    bench.add_argument("--hidden", type=float, default=0.6, help="share of leads hidden")
+    bench.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.command == "benchmark":
+        logging.disable(logging.CRITICAL)
+        print(benchmark(args.leads, args.hidden, args.batch_size))
+        return
+
+    with DatabaseOperation(args.database) as database:
+        if args.command == "enable-incremental":
+            print("converted" if enable_incremental_vacuum(database) else "already incremental or not sqlite")
+        elif args.command == "vacuum":
+            print(IncrementalVacuum(database, pages_per_step=args.pages, pause_seconds=args.pause).run())
+        else:
+            archiver = LeadArchiver(database, args.archive or archive_path_for(args.database),
+                                    keep_latest=args.keep_latest, batch_size=args.batch_size,
+                                    rows_per_second=args.rate)
+            archiver.start()
+            while archiver.join(1.0):
+                print(archiver.report(), flush=True)
+            print(archiver.report())
+            archiver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Module for compressing HTTP responses at the WSGI layer.
+"""
+import gzip
+import threading
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/xml",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+)
+MINIMUM_SIZE = 500
+
+
+class CompressionStats:
+    """
+    Thread safe counters describing the bandwidth vs CPU tradeoff of compression
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.compressed = {}
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int, cpu_seconds: float) -> None:
+        """
+        Records one compressed response
+        @param encoding: content coding used (gzip or br)
+        @param bytes_in: size of the uncompressed body
+        @param bytes_out: size of the compressed body
+        @param cpu_seconds: thread CPU time spent compressing
+        @return: null
+        """
+        with self._lock:
+            self.compressed[encoding] = self.compressed.get(encoding, 0) + 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_seconds += cpu_seconds
+
+    def record_skip(self) -> None:
+        """
+        Records a response that was passed through untouched
+        @return: null
+        """
+        with self._lock:
+            self.skipped += 1
+
+    @property
+    def ratio(self) -> float:
+        """
+        Compressed size divided by original size over all compressed responses
+        @return: float, 1.0 when nothing was compressed yet
+        """
+        with self._lock:
+            if not self.bytes_in:
+                return 1.0
+            return self.bytes_out / self.bytes_in
+
+    def snapshot(self) -> dict:
+        """
+        Returns a copy of the counters
+        @return: dict
+        """
+        with self._lock:
+            return {
+                "compressed": dict(self.compressed),
+                "skipped": self.skipped,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "cpu_seconds": self.cpu_seconds,
+                "ratio": self.bytes_out / self.bytes_in if self.bytes_in else 1.0,
+            }
+
+
+def negotiate_encoding(accept_encoding: str, brotli_available: bool = brotli is not None) -> str | None:
+    """
+    Picks the best supported content coding from an Accept-Encoding header
+    @param accept_encoding: raw header value
+    @param brotli_available: whether br may be offered
+    @return: "br", "gzip" or None
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[coding] = quality
+    candidates = ["br", "gzip"] if brotli_available else ["gzip"]
+    best, best_quality = None, 0.0
+    for coding in candidates:
+        quality = weights.get(coding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class _Compressor:
+    """
+    Incremental compressor with a common interface for gzip and brotli
+    """
+
+    def __init__(self, encoding: str, level: int, brotli_quality: int) -> None:
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+            self._process = self._compressor.process
+            self._flush = self._compressor.flush
+            self._finish = self._compressor.finish
+        else:
+            # wbits 16 + MAX_WBITS produces a gzip container instead of raw zlib
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._process = self._compressor.compress
+            self._flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._compressor.flush
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._process(data)
+        if flush:
+            out += self._flush()
+        return out
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+class CompressionMiddleware:
+    """
+    WSGI middleware that gzip/brotli encodes compressible responses.
+    Small bodies, already encoded bodies and binary types (uploaded images) are passed through.
+    Responses without a Content-Length are compressed chunk by chunk as they are produced.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = MINIMUM_SIZE,
+        compress_level: int = 6,
+        brotli_quality: int = 4,
+        compressible_types: tuple = COMPRESSIBLE_TYPES,
+        stats: CompressionStats = None,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compress_level = compress_level
+        self.brotli_quality = brotli_quality
+        self.compressible_types = compressible_types
+        self.stats = stats or CompressionStats()
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate_encoding(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None or environ.get("REQUEST_METHOD") == "HEAD":
+            return self.app(environ, start_response)
+
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            if exc_info and captured:
+                raise exc_info[1].with_traceback(exc_info[2])
+            captured["status"] = status
+            captured["headers"] = headers
+            captured["exc_info"] = exc_info
+            return captured.setdefault("body", []).append
+
+        app_iter = self.app(environ, capture_start_response)
+        if "status" not in captured:
+            app_iter = self._await_start_response(app_iter, captured)
+        status, headers = captured["status"], captured["headers"]
+
+        if not self._should_compress(status, headers):
+            self.stats.record_skip()
+            start_response(status, headers, captured["exc_info"])
+            return self._passthrough(captured.get("body"), app_iter)
+
+        headers = list(headers)
+        _add_vary(headers)
+        content_length = _header(headers, "content-length")
+        if content_length is not None and int(content_length) < self.minimum_size:
+            self.stats.record_skip()
+            start_response(status, headers, captured["exc_info"])
+            return self._passthrough(captured.get("body"), app_iter)
+
+        headers = _encoded_headers(headers, encoding)
+        if content_length is not None:
+            # Whole body is known up front, compress it in one shot for the best ratio
+            body = self._collect(captured.get("body"), app_iter)
+            compressed = self._compress_buffered(encoding, body)
+            headers.append(("Content-Length", str(len(compressed))))
+            start_response(status, headers, captured["exc_info"])
+            return [compressed]
+
+        start_response(status, headers, captured["exc_info"])
+        return self._compress_stream(encoding, captured.get("body"), app_iter)
+
+    def _should_compress(self, status: str, headers: list) -> bool:
+        code = int(status.split(" ", 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        if _header(headers, "content-encoding"):
+            return False
+        if "no-transform" in (_header(headers, "cache-control") or ""):
+            return False
+        content_type = (_header(headers, "content-type") or "").split(";", 1)[0].strip().lower()
+        return content_type in self.compressible_types
+
+    def _compress_buffered(self, encoding: str, body: bytes) -> bytes:
+        started = time.thread_time()
+        if encoding == "br":
+            compressed = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.compress_level, mtime=0)
+        self.stats.record(encoding, len(body), len(compressed), time.thread_time() - started)
+        return compressed
+
+    def _compress_stream(self, encoding: str, written: list | None, app_iter):
+        compressor = _Compressor(encoding, self.compress_level, self.brotli_quality)
+        bytes_in = bytes_out = 0
+        cpu = 0.0
+        try:
+            for chunk in _chain(written, app_iter):
+                if not chunk:
+                    continue
+                started = time.thread_time()
+                # Flush per chunk so streamed output reaches the client as it is produced
+                out = compressor.compress(chunk, flush=True)
+                cpu += time.thread_time() - started
+                bytes_in += len(chunk)
+                bytes_out += len(out)
+                if out:
+                    yield out
+            started = time.thread_time()
+            tail = compressor.finish()
+            cpu += time.thread_time() - started
+            bytes_out += len(tail)
+            if tail:
+                yield tail
+        finally:
+            _close(app_iter)
+            self.stats.record(encoding, bytes_in, bytes_out, cpu)
+
+    @staticmethod
+    def _await_start_response(app_iter, captured: dict):
+        """
+        Iterates a generator application until it calls start_response, which WSGI allows it to defer
+        until its first chunk. The chunks read meanwhile are kept with the written body.
+        """
+        iterator = iter(app_iter)
+        try:
+            for chunk in iterator:
+                captured.setdefault("body", []).append(chunk)
+                if "status" in captured:
+                    return _ClosingIterator(iterator, app_iter)
+        except BaseException:
+            _close(app_iter)
+            raise
+        if "status" in captured:
+            return _ClosingIterator(iterator, app_iter)
+        _close(app_iter)
+        raise RuntimeError("The application returned without calling start_response")
+
+    @staticmethod
+    def _collect(written: list | None, app_iter) -> bytes:
+        try:
+            return b"".join(_chain(written, app_iter))
+        finally:
+            _close(app_iter)
+
+    @staticmethod
+    def _passthrough(written: list | None, app_iter):
+        if not written:
+            return app_iter
+        return _ClosingIterator(_chain(written, app_iter), app_iter)
+
+
+class _ClosingIterator:
+    """
+    Iterable that forwards close() to the wrapped application iterator
+    """
+
+    def __init__(self, iterator, app_iter) -> None:
+        self._iterator = iterator
+        self._app_iter = app_iter
+
+    def __iter__(self):
+        return self._iterator
+
+    def close(self) -> None:
+        _close(self._app_iter)
+
+
+def _chain(written: list | None, app_iter):
+    if written:
+        yield from written
+    yield from app_iter
+
+
+def _close(app_iter) -> None:
+    close = getattr(app_iter, "close", None)
+    if close is not None:
+        close()
+
+
+def _header(headers: list, name: str) -> str | None:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _encoded_headers(headers: list, encoding: str) -> list:
+    """
+    Returns the headers of a response about to be compressed. The length changes, byte ranges of the
+    original body no longer apply, and the ETag is made weak because the bytes are no longer the same
+    representation as the uncompressed response with that tag.
+    """
+    encoded = []
+    for key, value in headers:
+        name = key.lower()
+        if name in ("content-length", "accept-ranges"):
+            continue
+        if name == "etag" and not value.startswith("W/"):
+            value = f"W/{value}"
+        encoded.append((key, value))
+    encoded.append(("Content-Encoding", encoding))
+    return encoded
+
+
+def _add_vary(headers: list) -> None:
+    for index, (key, value) in enumerate(headers):
+        if key.lower() == "vary":
+            if "accept-encoding" not in value.lower():
+                headers[index] = (key, f"{value}, Accept-Encoding")
+            return
+    headers.append(("Vary", "Accept-Encoding"))
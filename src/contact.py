@@ -0,0 +1,15 @@
+from typing import NamedTuple
+
+
+class Contact(NamedTuple):
+    """
+    Read-only lead record used for listings. Being a tuple it carries no per-instance __dict__,
+    and templates read it by attribute just like a dict.
+    """
+    first_name: str
+    last_name: str
+    phone_number: str
+    email: str
+    subject: str
+    message: str
+    id: int | None = None
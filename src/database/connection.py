@@ -0,0 +1,143 @@
+"""
+Module wrapping a sqlite3 connection so statements can be observed without touching every query.
+
+A SELECT's execute() returns as soon as its first row is ready, so timing execute() alone misses the
+time spent stepping through the rest of the rows. execute() returns a TimedCursor instead, which keeps
+adding the time spent in its fetch calls and notifies the observers once its rows are exhausted,
+fetchall() returned, or it is closed or dropped.
+"""
+import sqlite3
+import time
+
+
+class TimedCursor:
+    """
+    Cursor proxy reporting the execute and fetch time of its statement once, when the statement is done
+    """
+
+    def __init__(self, cursor, done, seconds: float) -> None:
+        """
+        @param cursor: cursor returned by the connection
+        @param done: callable(seconds) run once the statement is done
+        @param seconds: time the execute call took
+        """
+        object.__setattr__(self, "_cursor", cursor)
+        object.__setattr__(self, "_done", done)
+        object.__setattr__(self, "_seconds", seconds)
+
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            object.__setattr__(self, "_seconds", self._seconds + time.perf_counter() - started)
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size: int = None) -> list:
+        size = self._cursor.arraysize if size is None else size
+        rows = self._fetch(self._cursor.fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self) -> list:
+        rows = self._fetch(self._cursor.fetchall)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self) -> None:
+        self._finish()
+        close = getattr(self._cursor, "close", None)
+        if close is not None:
+            close()
+
+    def _finish(self) -> None:
+        done = self._done
+        if done is not None:
+            object.__setattr__(self, "_done", None)
+            done(self._seconds)
+
+    def __del__(self) -> None:
+        # e.g. execute(...).fetchone() of a single row, or a write whose cursor is never read
+        self._finish()
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value) -> None:
+        # row_factory and arraysize belong to the wrapped cursor
+        setattr(self._cursor, name, value)
+
+
+class InstrumentedConnection:
+    """
+    Thin proxy around sqlite3.Connection that times execute/executemany and notifies observers.
+    Observers are callables taking (sql, parameters, seconds); anything not overridden is delegated.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, observers: list = None) -> None:
+        self.raw = connection
+        self.observers = list(observers or [])
+
+    def add_observer(self, observer) -> None:
+        """
+        Registers a statement observer
+        @param observer: callable(sql, parameters, seconds)
+        @return: null
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer) -> None:
+        """
+        Unregisters a statement observer
+        @param observer: previously registered callable
+        @return: null
+        """
+        if observer in self.observers:
+            self.observers.remove(observer)
+
+    def execute(self, sql: str, parameters=()) -> TimedCursor:
+        started = time.perf_counter()
+        try:
+            cursor = self.raw.execute(sql, parameters)
+        except Exception:
+            self._notify(sql, parameters, time.perf_counter() - started)
+            raise
+        return TimedCursor(
+            cursor, lambda seconds: self._notify(sql, parameters, seconds), time.perf_counter() - started
+        )
+
+    def executemany(self, sql: str, seq_of_parameters) -> sqlite3.Cursor:
+        started = time.perf_counter()
+        try:
+            return self.raw.executemany(sql, seq_of_parameters)
+        finally:
+            self._notify(sql, None, time.perf_counter() - started)
+
+    def _notify(self, sql: str, parameters, seconds: float) -> None:
+        for observer in self.observers:
+            observer(sql, parameters, seconds)
+
+    def __enter__(self):
+        self.raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.raw.__exit__(exc_type, exc_val, exc_tb)
+
+    def __getattr__(self, name: str):
+        return getattr(self.raw, name)
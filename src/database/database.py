@@ -1,34 +1,87 @@
 """
 Module for interacting with sql database.
 """
+import json
 import sqlite3
 import logging
+import time
 from datetime import datetime
 import hashlib
 from src.appointment import Appointment
+from src.contact import Contact
+from src.markup import compile_page
 from src.page import Page
 from src.encryption import EncryptionService
-from src.hashing import get_hash
+from src.hashing import get_hash, HashingService
+from src.database.backends import DatabaseError, IntegrityError, SqliteBackend, SqliteConnection, create_backend
+from src.database.connection import InstrumentedConnection
+from src.database.revisions import (
+    PAGE_REVISIONS_TABLE_NAME, SNAPSHOT_EVERY, decode, encode_delta, encode_snapshot, lines_page, page_lines,
+)
+from src.events import CONTACT_CHANGED, EventBus, PAGE_CHANGED
+from src.search import BlindIndex, BLIND_INDEX_TABLE_NAME, FTS_TABLE_NAME
+from src.metrics import record_sql
+
+logger = logging.getLogger(__name__)
 
 DB_NAME_FILENAME = "data.db"
 DB_TABLE_NAME = "leads"
+CACHE_VERSIONS_TABLE_NAME = "cache_versions"
+IDEMPOTENCY_TABLE_NAME = "idempotency_keys"
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+OUTBOX_TABLE_NAME = "outbox"
+PAGE_COLUMNS = "route, title, content, image_url, content_html, excerpt, content_hash, images"
+PAGE_COMPILED_COLUMNS = {
+    "content_html": "TEXT NOT NULL DEFAULT ''",
+    "excerpt": "TEXT NOT NULL DEFAULT ''",
+    "content_hash": "TEXT",
+    "images": "TEXT NOT NULL DEFAULT '[]'",
+}
+BLIND_INDEX_UPSERT = (
+    f"INSERT INTO {BLIND_INDEX_TABLE_NAME} (lead_id, email_bidx, phone_bidx) VALUES (?, ?, ?)"
+    " ON CONFLICT(lead_id) DO UPDATE SET email_bidx = excluded.email_bidx, phone_bidx = excluded.phone_bidx"
+)
 
 
 class DatabaseOperation:
     """
-    Class for setting up, changing, reading, updating or deleting data in sqlite db
+    Class for setting up, changing, reading, updating or deleting data in sqlite db or PostgreSQL
     """
 
     def __init__(self, db_file_name: str = DB_NAME_FILENAME, sqlite_connection: sqlite3.Connection = None,
-) -> None:
+                 events: EventBus = None, backend=None) -> None:
+        """
+        @param db_file_name: sqlite database file or postgresql:// URL
+        @param sqlite_connection: already opened sqlite3 connection to use instead
+        @param events: bus the page change events are published on
+        @param backend: storage backend, picked from db_file_name when not given
+        """
         if sqlite_connection:
-            self.connection = sqlite_connection
+            backend = backend or SqliteBackend(db_file_name)
+            if isinstance(sqlite_connection, sqlite3.Connection):
+                sqlite_connection = SqliteConnection(sqlite_connection)
         else:
-            self.connection = sqlite3.connect(db_file_name, check_same_thread=False)
-        logging.basicConfig(
-            filename="database.log", encoding="utf8", level=logging.DEBUG
-        )
+            backend = backend or create_backend(db_file_name)
+            sqlite_connection = backend.connect()
+        self.backend = backend
+        self.connection = InstrumentedConnection(sqlite_connection, observers=[record_sql])
+        self.events = events or EventBus()
         self.encryption = EncryptionService()
+        self.hashing = HashingService()
+        self.blind_index = BlindIndex()
+        self.snapshot_every = SNAPSHOT_EVERY
+        try:
+            # Page writes only keep a history once create_page_revisions_table has run on this database
+            self._revisions_enabled = self.backend.table_exists(self.connection, PAGE_REVISIONS_TABLE_NAME)
+            # Leads are only indexed once create_search_tables has run; on PostgreSQL a failed insert into a
+            # missing index table would abort the lead's own transaction
+            self._search_enabled = self.backend.table_exists(self.connection, BLIND_INDEX_TABLE_NAME)
+        except DatabaseError:
+            self._revisions_enabled = False
+            self._search_enabled = False
+        # New leads and bookings are only queued for the admin digest after this process ran create_outbox_table,
+        # which a site only does when it has a relay; the table alone would keep collecting events nothing drains
+        self._outbox_enabled = False
 
     def __enter__(self):
         return self
@@ -44,7 +97,7 @@ class DatabaseOperation:
         if self.connection:
             self.connection.close()
             self.connection = None
-            logging.info("Database connection closed")
+            logger.info("Database connection closed")
 
     def commit(self):
         """
@@ -53,9 +106,9 @@ class DatabaseOperation:
         """
         try:
             self.connection.commit()
-            logging.info("Transaction commited")
-        except sqlite3.IntegrityError as error:
-            logging.error("Failed to commit transaction: %s", error)
+            logger.info("Transaction commited")
+        except IntegrityError as error:
+            logger.error("Failed to commit transaction: %s", error)
 
     def rollback(self):
         """
@@ -64,9 +117,20 @@ class DatabaseOperation:
         """
         try:
             self.connection.rollback()
-            logging.info("Transaction rolled back")
-        except sqlite3.Error as error:
-            logging.error("Failed to roll back transaction: %s", error)
+            logger.info("Transaction rolled back")
+        except DatabaseError as error:
+            logger.error("Failed to roll back transaction: %s", error)
+
+    def bulk_insert(self, table: str, columns: tuple, rows) -> int:
+        """
+        Inserts many rows inside the current transaction with the backend's fastest path:
+        executemany on SQLite, COPY on PostgreSQL. The caller commits.
+        @param table: table name
+        @param columns: column names
+        @param rows: iterable of tuples in column order
+        @return: number of rows inserted
+        """
+        return self.backend.bulk_insert(self.connection, table, columns, rows)
 
     def create_leads_table(self, db_table_name: str) -> bool:
         """
@@ -91,11 +155,11 @@ class DatabaseOperation:
                 "visible INTEGER NOT NULL)"
             )
             self.connection.commit()
-            logging.info("Database %s created.", db_table_name)
-            logging.info("Database table %s was created", db_table_name)
+            logger.info("Database %s created.", db_table_name)
+            logger.info("Database table %s was created", db_table_name)
             return True
-        except sqlite3.Error as error:
-            logging.error("Unable to create database %s. %s", DB_NAME_FILENAME, error)
+        except DatabaseError as error:
+            logger.error("Unable to create database %s. %s", DB_NAME_FILENAME, error)
             return False
 
     def create_appointment_table(self, db_table_name: str) -> bool:
@@ -115,10 +179,10 @@ class DatabaseOperation:
                 "message TEXT NOT NULL)"
             )
             self.connection.commit()
-            logging.info("Database table %s was created", db_table_name)
+            logger.info("Database table %s was created", db_table_name)
             return True
-        except sqlite3.Error as error:
-            logging.error("Unable to create database table %s. %s", db_table_name, error)
+        except DatabaseError as error:
+            logger.error("Unable to create database table %s. %s", db_table_name, error)
             return False
 
     def create_pages_table(self, db_table_name: str) -> bool:
@@ -134,26 +198,317 @@ class DatabaseOperation:
                 "route TEXT UNIQUE NOT NULL,"
                 "title TEXT NOT NULL,"
                 "content TEXT NOT NULL,"
-                "image_url TEXT)"
+                "image_url TEXT,"
+                + ",".join(f"{column} {definition}" for column, definition in PAGE_COMPILED_COLUMNS.items())
+                + ")"
+            )
+            self._compile_stored_pages(db_table_name)
+            self.connection.commit()
+            logger.info("Database table %s was created", db_table_name)
+            return True
+        except DatabaseError as error:
+            logger.error("Unable to create database table %s. %s", db_table_name, error)
+            return False
+
+    def _compile_stored_pages(self, db_table_name: str) -> None:
+        """
+        Adds the compiled columns to a pages table created before they existed and compiles every page
+        that has not been compiled yet, so reads never have to render Markdown
+        @param db_table_name: name of the pages table
+        @return: null
+        """
+        cursor = self.connection.execute(f"select * from {db_table_name} limit 0")
+        existing = {column[0] for column in cursor.description}
+        for column, definition in PAGE_COMPILED_COLUMNS.items():
+            if column not in existing:
+                self.connection.execute(f"ALTER TABLE {db_table_name} ADD COLUMN {column} {definition}")
+        rows = self.connection.execute(
+            f"select route, title, content, image_url from {db_table_name} where content_hash is null"
+        ).fetchall()
+        for row in rows:
+            page = compile_page(Page(*row))
+            self.connection.execute(
+                f"UPDATE {db_table_name} SET content_html = ?, excerpt = ?, content_hash = ?, images = ?"
+                " WHERE route = ?",
+                (page.content_html, page.excerpt, page.content_hash, json.dumps(page.images), page.route),
+            )
+        if rows:
+            logger.info("Compiled %s stored pages", len(rows))
+
+    def create_page_revisions_table(self, db_table_name: str = PAGE_REVISIONS_TABLE_NAME) -> bool:
+        """
+        Creates the append-only history of every page version, see src.database.revisions
+        @param db_table_name: name of the new table
+        @return: bool
+        """
+        try:
+            self.connection.execute(
+                f"create table if not exists {db_table_name}("
+                "id INTEGER PRIMARY KEY,"
+                "route TEXT NOT NULL,"
+                "revision INTEGER NOT NULL,"
+                "base INTEGER NOT NULL,"
+                "is_delta INTEGER NOT NULL,"
+                "data BLOB NOT NULL,"
+                "created_at INTEGER NOT NULL,"
+                "UNIQUE(route, revision))"
             )
             self.connection.commit()
-            logging.info("Database table %s was created", db_table_name)
+            self._revisions_enabled = True
+            logger.info("Database table %s was created", db_table_name)
             return True
-        except sqlite3.Error as error:
-            logging.error("Unable to create database table %s. %s", db_table_name, error)
+        except DatabaseError as error:
+            logger.error("Unable to create database table %s. %s", db_table_name, error)
+            return False
+
+    def create_search_tables(self, leads_table_name: str = DB_TABLE_NAME) -> bool:
+        """
+        Creates the blind index table and the FTS5 index over non sensitive lead columns.
+        Existing leads are indexed when the tables are first created.
+        @param leads_table_name: name of the leads table
+        @return: bool
+        """
+        try:
+            existed = self.backend.table_exists(self.connection, FTS_TABLE_NAME)
+            for statement in self.backend.search_schema(leads_table_name):
+                self.connection.execute(statement)
+            if not existed:
+                self.backend.rebuild_text_index(self.connection)
+            self.connection.commit()
+            self._search_enabled = True
+            logger.info("Search tables for %s were created", leads_table_name)
+        except DatabaseError as error:
+            logger.error("Unable to create search tables. %s", error)
             return False
+        self.rebuild_search_index(leads_table_name)
+        return True
+
+    def rebuild_search_index(self, leads_table_name: str = DB_TABLE_NAME, batch_size: int = 1000) -> int:
+        """
+        Builds blind index rows for leads that don't have one yet, decrypting only those leads
+        @param leads_table_name: name of the leads table
+        @param batch_size: leads decrypted and committed per transaction
+        @return: number of leads indexed
+        """
+        indexed = 0
+        try:
+            while True:
+                rows = self.connection.execute(
+                    f"select l.id, l.email, l.phone_number from {leads_table_name} l"
+                    f" left join {BLIND_INDEX_TABLE_NAME} b on b.lead_id = l.id where b.lead_id is null limit ?",
+                    (batch_size,),
+                ).fetchall()
+                if not rows:
+                    break
+                self.connection.executemany(
+                    BLIND_INDEX_UPSERT,
+                    [
+                        (
+                            lead_id,
+                            self.blind_index.email(self.encryption.decrypt(email)),
+                            self.blind_index.phone(self.encryption.decrypt(phone_number)),
+                        )
+                        for lead_id, email, phone_number in rows
+                    ],
+                )
+                self.connection.commit()
+                indexed += len(rows)
+            if indexed:
+                logger.info("Indexed %s leads for search", indexed)
+            return indexed
+        except DatabaseError as error:
+            logger.error("Search index rebuild failed. Error: %s", error)
+            return indexed
+
+    def _index_lead(self, lead_id: int, email: str, phone_number: str) -> None:
+        """
+        Writes the blind index row for a lead inside the caller's transaction
+        @param lead_id: leads.id
+        @param email: plain text email
+        @param phone_number: plain text phone number
+        @return: null
+        """
+        if not self._search_enabled:
+            return
+        try:
+            self.connection.execute(
+                BLIND_INDEX_UPSERT,
+                (lead_id, self.blind_index.email(email), self.blind_index.phone(phone_number)),
+            )
+        except DatabaseError as error:
+            logger.warning("Lead %s was not indexed for search: %s", lead_id, error)
+
+    def create_cache_versions_table(self, db_table_name: str = CACHE_VERSIONS_TABLE_NAME) -> bool:
+        """
+        Creates the table holding the version counters used to invalidate cached template fragments
+        @param db_table_name: name of the new table
+        @return: bool
+        """
+        try:
+            self.connection.execute(
+                f"create table if not exists {db_table_name}("
+                "name TEXT PRIMARY KEY,"
+                "version INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self.connection.commit()
+            logger.info("Database table %s was created", db_table_name)
+            return True
+        except DatabaseError as error:
+            logger.error("Unable to create database table %s. %s", db_table_name, error)
+            return False
+
+    def _bump_version(self, name: str) -> None:
+        """
+        Increments a cache version inside the caller's transaction, so readers in every worker see it on commit
+        @param name: version counter name, e.g. pages or contacts
+        @return: the new version, None if it could not be bumped
+        """
+        try:
+            return self.connection.execute(
+                f"INSERT INTO {CACHE_VERSIONS_TABLE_NAME} (name, version) VALUES (?, 1)"
+                f" ON CONFLICT(name) DO UPDATE SET version = {CACHE_VERSIONS_TABLE_NAME}.version + 1 RETURNING version",
+                (name,),
+            ).fetchone()[0]
+        except DatabaseError as error:
+            logger.warning("Cache version %s was not bumped: %s", name, error)
+            return None
+
+    def get_cache_versions(self) -> dict:
+        """
+        Returns all cache version counters
+        @return: dict of name -> version
+        """
+        try:
+            fetch = self.connection.execute(f"select name, version from {CACHE_VERSIONS_TABLE_NAME}")
+            return dict(fetch.fetchall())
+        except DatabaseError as error:
+            logger.error("Cache versions were not found. Error: %s", error)
+            return {}
+
+    def create_idempotency_table(self, db_table_name: str = IDEMPOTENCY_TABLE_NAME) -> bool:
+        """
+        Creates the expiring table of idempotency keys used to suppress resubmitted forms
+        @param db_table_name: name of the new table
+        @return: bool
+        """
+        try:
+            self.connection.execute(
+                f"create table if not exists {db_table_name}("
+                "key TEXT PRIMARY KEY,"
+                "result TEXT,"
+                "expires_at INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                f"create index if not exists {db_table_name}_expires_at on {db_table_name}(expires_at)"
+            )
+            self.connection.commit()
+            logger.info("Database table %s was created", db_table_name)
+            return True
+        except DatabaseError as error:
+            logger.error("Unable to create database table %s. %s", db_table_name, error)
+            return False
+
+    def _claim_idempotency_key(self, key: str) -> bool:
+        """
+        Records a key inside the caller's transaction, purging a few expired keys on the way
+        @param key: scoped idempotency key
+        @return: False if the key was already used and has not expired
+        """
+        now = int(time.time())
+        self.connection.execute(
+            f"DELETE FROM {IDEMPOTENCY_TABLE_NAME} WHERE key IN"
+            f" (SELECT key FROM {IDEMPOTENCY_TABLE_NAME} WHERE expires_at < ? LIMIT 100)",
+            (now,),
+        )
+        claimed = self.connection.execute(
+            f"INSERT INTO {IDEMPOTENCY_TABLE_NAME} (key, expires_at) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at, result = NULL"
+            f" WHERE {IDEMPOTENCY_TABLE_NAME}.expires_at < ? RETURNING key",
+            (key, now + IDEMPOTENCY_TTL_SECONDS, now),
+        ).fetchone()
+        if claimed is None:
+            # Only the purge above is pending; committing it ends this thread's transaction
+            self.connection.commit()
+            logger.info("Duplicate submission suppressed")
+            return False
+        return True
+
+    def _store_idempotent_result(self, key: str, result: dict) -> None:
+        self.connection.execute(
+            f"UPDATE {IDEMPOTENCY_TABLE_NAME} SET result = ? WHERE key = ?", (json.dumps(result), key)
+        )
+
+    def get_idempotent_result(self, scope: str, key: str) -> dict | None:
+        """
+        Returns the stored result of an earlier submission with the same key
+        @param scope: appointment or contact
+        @param key: client supplied idempotency key
+        @return: dict or None if the key is unknown or expired
+        """
+        try:
+            row = self.connection.execute(
+                f"select result from {IDEMPOTENCY_TABLE_NAME} where key = ? and expires_at >= ?",
+                (f"{scope}:{key}", int(time.time())),
+            ).fetchone()
+            if row is None:
+                return None
+            return json.loads(row[0]) if row[0] else {"success": True}
+        except DatabaseError as error:
+            logger.error("Idempotency key lookup failed. Error: %s", error)
+            return None
 
-    def insert_appointment(self, appointment: Appointment) -> bool:
+    def create_outbox_table(self, db_table_name: str = OUTBOX_TABLE_NAME) -> bool:
+        """
+        Creates the outbox of events written with the records they describe and relayed by src.outbox,
+        and starts queueing events on this connection; call it only where a relay drains the outbox
+        @param db_table_name: name of the new table
+        @return: bool
+        """
+        try:
+            self.connection.execute(
+                f"create table if not exists {db_table_name}("
+                "id INTEGER PRIMARY KEY,"
+                "topic TEXT NOT NULL,"
+                "payload TEXT NOT NULL,"
+                "created_at INTEGER NOT NULL,"
+                "claimed_at INTEGER)"
+            )
+            self.connection.commit()
+            self._outbox_enabled = True
+            logger.info("Database table %s was created", db_table_name)
+            return True
+        except DatabaseError as error:
+            logger.error("Unable to create database table %s. %s", db_table_name, error)
+            return False
+
+    def _enqueue_event(self, topic: str, payload: dict) -> None:
+        """
+        Queues an event inside the caller's transaction, so it is stored exactly when the record is
+        @param topic: lead or appointment
+        @param payload: JSON serialisable summary without encrypted fields
+        @return: null
+        """
+        if not self._outbox_enabled:
+            return
+        self.connection.execute(
+            f"INSERT INTO {OUTBOX_TABLE_NAME} (topic, payload, created_at) VALUES (?, ?, ?)",
+            (topic, json.dumps(payload), int(time.time())),
+        )
+
+    def insert_appointment(self, appointment: Appointment, idempotency_key: str = None) -> bool:
         """
         Inserts appointment into appointments table
         @param appointment: Appointment object
+        @param idempotency_key: optional client supplied key; a repeated key is a no-op that reports success
         @return: bool
         """
         try:
+            if idempotency_key and not self._claim_idempotency_key(f"appointment:{idempotency_key}"):
+                return True
             encrypted_phone = self.encryption.encrypt(appointment.phone_number)
-            self.connection.execute(
+            cursor = self.connection.execute(
                 "INSERT INTO appointments (date, event_name, phone_number, location, message)"
-                "VALUES (?, ?, ?, ?, ?)",
+                "VALUES (?, ?, ?, ?, ?) RETURNING id",
                 (
                     appointment.date.isoformat(),
                     appointment.event_name,
@@ -162,11 +517,21 @@ class DatabaseOperation:
                     appointment.message,
                 ),
             )
+            appointment_id = cursor.fetchone()[0]
+            self._enqueue_event("appointment", {
+                "id": appointment_id,
+                "date": appointment.date.isoformat(),
+                "event_name": appointment.event_name,
+                "location": appointment.location,
+            })
+            if idempotency_key:
+                self._store_idempotent_result(f"appointment:{idempotency_key}", {"success": True})
             self.connection.commit()
-            logging.info("Appointment inserted into database")
+            logger.info("Appointment inserted into database")
             return True
-        except sqlite3.Error as error:
-            logging.error("Appointment insertion failed :(\n%s", error)
+        except DatabaseError as error:
+            self.connection.rollback()
+            logger.error("Appointment insertion failed :(\n%s", error)
             return False
 
     def get_appointments(self, date: datetime) -> list[Appointment]:
@@ -193,21 +558,12 @@ class DatabaseOperation:
                 " from appointments where date = ?",
                 (target_date_str,)
             )
-            returned_data = fetch.fetchall()
-            appointments = []
-            for row in returned_data:
-                phone = self.encryption.decrypt(row[2])
-                appointments.append(Appointment(
-                    date=datetime.fromisoformat(row[0]),
-                    event_name=row[1],
-                    phone_number=phone,
-                    location=row[3],
-                    message=row[4]
-                ))
-            logging.info("Appointments found for date %s", date)
+            fetch.row_factory = self._appointment_row
+            appointments = fetch.fetchall()
+            logger.info("Appointments found for date %s", date)
             return appointments
-        except sqlite3.Error as error:
-            logging.error("Appointments not found. Error: %s", error)
+        except DatabaseError as error:
+            logger.error("Appointments not found. Error: %s", error)
             return []
 
     def insert_page(self, page: Page) -> bool:
@@ -217,16 +573,20 @@ class DatabaseOperation:
         @return: bool
         """
         try:
+            page = compile_page(page)
             self.connection.execute(
-                "INSERT INTO pages (route, title, content, image_url)"
-                "VALUES (?, ?, ?, ?)",
-                (page.route, page.title, page.content, page.image_url),
+                f"INSERT INTO pages ({PAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (page.route, page.title, page.content, page.image_url, page.content_html, page.excerpt,
+                 page.content_hash, json.dumps(page.images)),
             )
+            self._record_revision(page)
+            version = self._bump_version("pages")
             self.connection.commit()
-            logging.info("Page inserted into database")
+            logger.info("Page inserted into database")
+            self.events.publish(PAGE_CHANGED, route=page.route, version=version)
             return True
-        except sqlite3.Error as error:
-            logging.error("Page insertion failed :(\n%s", error)
+        except DatabaseError as error:
+            logger.error("Page insertion failed :(\n%s", error)
             return False
 
     def update_page(self, page: Page) -> bool:
@@ -236,18 +596,29 @@ class DatabaseOperation:
         @return: bool
         """
         try:
+            fetch = self.connection.execute(f"select {PAGE_COLUMNS} from pages where route = ?", (page.route,))
+            fetch.row_factory = Page.from_row
+            previous = fetch.fetchone()
+            # Unchanged content keeps its compiled HTML, so saving a new title or image renders nothing
+            page = compile_page(page, previous)
             cursor = self.connection.execute(
-                "UPDATE pages SET title = ?, content = ?, image_url = ? WHERE route = ?",
-                (page.title, page.content, page.image_url, page.route),
+                "UPDATE pages SET title = ?, content = ?, image_url = ?, content_html = ?, excerpt = ?,"
+                " content_hash = ?, images = ? WHERE route = ?",
+                (page.title, page.content, page.image_url, page.content_html, page.excerpt, page.content_hash,
+                 json.dumps(page.images), page.route),
             )
-            self.connection.commit()
             if cursor.rowcount == 0:
-                logging.warning("No page found with route: %s", page.route)
+                self.connection.commit()
+                logger.warning("No page found with route: %s", page.route)
                 return False
-            logging.info("Page %s has been updated.", page.route)
+            self._record_revision(page, previous)
+            version = self._bump_version("pages")
+            self.connection.commit()
+            logger.info("Page %s has been updated.", page.route)
+            self.events.publish(PAGE_CHANGED, route=page.route, version=version)
             return True
-        except sqlite3.Error as error:
-            logging.error("Page update failed :(\n%s", error)
+        except DatabaseError as error:
+            logger.error("Page update failed :(\n%s", error)
             return False
 
     def get_page_by_route(self, route: str) -> Page | None:
@@ -257,17 +628,15 @@ class DatabaseOperation:
         @return: Page object or None
         """
         try:
-            fetch = self.connection.execute(
-                "select route, title, content, image_url from pages where route = ?",
-                (route,)
-            )
-            row = fetch.fetchone()
-            if row:
-                return Page(route=row[0], title=row[1], content=row[2], image_url=row[3])
-            logging.warning("Page %s not found", route)
+            fetch = self.connection.execute(f"select {PAGE_COLUMNS} from pages where route = ?", (route,))
+            fetch.row_factory = Page.from_row
+            page = fetch.fetchone()
+            if page:
+                return page
+            logger.warning("Page %s not found", route)
             return None
-        except sqlite3.Error as error:
-            logging.error("Page lookup failed. Error: %s", error)
+        except DatabaseError as error:
+            logger.error("Page lookup failed. Error: %s", error)
             return None
 
     def get_all_pages(self) -> list[Page]:
@@ -276,60 +645,220 @@ class DatabaseOperation:
         @return: list of Page objects
         """
         try:
-            fetch = self.connection.execute("select route, title, content, image_url from pages")
-            returned_data = fetch.fetchall()
-            pages = []
-            for row in returned_data:
-                pages.append(Page(route=row[0], title=row[1], content=row[2], image_url=row[3]))
-            logging.info("All pages were found")
+            fetch = self.connection.execute(f"select {PAGE_COLUMNS} from pages")
+            fetch.row_factory = Page.from_row
+            pages = fetch.fetchall()
+            logger.info("All pages were found")
             return pages
-        except sqlite3.Error as error:
-            logging.error("Pages were not found. Error: %s", error)
+        except DatabaseError as error:
+            logger.error("Pages were not found. Error: %s", error)
+            return []
+
+    def _record_revision(self, page: Page, previous: Page = None) -> None:
+        """
+        Appends a page version to its history inside the caller's transaction.
+        Pages written before the history existed get their previous version recorded first.
+        @param page: the version being written
+        @param previous: the version it replaces, None for a new page
+        @return: null
+        """
+        if not self._revisions_enabled:
+            return
+        head = self.connection.execute(
+            f"select revision, base from {PAGE_REVISIONS_TABLE_NAME} where route = ? order by revision desc limit 1",
+            (page.route,),
+        ).fetchone()
+        lines = page_lines(page)
+        if head is None and previous is not None:
+            self._insert_revision(page.route, 1, 1, False, encode_snapshot(page_lines(previous)))
+            head = (1, 1)
+        if head is None or previous is None or head[0] + 1 - head[1] >= self.snapshot_every:
+            revision = head[0] + 1 if head else 1
+            self._insert_revision(page.route, revision, revision, False, encode_snapshot(lines))
+        else:
+            # The row being replaced is the head revision, so the delta needs no reconstruction
+            delta = encode_delta(page_lines(previous), lines)
+            self._insert_revision(page.route, head[0] + 1, head[1], True, delta)
+
+    def _insert_revision(self, route: str, revision: int, base: int, is_delta: bool, data: bytes) -> None:
+        self.connection.execute(
+            f"INSERT INTO {PAGE_REVISIONS_TABLE_NAME} (route, revision, base, is_delta, data, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (route, revision, base, int(is_delta), data, int(time.time())),
+        )
+
+    def get_page_revisions(self, route: str) -> list[dict]:
+        """
+        Lists the history of a page without decoding it
+        @param route: pages.route
+        @return: list of dicts with revision, created_at (datetime), stored bytes and is_delta, newest first
+        """
+        try:
+            fetch = self.connection.execute(
+                f"select revision, created_at, length(data), is_delta from {PAGE_REVISIONS_TABLE_NAME}"
+                " where route = ? order by revision desc",
+                (route,),
+            )
+            return [
+                {
+                    "revision": revision,
+                    "created_at": datetime.fromtimestamp(created_at),
+                    "bytes": size,
+                    "is_delta": bool(is_delta),
+                }
+                for revision, created_at, size, is_delta in fetch.fetchall()
+            ]
+        except DatabaseError as error:
+            logger.error("Page revisions were not found. Error: %s", error)
             return []
 
-    def insert_contact_data(self, data: dict) -> bool:
+    def get_page_revision(self, route: str, revision: int) -> Page | None:
+        """
+        Rebuilds a past version of a page from its snapshot and the deltas after it
+        @param route: pages.route
+        @param revision: revision number
+        @return: Page or None if the revision does not exist
+        """
+        try:
+            fetch = self.connection.execute(
+                f"select r.is_delta, r.data from {PAGE_REVISIONS_TABLE_NAME} t join {PAGE_REVISIONS_TABLE_NAME} r"
+                " on r.route = t.route and r.revision between t.base and t.revision"
+                " where t.route = ? and t.revision = ? order by r.revision",
+                (route, revision),
+            )
+            lines = None
+            for is_delta, data in fetch.fetchall():
+                lines = decode(bytes(data), lines if is_delta else None)
+            return lines_page(route, lines) if lines is not None else None
+        except DatabaseError as error:
+            logger.error("Page revision lookup failed. Error: %s", error)
+            return None
+
+    def rollback_page(self, route: str, revision: int) -> bool:
         """
-        Inserts data into leads table
+        Makes a past revision the live page again. The rollback is itself a new revision, so it can be undone,
+        and like any update it bumps the pages cache version and publishes PAGE_CHANGED.
+        @param route: pages.route
+        @param revision: revision to restore
+        @return: bool
+        """
+        page = self.get_page_revision(route, revision)
+        if page is None:
+            logger.warning("Revision %s of page %s not found", revision, route)
+            return False
+        return self.update_page(page)
+
+    def insert_contact_data(self, data: dict, idempotency_key: str = None) -> bool:
+        """
+        Inserts data into leads table. A lead with the same (canonical) email is updated in place.
         @type data: dict
+        @param idempotency_key: optional client supplied key; a repeated key is a no-op that reports success
         """
         try:
+            if idempotency_key and not self._claim_idempotency_key(f"contact:{idempotency_key}"):
+                return True
             data_copy = data.copy()
             data_copy["phone_number"] = self.encryption.encrypt(data["phone_number"])
             data_copy["email"] = self.encryption.encrypt(data["email"])
-            data_copy["email_hash"] = get_hash(data["email"])
-
-            self.connection.execute(
-                "INSERT INTO leads (first_name,"
-                "last_name,"
-                "phone_number,"
-                "email,"
-                "email_hash,"
-                "subject,"
-                "message,"
-                "visible)"
-                "VALUES (:first_name, :last_name, :phone_number, :email, :email_hash, :subject, :message, :visible)",
-                data_copy,
-            )
+            data_copy["email_hash"] = self.hashing.hash(data["email"])
+            # Rows not yet rehashed by migrations.rehash_email_hashes still carry the legacy unkeyed hash
+            existing = self.connection.execute(
+                "select id from leads where email_hash in (?, ?) order by email_hash = ? desc limit 1",
+                (data_copy["email_hash"], get_hash(data["email"]), data_copy["email_hash"]),
+            ).fetchone()
+            if existing is not None:
+                lead_id = data_copy["id"] = existing[0]
+                self.connection.execute(
+                    "UPDATE leads SET first_name = :first_name, last_name = :last_name,"
+                    " phone_number = :phone_number, email = :email, email_hash = :email_hash,"
+                    " subject = :subject, message = :message, visible = :visible WHERE id = :id",
+                    data_copy,
+                )
+            else:
+                lead_id = self._insert_lead(data_copy)
+            self._index_lead(lead_id, data["email"], data["phone_number"])
+            if existing is None:
+                # A resubmission updates the lead in place and is no new lead for the digest
+                self._enqueue_event("lead", {
+                    "id": lead_id,
+                    "name": f"{data.get('first_name', '')} {data.get('last_name', '')}".strip(),
+                    "subject": data.get("subject", ""),
+                })
+            if idempotency_key:
+                self._store_idempotent_result(f"contact:{idempotency_key}", {"success": True})
+            version = self._bump_version("contacts")
             self.connection.commit()
-            logging.info("Data inserted into database")
+            logger.info("Data inserted into database")
+            self._publish_contact(lead_id, data, version)
             return True
-        except sqlite3.Error as error:
-            logging.error("Data insertion failed :(\n%s", error)
+        except DatabaseError as error:
+            self.connection.rollback()
+            logger.error("Data insertion failed :(\n%s", error)
             return False
 
+    def _insert_lead(self, data_copy: dict) -> int:
+        """
+        Inserts an encrypted lead row; a concurrent insert of the same email updates that row instead
+        @param data_copy: row values with encrypted phone and email and the keyed email_hash
+        @return: leads.id
+        """
+        cursor = self.connection.execute(
+            "INSERT INTO leads (first_name,"
+            "last_name,"
+            "phone_number,"
+            "email,"
+            "email_hash,"
+            "subject,"
+            "message,"
+            "visible)"
+            "VALUES (:first_name, :last_name, :phone_number, :email, :email_hash, :subject, :message, :visible)"
+            " ON CONFLICT(email_hash) DO UPDATE SET"
+            " first_name = excluded.first_name,"
+            " last_name = excluded.last_name,"
+            " phone_number = excluded.phone_number,"
+            " email = excluded.email,"
+            " subject = excluded.subject,"
+            " message = excluded.message,"
+            " visible = excluded.visible"
+            " RETURNING id",
+            data_copy,
+        )
+        return cursor.fetchone()[0]
+
+    def _publish_contact(self, lead_id: int, data: dict | None, version: int | None) -> None:
+        """
+        Publishes CONTACT_CHANGED after a commit with the plain text fields the caller already has,
+        so listeners never read back or decrypt the row
+        @param lead_id: leads.id
+        @param data: submitted fields, None when the lead was disabled
+        @param version: new contacts cache version
+        @return: null
+        """
+        contact = None
+        if data is not None and data.get("visible", 1):
+            contact = Contact(data.get("first_name"), data.get("last_name"), data.get("phone_number"),
+                              data.get("email"), data.get("subject"), data.get("message"), lead_id)
+        self.events.publish(CONTACT_CHANGED, lead_id=lead_id, contact=contact, version=version)
+
     def disable_contact(self, email: str) -> bool:
         """
         Hides data from the front end instead of a hard delete - updates visible field to false
         @param email: email address
         """
         try:
-            email_hash = get_hash(email)
-            self.connection.execute("UPDATE leads set visible=0 where email_hash = ?", (email_hash,))
+            email_hash = self.hashing.hash(email)
+            cursor = self.connection.execute(
+                "UPDATE leads set visible=0 where email_hash in (?, ?) RETURNING id", (email_hash, get_hash(email))
+            )
+            disabled_ids = [row[0] for row in cursor.fetchall()]
+            version = self._bump_version("contacts")
             self.connection.commit()
-            logging.info("Email address %s was disabled.", email)
+            logger.info("Contact %s was disabled.", email_hash[:12])
+            for lead_id in disabled_ids:
+                self._publish_contact(lead_id, None, version)
             return True
-        except sqlite3.Error as error:
-            logging.error("%s was not disabled. Error: %s", email, error)
+        except DatabaseError as error:
+            logger.error("Contact was not disabled. Error: %s", error)
             return False
 
     def update_contact(self, data: dict, email: str) -> bool:
@@ -340,13 +869,14 @@ class DatabaseOperation:
         @return: bool
         """
         try:
-            email_hash_old = get_hash(email)
+            email_hash_old = self.hashing.hash(email)
 
             data_copy = data.copy()
             data_copy["phone_number"] = self.encryption.encrypt(data["phone_number"])
             data_copy["email"] = self.encryption.encrypt(data["email"])
-            data_copy["email_hash"] = get_hash(data["email"])
+            data_copy["email_hash"] = self.hashing.hash(data["email"])
             data_copy["email_hash_old"] = email_hash_old
+            data_copy["email_hash_legacy"] = get_hash(email)
 
             cursor = self.connection.execute(
                 """
@@ -359,18 +889,25 @@ class DatabaseOperation:
                     subject = :subject,
                     message = :message,
                     visible = :visible
-                WHERE email_hash = :email_hash_old
+                WHERE email_hash in (:email_hash_old, :email_hash_legacy)
+                RETURNING id
                 """,
                 data_copy,
             )
+            updated_ids = [row[0] for row in cursor.fetchall()]
+            for lead_id in updated_ids:
+                self._index_lead(lead_id, data["email"], data["phone_number"])
+            version = self._bump_version("contacts") if updated_ids else None
             self.connection.commit()
-            if cursor.rowcount == 0:
-                logging.warning("No contact found with email: %s", email)
+            if not updated_ids:
+                logger.warning("No contact found with email hash: %s", email_hash_old[:12])
                 return False
-            logging.info("Contact %s has been updated.", data["email"])
+            logger.info("Contact %s has been updated.", data_copy["email_hash"][:12])
+            for lead_id in updated_ids:
+                self._publish_contact(lead_id, data, version)
             return True
-        except sqlite3.IntegrityError as error:
-            logging.error("%s was not updated Error: %s", data["email"], error)
+        except IntegrityError as error:
+            logger.error("Contact was not updated Error: %s", error)
             return False
 
     def get_contact(self, data: str) -> dict:
@@ -388,11 +925,12 @@ class DatabaseOperation:
             "message",
         ]
         try:
-            email_hash = get_hash(data)
+            email_hash = self.hashing.hash(data)
+            # Rows not yet rehashed by migrations.rehash_email_hashes still carry the legacy unkeyed hash
             fetch = self.connection.execute(
                 "select first_name, last_name, phone_number, email, subject, message"
-                " from leads where visible = 1 and email_hash = ?",
-                (email_hash,)
+                " from leads where visible = 1 and email_hash in (?, ?)",
+                (email_hash, get_hash(data))
             )
             returned_data = fetch.fetchone()
 
@@ -400,43 +938,78 @@ class DatabaseOperation:
                 formatted_dict = dict(zip(d_keys, returned_data))
                 formatted_dict["email"] = self.encryption.decrypt(formatted_dict["email"])
                 formatted_dict["phone_number"] = self.encryption.decrypt(formatted_dict["phone_number"])
-                logging.info("Contact %s was found", data)
+                logger.info("Contact %s was found", email_hash[:12])
                 return formatted_dict
 
-            logging.warning("Contact %s not found", data)
+            logger.warning("Contact %s not found", email_hash[:12])
             return {}
-        except sqlite3.Error as error:
-            logging.error("%s was not found. Error: %s", data, error)
+        except DatabaseError as error:
+            logger.error("Contact lookup failed. Error: %s", error)
             return {}
 
-    def get_all_contacts(self) -> list:
+    def get_all_contacts(self) -> list[Contact]:
         """
         Returns all visible contacts
-        @return: list of dicts
+        @return: list of Contact records
         """
-        d_keys = [
-            "first_name",
-            "last_name",
-            "phone_number",
-            "email",
-            "subject",
-            "message",
-        ]
         try:
             fetch = self.connection.execute(
-                "select first_name, last_name, phone_number, email, subject, message"
+                "select first_name, last_name, phone_number, email, subject, message, id"
                 " from leads where visible = 1"
             )
-            returned_data = fetch.fetchall()
-            contacts = []
-            for row in returned_data:
-                d = dict(zip(d_keys, row))
-                d["email"] = self.encryption.decrypt(d["email"])
-                d["phone_number"] = self.encryption.decrypt(d["phone_number"])
-                contacts.append(d)
+            fetch.row_factory = self._contact_row
+            contacts = fetch.fetchall()
+            logger.info("All contacts were found")
+            return contacts
+        except DatabaseError as error:
+            logger.error("Contacts were not found. Error: %s", error)
+            return []
+
+    def _contact_row(self, cursor, row: tuple) -> Contact:
+        """
+        Row factory decrypting (first_name, last_name, phone_number, email, subject, message[, id]) rows
+        """
+        decrypt = self.encryption.decrypt
+        return Contact(row[0], row[1], decrypt(row[2]), decrypt(row[3]), row[4], row[5], *row[6:])
+
+    def _appointment_row(self, cursor, row: tuple) -> Appointment:
+        """
+        Row factory for (date, event_name, phone_number, location, message) rows
+        """
+        return Appointment(datetime.fromisoformat(row[0]), row[1], self.encryption.decrypt(row[2]), row[3], row[4])
 
-            logging.info("All contacts were found")
+    def search_contacts(self, query: str = None, email: str = None, phone_number: str = None,
+                        limit: int = 50) -> list:
+        """
+        Searches visible contacts by free text, exact email and/or exact phone number.
+        Only the matching rows are decrypted.
+        @param query: words matched against names, subject and message (last word as a prefix)
+        @param email: email address to match exactly
+        @param phone_number: phone number to match exactly, formatting is ignored
+        @param limit: maximum number of results
+        @return: list of dicts
+        """
+        sql, parameters = self.backend.search_query(
+            text=query,
+            email_bidx=self.blind_index.email(email) if email else None,
+            phone_bidx=self.blind_index.phone(phone_number) if phone_number else None,
+            limit=limit,
+        )
+        if sql is None:
+            return []
+        try:
+            contacts = []
+            for row in self.connection.execute(sql, parameters).fetchall():
+                contacts.append({
+                    "id": row[0],
+                    "first_name": row[1],
+                    "last_name": row[2],
+                    "phone_number": self.encryption.decrypt(row[3]),
+                    "email": self.encryption.decrypt(row[4]),
+                    "subject": row[5],
+                    "message": row[6],
+                })
             return contacts
-        except sqlite3.Error as error:
-            logging.error("Contacts were not found. Error: %s", error)
+        except DatabaseError as error:
+            logger.error("Contact search failed. Error: %s", error)
             return []
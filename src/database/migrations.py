@@ -0,0 +1,102 @@
+"""
+Module for online data migrations on the leads table.
+
+Usage:
+    python -m src.database.migrations rehash contacts.db --chunk-size 500 --pause 0.05
+"""
+import argparse
+import logging
+import time
+
+from src.database.backends import IntegrityError
+from src.database.database import DatabaseOperation
+
+logger = logging.getLogger(__name__)
+
+
+def rehash_email_hashes(database: DatabaseOperation, chunk_size: int = 500, pause: float = 0.0,
+                        start_id: int = 0, progress=None) -> dict:
+    """
+    Rewrites leads.email_hash with the keyed, canonicalized hash in place.
+    Works through the table by primary key in small chunks, committing after each one so the write
+    lock is only held briefly; lookups keep working meanwhile because they also match the legacy hash.
+    Leads whose canonical email collides with an earlier lead keep no hash (NULL) and are reported;
+    each chunk, and each row of a chunk with a collision, runs in a savepoint rolled back on its own.
+    @param database: DatabaseOperation whose connection and hashing service are used
+    @param chunk_size: rows per transaction
+    @param pause: seconds to sleep between chunks to leave room for live writes
+    @param start_id: resume after this lead id
+    @param progress: optional callable(stats dict) invoked after every chunk
+    @return: dict with scanned, updated, collisions and last_id
+    """
+    connection = database.connection
+    stats = {"scanned": 0, "updated": 0, "collisions": 0, "last_id": start_id}
+    while True:
+        rows = connection.execute(
+            "select id, email, email_hash from leads where id > ? order by id limit ?",
+            (stats["last_id"], chunk_size),
+        ).fetchall()
+        if not rows:
+            break
+        emails = [database.encryption.decrypt(email) for _, email, _ in rows]
+        new_hashes = database.hashing.hash_many(emails)
+        changes = [
+            (new_hash, lead_id)
+            for (lead_id, _, old_hash), new_hash in zip(rows, new_hashes)
+            if new_hash != old_hash
+        ]
+        if changes:
+            # The chunk's own savepoint: on PostgreSQL a failed statement aborts the transaction, and
+            # rolling back to it keeps the chunks committed before and the statements before the failure
+            connection.execute("SAVEPOINT rehash_chunk")
+            try:
+                connection.executemany("UPDATE leads SET email_hash = ? WHERE id = ?", changes)
+                stats["updated"] += len(changes)
+            except IntegrityError:
+                # Two legacy rows canonicalize to the same email: apply row by row and clear the later one
+                connection.execute("ROLLBACK TO SAVEPOINT rehash_chunk")
+                for new_hash, lead_id in changes:
+                    connection.execute("SAVEPOINT rehash_row")
+                    try:
+                        connection.execute("UPDATE leads SET email_hash = ? WHERE id = ?", (new_hash, lead_id))
+                        stats["updated"] += 1
+                    except IntegrityError:
+                        connection.execute("ROLLBACK TO SAVEPOINT rehash_row")
+                        connection.execute("UPDATE leads SET email_hash = NULL WHERE id = ?", (lead_id,))
+                        stats["collisions"] += 1
+                        logger.warning("Lead %s duplicates an existing canonical email", lead_id)
+                    connection.execute("RELEASE SAVEPOINT rehash_row")
+        connection.commit()
+        stats["scanned"] += len(rows)
+        stats["last_id"] = rows[-1][0]
+        if progress:
+            progress(dict(stats))
+        if pause:
+            time.sleep(pause)
+    logger.info("Email hash migration finished: %s", stats)
+    return stats
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Online migrations for the leads table")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rehash = commands.add_parser("rehash", help="rebuild email_hash with the keyed hash")
+    rehash.add_argument("database", help="sqlite database file")
+    rehash.add_argument("--chunk-size", type=int, default=500)
+    rehash.add_argument("--pause", type=float, default=0.0, help="seconds between chunks")
+    rehash.add_argument("--start-id", type=int, default=0, help="resume after this lead id")
+    args = parser.parse_args(argv)
+
+    with DatabaseOperation(args.database) as database:
+        stats = rehash_email_hashes(
+            database,
+            chunk_size=args.chunk_size,
+            pause=args.pause,
+            start_id=args.start_id,
+            progress=lambda s: print(f"scanned {s['scanned']} updated {s['updated']} last id {s['last_id']}"),
+        )
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Module for the compact encoding of page revisions.
+
+A version of a page is a list of lines: a JSON header line with the title and image URL followed by
+the content split into lines. Every SNAPSHOT_EVERY revisions the whole list is stored; the revisions in
+between only store a line delta against the revision before them. Both are zlib compressed JSON, so
+rebuilding any revision reads one snapshot and applies at most SNAPSHOT_EVERY - 1 deltas.
+"""
+import json
+import zlib
+from difflib import SequenceMatcher
+
+from src.page import Page
+
+PAGE_REVISIONS_TABLE_NAME = "page_revisions"
+# Upper bound of the delta chain walked to rebuild a revision
+SNAPSHOT_EVERY = 32
+COMPRESSION_LEVEL = 9
+
+
+def page_lines(page: Page) -> list[str]:
+    """
+    Splits a page into the lines deltas are computed over
+    @param page: Page
+    @return: list of str
+    """
+    header = json.dumps([page.title, page.image_url or ""]) + "\n"
+    return [header, *page.content.splitlines(keepends=True)]
+
+
+def lines_page(route: str, lines: list[str]) -> Page:
+    """
+    Rebuilds a page from its lines
+    @param route: pages.route
+    @param lines: list produced by page_lines
+    @return: Page
+    """
+    title, image_url = json.loads(lines[0])
+    return Page(route=route, title=title, content="".join(lines[1:]), image_url=image_url)
+
+
+def encode_snapshot(lines: list[str]) -> bytes:
+    return zlib.compress(json.dumps(lines).encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def encode_delta(old: list[str], new: list[str]) -> bytes:
+    """
+    Encodes new as copies of line ranges from old plus inserted lines
+    @param old: lines of the previous revision
+    @param new: lines of this revision
+    @return: compressed delta; [start, end] copies old[start:end], a list of str inserts those lines
+    """
+    operations = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag == "equal":
+            operations.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            operations.append(new[j1:j2])
+    return zlib.compress(json.dumps(operations).encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decode(data: bytes, previous: list[str] | None) -> list[str]:
+    """
+    Decodes a stored revision
+    @param data: snapshot or delta bytes
+    @param previous: lines of the revision before, None for a snapshot
+    @return: list of str
+    """
+    decoded = json.loads(zlib.decompress(data))
+    if previous is None:
+        return decoded
+    lines = []
+    for operation in decoded:
+        if operation and isinstance(operation[0], int):
+            lines.extend(previous[operation[0]:operation[1]])
+        else:
+            lines.extend(operation)
+    return lines
@@ -0,0 +1,409 @@
+"""
+Module for generating large synthetic databases for performance work.
+
+Leads, appointments and pages are generated deterministically from a seed, encrypted and hashed in
+batches and written with bulk inserts inside one transaction per batch (COPY on PostgreSQL). Encryption
+is the bulk of the work, so batches are spread over a process pool calling the regular Fernet encrypt.
+The search index is built once at the end instead of row by row through the triggers.
+
+Usage:
+    python -m src.database.seed contacts.db --leads 1000000 --appointments 250000 --pages 300 --seed 7
+    python -m src.database.seed contacts.db --pages 300 --image-dir static/uploads
+    python -m src.database.seed postgresql://app@localhost/static_pages --leads 1000000 --workers 8
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import repeat
+
+from src.database.database import DatabaseOperation, PAGE_COLUMNS
+from src.encryption import EncryptionService
+from src.markup import compile_page
+from src.page import Page
+from src.search import BLIND_INDEX_TABLE_NAME, FTS_TABLE_NAME
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50000
+FIRST_NAMES = (
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Karen", "Carlos", "Sarah",
+    "Daniel", "Lisa", "Matthew", "Nancy", "Anthony", "Sandra", "Mark", "Ashley", "Wei", "Emily",
+    "Luis", "Priya", "Ahmed", "Olga", "Kenji", "Fatima", "Mateo", "Amara", "Noah", "Chloe",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+    "Nguyen", "Patel", "Kim", "Chen", "Okafor", "Ivanova", "Tanaka", "Haddad", "Rossi", "Novak",
+)
+DOMAINS = ("gmail.com", "yahoo.com", "outlook.com", "icloud.com", "hotmail.com", "proton.me", "example.org")
+SUBJECTS = (
+    "Quote request", "Kitchen remodel", "Deck repair", "Bathroom tile", "Question about pricing",
+    "Schedule a visit", "Fence installation", "Roof leak", "Follow up", "Patio estimate", "Painting job",
+    "Window replacement", "Basement finishing", "Emergency repair", "Garden design",
+)
+WORDS = (
+    "hi", "hello", "we", "are", "looking", "for", "a", "quote", "on", "our", "new", "old", "kitchen", "deck",
+    "roof", "fence", "patio", "bathroom", "floor", "tile", "paint", "the", "house", "next", "week", "month",
+    "please", "call", "me", "back", "when", "you", "can", "budget", "is", "around", "flexible", "thanks",
+    "estimate", "repair", "install", "cedar", "stone", "brick", "color", "weekend", "morning", "afternoon",
+)
+EVENTS = ("Site visit", "Estimate", "Consultation", "Install", "Inspection", "Follow up", "Walkthrough")
+LOCATIONS = ("Main St", "Oak Ave", "Pine Rd", "Maple Dr", "Cedar Ln", "Elm St", "Lake Blvd", "Hill Ct")
+DEFAULT_PAGES = (("home", "Welcome"), ("services", "Our Services"), ("gallery", "Gallery"))
+LEAD_COLUMNS = ("id", "first_name", "last_name", "phone_number", "email", "email_hash", "subject", "message",
+                "visible")
+APPOINTMENT_COLUMNS = ("date", "event_name", "phone_number", "location", "message")
+
+
+def generate_leads(rng: random.Random, start: int, count: int) -> list[tuple]:
+    """
+    Generates plain text leads; the index is part of the email so every email is unique
+    @param rng: random generator
+    @param start: index of the first lead
+    @param count: number of leads
+    @return: list of (first_name, last_name, phone_number, email, subject, message)
+    """
+    choice, randrange = rng.choice, rng.randrange
+    # Drawing from a pool of messages is much cheaper than building one per lead and looks the same
+    messages = _sentences(rng, min(count, 5000), 6, 30)
+    leads = []
+    for i in range(start, start + count):
+        first_name, last_name = choice(FIRST_NAMES), choice(LAST_NAMES)
+        leads.append((
+            first_name,
+            last_name,
+            _phone(randrange),
+            f"{first_name}.{last_name}{i}@{choice(DOMAINS)}".lower(),
+            choice(SUBJECTS),
+            choice(messages),
+        ))
+    return leads
+
+
+def generate_appointments(rng: random.Random, count: int, first_day: datetime) -> list[tuple]:
+    """
+    Generates plain text appointments during working hours over the two years after first_day
+    @param rng: random generator
+    @param count: number of appointments
+    @param first_day: earliest appointment date
+    @return: list of (date, event_name, phone_number, location, message)
+    """
+    choice, randrange = rng.choice, rng.randrange
+    messages = _sentences(rng, min(count, 5000), 4, 20)
+    return [
+        (
+            (first_day + timedelta(days=randrange(730), hours=randrange(8, 18), minutes=15 * randrange(4)))
+            .isoformat(),
+            choice(EVENTS),
+            _phone(randrange),
+            f"{randrange(1, 9999)} {choice(LOCATIONS)}",
+            choice(messages),
+        )
+        for _ in range(count)
+    ]
+
+
+def _sentences(rng: random.Random, count: int, shortest: int, longest: int) -> list[str]:
+    return [" ".join(rng.choices(WORDS, k=rng.randrange(shortest, longest))).capitalize() + "." for _ in range(count)]
+
+
+def _phone(randrange) -> str:
+    area, exchange, line = randrange(201, 990), randrange(200, 999), randrange(10000)
+    style = randrange(3)
+    if style == 0:
+        return f"({area}) {exchange}-{line:04d}"
+    if style == 1:
+        return f"+1 {area}-{exchange}-{line:04d}"
+    return f"{area}{exchange}{line:04d}"
+
+
+def placeholder_png(rng: random.Random, width: int = 64, height: int = 48) -> bytes:
+    """
+    Builds a small valid PNG with a random horizontal gradient
+    @param rng: random generator
+    @param width: pixels
+    @param height: pixels
+    @return: PNG bytes
+    """
+    red, green, blue = rng.randrange(256), rng.randrange(256), rng.randrange(256)
+    row = b"\x00" + b"".join(bytes(((red + x) % 256, green, (blue + 2 * x) % 256)) for x in range(width))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+def _encrypt_chunk(keys: list, plain_texts: list) -> list[str]:
+    """
+    Encrypts values in a worker process with the same keys as the parent's EncryptionService
+    """
+    encryption = EncryptionService(keys)
+    return [encryption.encrypt(text) for text in plain_texts]
+
+
+class Seeder:
+    """
+    Bulk loads synthetic data through a DatabaseOperation, reusing its encryption, hashing and blind index
+    services so the result is indistinguishable from rows written by the app
+    """
+
+    def __init__(self, database: DatabaseOperation, seed: int = 0, batch_size: int = BATCH_SIZE,
+                 progress=None, workers: int = 1) -> None:
+        """
+        @param database: target database
+        @param seed: random seed, the same seed and sizes always give the same plain text data
+        @param batch_size: rows per transaction
+        @param progress: optional callable(kind, done, total)
+        @param workers: processes encrypting in parallel, 1 encrypts in this process
+        """
+        self.database = database
+        self.connection = database.connection
+        self.seed = seed
+        self.batch_size = batch_size
+        self.progress = progress
+        self.workers = workers
+        self._pool = ProcessPoolExecutor(workers) if workers > 1 else None
+
+    def _encrypt(self, plain_texts) -> list[str]:
+        """
+        Encrypts a batch of values, split over the worker processes
+        @param plain_texts: iterable of str
+        @return: tokens in input order, "" for empty values
+        """
+        plain_texts = list(plain_texts)
+        encryption = self.database.encryption
+        if self._pool is None or len(plain_texts) < 2 * self.workers:
+            return [encryption.encrypt(text) for text in plain_texts]
+        size = -(-len(plain_texts) // self.workers)
+        chunks = [plain_texts[start:start + size] for start in range(0, len(plain_texts), size)]
+        encrypted = self._pool.map(_encrypt_chunk, repeat(encryption.keys), chunks)
+        return [token for chunk in encrypted for token in chunk]
+
+    def close(self) -> None:
+        """
+        Stops the encryption worker processes
+        @return: null
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def create_tables(self) -> None:
+        self.database.create_leads_table("leads")
+        self.database.create_appointment_table("appointments")
+        self.database.create_pages_table("pages")
+        self.database.create_cache_versions_table()
+        self.database.create_idempotency_table()
+
+    def seed_leads(self, count: int) -> int:
+        """
+        Inserts encrypted leads together with their email hash and blind index rows.
+        The FTS insert trigger and the blind index secondary indexes are dropped during the load and
+        rebuilt once at the end, which is much faster than maintaining them row by row.
+        @param count: number of leads
+        @return: number of leads inserted
+        """
+        rng = random.Random(f"{self.seed}:leads")
+        hashing, blind_index = self.database.hashing, self.database.blind_index
+        backend = self.database.backend
+        first_id = (self.connection.execute("select max(id) from leads").fetchone()[0] or 0) + 1
+        schema = backend.search_schema("leads")
+        self.connection.execute(schema[0])
+        if backend.name == "sqlite":
+            self.connection.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE_NAME}_ai")
+        self.connection.execute(f"DROP INDEX IF EXISTS {BLIND_INDEX_TABLE_NAME}_email")
+        self.connection.execute(f"DROP INDEX IF EXISTS {BLIND_INDEX_TABLE_NAME}_phone")
+        self.connection.commit()
+
+        done = 0
+        while done < count:
+            size = min(self.batch_size, count - done)
+            leads = generate_leads(rng, first_id + done, size)
+            phones = [lead[2] for lead in leads]
+            emails = [lead[3] for lead in leads]
+            ids = range(first_id + done, first_id + done + size)
+            self.database.bulk_insert(
+                "leads",
+                LEAD_COLUMNS,
+                zip(
+                    ids,
+                    (lead[0] for lead in leads),
+                    (lead[1] for lead in leads),
+                    self._encrypt(phones),
+                    self._encrypt(emails),
+                    hashing.hash_many(emails),
+                    (lead[4] for lead in leads),
+                    (lead[5] for lead in leads),
+                    (1 for _ in leads),
+                ),
+            )
+            self.database.bulk_insert(
+                BLIND_INDEX_TABLE_NAME,
+                ("lead_id", "email_bidx", "phone_bidx"),
+                zip(ids, blind_index.email_many(emails), blind_index.phone_many(phones)),
+            )
+            self.connection.commit()
+            done += size
+            self._report("leads", done, count)
+
+        # Recreates the dropped trigger and indexes, then indexes all leads for full-text search in one pass
+        for statement in schema:
+            self.connection.execute(statement)
+        backend.rebuild_text_index(self.connection)
+        self.connection.commit()
+        self.database._bump_version("contacts")
+        return done
+
+    def seed_appointments(self, count: int, first_day: datetime = datetime(2026, 1, 5)) -> int:
+        """
+        Inserts encrypted appointments
+        @param count: number of appointments
+        @param first_day: earliest appointment date
+        @return: number of appointments inserted
+        """
+        rng = random.Random(f"{self.seed}:appointments")
+        done = 0
+        while done < count:
+            appointments = generate_appointments(rng, min(self.batch_size, count - done), first_day)
+            self.database.bulk_insert(
+                "appointments",
+                APPOINTMENT_COLUMNS,
+                zip(
+                    (appointment[0] for appointment in appointments),
+                    (appointment[1] for appointment in appointments),
+                    self._encrypt(appointment[2] for appointment in appointments),
+                    (appointment[3] for appointment in appointments),
+                    (appointment[4] for appointment in appointments),
+                ),
+            )
+            self.connection.commit()
+            done += len(appointments)
+            self._report("appointments", done, count)
+        return done
+
+    def seed_pages(self, count: int, image_dir: str = None, image_url_prefix: str = "/static/uploads") -> int:
+        """
+        Inserts the default pages plus count generated ones, each with an image.
+        Existing routes are left alone.
+        @param count: number of generated pages besides home, services and gallery
+        @param image_dir: when given, a placeholder PNG is written there for every page
+        @param image_url_prefix: URL prefix of the stored image_url
+        @return: number of pages inserted
+        """
+        rng = random.Random(f"{self.seed}:pages")
+        pages = list(DEFAULT_PAGES) + [(f"page-{i}", rng.choice(SUBJECTS)) for i in range(count)]
+        if image_dir:
+            os.makedirs(image_dir, exist_ok=True)
+        rows = []
+        for route, title in pages:
+            filename = f"seed-{route}.png"
+            if image_dir:
+                with open(os.path.join(image_dir, filename), "wb") as image:
+                    image.write(placeholder_png(rng))
+            paragraphs = (" ".join(rng.choices(WORDS, k=rng.randrange(30, 90))).capitalize() + "."
+                          for _ in range(rng.randrange(2, 8)))
+            page = compile_page(Page(route, title, "\n\n".join(paragraphs), f"{image_url_prefix}/{filename}"))
+            rows.append((page.route, page.title, page.content, page.image_url, page.content_html, page.excerpt,
+                         page.content_hash, json.dumps(page.images)))
+        inserted = self.connection.executemany(
+            f"INSERT INTO pages ({PAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(route) DO NOTHING",
+            rows,
+        ).rowcount
+        self.connection.commit()
+        self._report("pages", len(rows), len(rows))
+        self.database._bump_version("pages")
+        return inserted
+
+    def _report(self, kind: str, done: int, total: int) -> None:
+        if self.progress:
+            self.progress(kind, done, total)
+
+
+def seed_database(path: str, leads: int = 0, appointments: int = 0, pages: int = 0, seed: int = 0,
+                  image_dir: str = None, batch_size: int = BATCH_SIZE, progress=None, workers: int = None) -> dict:
+    """
+    Creates the schema if needed and fills it with synthetic data.
+    On SQLite durability is relaxed for the load (synchronous=OFF, in-memory journal): a crash leaves a
+    half-built test database, which is simply seeded again.
+    @param path: sqlite database file or postgresql:// URL
+    @param leads: number of leads
+    @param appointments: number of appointments
+    @param pages: number of generated pages
+    @param seed: random seed
+    @param image_dir: optional directory for page images
+    @param batch_size: rows per transaction
+    @param progress: optional callable(kind, done, total)
+    @param workers: encryption processes, defaults to the number of CPUs
+    @return: dict with the inserted counts and seconds per kind
+    """
+    stats = {}
+    with DatabaseOperation(path) as database:
+        sqlite = database.backend.name == "sqlite"
+        if sqlite:
+            database.connection.execute("PRAGMA synchronous=OFF")
+            database.connection.execute("PRAGMA journal_mode=MEMORY")
+            database.connection.execute("PRAGMA cache_size=-262144")
+        seeder = Seeder(database, seed=seed, batch_size=batch_size, progress=progress,
+                        workers=workers or os.cpu_count() or 1)
+        try:
+            seeder.create_tables()
+            for kind, run in (
+                ("pages", lambda: seeder.seed_pages(pages, image_dir)),
+                ("leads", lambda: seeder.seed_leads(leads)),
+                ("appointments", lambda: seeder.seed_appointments(appointments)),
+            ):
+                started = time.perf_counter()
+                stats[kind] = run()
+                stats[f"{kind}_seconds"] = round(time.perf_counter() - started, 3)
+        finally:
+            seeder.close()
+        if sqlite:
+            database.connection.execute("PRAGMA optimize")
+        else:
+            database.connection.execute("ANALYZE")
+    logger.info("Seeded %s: %s", path, stats)
+    return stats
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Fill a database with synthetic leads, appointments and pages")
+    parser.add_argument("database", help="sqlite database file, created if missing, or postgresql:// URL")
+    parser.add_argument("--leads", type=int, default=100000)
+    parser.add_argument("--appointments", type=int, default=100000)
+    parser.add_argument("--pages", type=int, default=200, help="pages besides home, services and gallery")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--image-dir", help="write placeholder page images here, e.g. static/uploads")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, help="encryption processes, defaults to the number of CPUs")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    stats = seed_database(
+        args.database,
+        leads=args.leads,
+        appointments=args.appointments,
+        pages=args.pages,
+        seed=args.seed,
+        image_dir=args.image_dir,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        progress=lambda kind, done, total: print(f"{kind}: {done}/{total}", flush=True),
+    )
+    print(f"{stats} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
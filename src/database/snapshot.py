@@ -0,0 +1,256 @@
+"""
+Module for serving reporting reads from a periodically refreshed copy of the database.
+
+The copy is made with the SQLite online backup API a few pages at a time, so the live connection is
+only ever blocked for one small step. Every refresh builds a fresh copy and swaps it in, so readers
+never see a half-copied snapshot. Only the skip is incremental: a refresh does nothing when nothing
+was committed since the previous one, but any commit means a full copy. The backup also starts over
+whenever another connection writes to the source during it, so on a database that is written to more
+often than a copy takes it may never finish; a copy is abandoned with an error after max_restarts
+restarts or max_seconds, and the previous snapshot stays in use.
+
+Readers borrow the current snapshot through reader(); a swapped out snapshot is closed as soon as the
+last request reading it returns it. Given a position callable, each snapshot remembers where a change
+feed stood when its copy started, so a page rendered from it can replay the changes it may be missing.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from src.database.backends import is_postgres_url
+from src.database.database import DatabaseOperation
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SECONDS_ENV = "REPORTING_SNAPSHOT_SECONDS"
+SNAPSHOT_FILE_ENV = "REPORTING_SNAPSHOT_FILE"
+
+
+class ReportingSnapshot:
+    """
+    Read-only copy of a SQLite database for admin and reporting queries
+    """
+
+    def __init__(self, source_path: str, refresh_seconds: float = 60.0, target_path: str = None,
+                 pages_per_step: int = 256, step_pause: float = 0.001, position=None, max_restarts: int = 20,
+                 max_seconds: float = 300.0) -> None:
+        """
+        @param source_path: live database file
+        @param refresh_seconds: interval between refresh attempts of the background thread
+        @param target_path: file to keep the snapshot in, in memory when not given
+        @param pages_per_step: database pages copied while holding the read lock on the source
+        @param step_pause: seconds slept between steps so writers get the lock
+        @param position: callable returning the change feed position, read before every copy
+        @param max_restarts: times a copy may start over because the source was written to before it is abandoned
+        @param max_seconds: seconds a copy may take before it is abandoned
+        """
+        self.source_path = source_path
+        self.refresh_seconds = refresh_seconds
+        self.target_path = target_path
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        self._position = position
+        self.max_restarts = max_restarts
+        self.max_seconds = max_seconds
+        self._source = sqlite3.connect(source_path, check_same_thread=False)
+        self._database = None
+        self._data_version = None
+        self._refresh_lock = threading.Lock()
+        self._readers_lock = threading.Lock()
+        self._readers = {}
+        self._positions = {}
+        self._retired = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"refreshes": 0, "skipped": 0, "failures": 0, "last_refresh": None, "last_seconds": 0.0}
+
+    @property
+    def database(self) -> DatabaseOperation:
+        """
+        Current snapshot, taken on first use if no refresh happened yet
+        @return: DatabaseOperation over the snapshot connection
+        """
+        if self._database is None:
+            self.refresh()
+        return self._database
+
+    @contextmanager
+    def reader(self):
+        """
+        Lends the current snapshot for the duration of a request; it stays open until returned
+        even if a refresh swaps in a newer one meanwhile
+        @return: context manager yielding a DatabaseOperation
+        """
+        if self._database is None:
+            self.refresh()
+        with self._readers_lock:
+            database = self._database
+            self._readers[database] = self._readers.get(database, 0) + 1
+        try:
+            yield database
+        finally:
+            close = False
+            with self._readers_lock:
+                self._readers[database] -= 1
+                if not self._readers[database]:
+                    del self._readers[database]
+                    close = database in self._retired
+                    self._retired.discard(database)
+            if close:
+                self._close(database)
+
+    def position(self, database: DatabaseOperation) -> str | None:
+        """
+        Returns the change feed position read before the given snapshot was copied; every change up to
+        it is in the snapshot, later ones may or may not be
+        @param database: snapshot lent by reader()
+        @return: str or None without a position callable
+        """
+        with self._readers_lock:
+            return self._positions.get(database)
+
+    def _close(self, database: DatabaseOperation) -> None:
+        with self._readers_lock:
+            self._positions.pop(database, None)
+        database.close()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Copies the source into a new snapshot and swaps it in
+        @param force: copy even if nothing was committed since the last refresh
+        @return: True when a new snapshot was taken
+        """
+        with self._refresh_lock:
+            # data_version changes whenever another connection commits to the source
+            data_version = self._source.execute("PRAGMA data_version").fetchone()[0]
+            if not force and self._database is not None and data_version == self._data_version:
+                self._stats["skipped"] += 1
+                return False
+            started = time.perf_counter()
+            position = self._position() if self._position else None
+            try:
+                connection = self._copy()
+            except sqlite3.Error as error:
+                self._stats["failures"] += 1
+                logger.error("Reporting snapshot refresh failed: %s", error)
+                return False
+            with self._readers_lock:
+                previous, self._database = self._database, DatabaseOperation(sqlite_connection=connection)
+                self._positions[self._database] = position
+                if previous is not None and self._readers.get(previous):
+                    # The last reader closes it
+                    self._retired.add(previous)
+                    previous = None
+            self._data_version = data_version
+            self._stats["refreshes"] += 1
+            self._stats["last_refresh"] = time.time()
+            self._stats["last_seconds"] = time.perf_counter() - started
+            logger.info("Reporting snapshot refreshed in %.3fs", self._stats["last_seconds"])
+        if previous is not None:
+            self._close(previous)
+        return True
+
+    def _copy(self) -> sqlite3.Connection:
+        if not self.target_path:
+            target = sqlite3.connect(":memory:", check_same_thread=False)
+            try:
+                self._backup(target)
+            except BaseException:
+                target.close()
+                raise
+            return target
+        building = f"{self.target_path}.building"
+        if os.path.exists(building):
+            os.remove(building)
+        target = sqlite3.connect(building)
+        try:
+            self._backup(target)
+        except BaseException:
+            target.close()
+            os.remove(building)
+            raise
+        target.close()
+        # Readers of the previous file keep their open descriptor, new ones see the complete copy
+        os.replace(building, self.target_path)
+        return sqlite3.connect(f"file:{self.target_path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _backup(self, target: sqlite3.Connection) -> None:
+        deadline = time.monotonic() + self.max_seconds
+        progress = {"remaining": None, "restarts": 0}
+
+        def step(status: int, remaining: int, total: int) -> None:
+            # A step that copied pages without getting closer to the end started over because of a write
+            previous = progress["remaining"]
+            if status == sqlite3.SQLITE_OK and previous is not None and remaining >= previous:
+                progress["restarts"] += 1
+            progress["remaining"] = remaining
+            if progress["restarts"] > self.max_restarts:
+                raise sqlite3.OperationalError(
+                    f"source written to during the copy, restarted {progress['restarts']} times")
+            if time.monotonic() > deadline:
+                raise sqlite3.OperationalError(
+                    f"copy took longer than {self.max_seconds}s, {remaining} of {total} pages left")
+            # The backup API only sleeps when the source is busy, so the pause between steps is taken here
+            if remaining:
+                time.sleep(self.step_pause)
+
+        self._source.backup(target, pages=self.pages_per_step, progress=step, sleep=self.step_pause)
+
+    def stats(self) -> dict:
+        """
+        Returns refresh counters and the age of the current snapshot
+        @return: dict
+        """
+        stats = dict(self._stats)
+        stats["age_seconds"] = time.time() - stats["last_refresh"] if stats["last_refresh"] else None
+        return stats
+
+    def start(self) -> None:
+        """
+        Refreshes the snapshot every refresh_seconds on a daemon thread
+        @return: null
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="reporting-snapshot", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.refresh_seconds)
+
+    def stop(self) -> None:
+        """
+        Stops the background refresh and closes every connection
+        @return: null
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._database is not None:
+            self._close(self._database)
+        self._source.close()
+
+
+def create_snapshot(source_path: str, position=None) -> ReportingSnapshot | None:
+    """
+    Returns a started snapshot when REPORTING_SNAPSHOT_SECONDS is set for a SQLite database, otherwise None
+    @param source_path: live database file or postgresql:// URL
+    @param position: callable returning the change feed position, see ReportingSnapshot
+    @return: ReportingSnapshot or None
+    """
+    seconds = os.environ.get(SNAPSHOT_SECONDS_ENV)
+    if not seconds:
+        return None
+    if is_postgres_url(source_path):
+        # PostgreSQL readers don't block writers, and replicas are the way to offload reporting there
+        logger.info("Reporting snapshot is SQLite only, reading %s directly", source_path.split("@")[-1])
+        return None
+    snapshot = ReportingSnapshot(source_path, float(seconds), os.environ.get(SNAPSHOT_FILE_ENV), position=position)
+    snapshot.start()
+    return snapshot
@@ -0,0 +1,228 @@
+"""
+Module for opt-in slow query tracing with EXPLAIN QUERY PLAN capture.
+
+Bound values are never recorded, only their types, so traces can be shared without leaking lead data.
+
+Usage:
+    python -m src.database.tracing show slow_queries.jsonl
+    python -m src.database.tracing explain contacts.db "select * from leads where visible = 1"
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from src.database.backends import SqliteConnection
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS_ENV = "SLOW_QUERY_MS"
+SLOW_QUERY_LOG_ENV = "SLOW_QUERY_LOG"
+PROGRESS_INTERVAL = 1000
+EXPLAINABLE = ("select", "insert", "update", "delete", "with", "replace")
+_log_lock = threading.Lock()
+
+
+class QueryTracer:
+    """
+    Connection observer recording statements slower than a threshold together with their query plan
+    """
+
+    def __init__(self, threshold_ms: float = 100.0, max_entries: int = 200, log_path: str = None,
+                 max_plans: int = 256) -> None:
+        self.threshold = threshold_ms / 1000.0
+        self.log_path = log_path
+        self.max_plans = max_plans
+        self._entries = deque(maxlen=max_entries)
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        # The progress handler runs on the thread stepping the statement, so steps are counted per thread
+        self._steps = threading.local()
+        self._raw = None
+
+    def attach(self, connection) -> None:
+        """
+        Starts tracing an InstrumentedConnection.
+        A progress handler counts virtual machine steps so full scans stand out from lock waits.
+        @param connection: InstrumentedConnection (e.g. DatabaseOperation.connection)
+        @return: null
+        """
+        # Query plans and step counts are SQLite features; other backends are only timed
+        if isinstance(connection.raw, SqliteConnection):
+            self._raw = connection.raw
+            self._raw.set_progress_handler(self._progress, PROGRESS_INTERVAL)
+        connection.add_observer(self)
+
+    def detach(self, connection) -> None:
+        """
+        Stops tracing a connection
+        @param connection: InstrumentedConnection previously attached
+        @return: null
+        """
+        connection.remove_observer(self)
+        if isinstance(connection.raw, SqliteConnection):
+            connection.raw.set_progress_handler(None, PROGRESS_INTERVAL)
+        self._raw = None
+
+    def _progress(self) -> int:
+        self._steps.count = getattr(self._steps, "count", 0) + PROGRESS_INTERVAL
+        return 0
+
+    def __call__(self, sql: str, parameters, seconds: float) -> None:
+        # Called once the statement's rows were fetched, so its steps are in; with several cursors open
+        # on one thread at a time the count is split between them approximately
+        count = getattr(self._steps, "count", 0)
+        steps = count - getattr(self._steps, "seen", 0)
+        self._steps.seen = count
+        if seconds < self.threshold:
+            return
+        entry = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "sql": " ".join(sql.split()),
+            "duration_ms": round(seconds * 1000, 3),
+            "vm_steps": steps,
+            "params": parameter_shape(parameters),
+            "plan": self._plan(sql, parameters),
+        }
+        with self._lock:
+            self._entries.append(entry)
+        # Every site's tracer may append to the same log file
+        with _log_lock:
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf8") as log_file:
+                        log_file.write(json.dumps(entry) + "\n")
+                except OSError as error:
+                    logger.error("Unable to write slow query log %s. %s", self.log_path, error)
+
+    def _plan(self, sql: str, parameters) -> list[str]:
+        if self._raw is None or not sql.lstrip().lower().startswith(EXPLAINABLE) or parameters is None:
+            return []
+        with self._lock:
+            plan = self._plans.get(sql)
+            if plan is not None:
+                self._plans.move_to_end(sql)
+                return plan
+        plan = explain(self._raw, sql, parameters)
+        with self._lock:
+            self._plans[sql] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def entries(self) -> list[dict]:
+        """
+        Returns recorded slow statements, newest first
+        @return: list of dicts
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def summary(self) -> list[dict]:
+        """
+        Groups recorded statements by SQL text
+        @return: list of dicts sorted by total time
+        """
+        return summarize(self.entries())
+
+
+def create_query_tracer(connection) -> QueryTracer | None:
+    """
+    Returns a tracer attached to a connection when SLOW_QUERY_MS is set, otherwise None
+    @param connection: InstrumentedConnection (e.g. DatabaseOperation.connection)
+    @return: QueryTracer or None
+    """
+    if not os.environ.get(SLOW_QUERY_MS_ENV):
+        return None
+    tracer = QueryTracer(threshold_ms=float(os.environ[SLOW_QUERY_MS_ENV]), log_path=os.environ.get(SLOW_QUERY_LOG_ENV))
+    tracer.attach(connection)
+    return tracer
+
+
+def parameter_shape(parameters):
+    """
+    Describes bound parameters by type only, never by value
+    @param parameters: sequence, mapping or None
+    @return: list or dict of type names
+    """
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+def explain(connection: sqlite3.Connection, sql: str, parameters=()) -> list[str]:
+    """
+    Runs EXPLAIN QUERY PLAN for a statement
+    @param connection: raw sqlite3 connection
+    @param sql: statement text
+    @param parameters: parameters the statement needs to compile
+    @return: list of plan detail lines
+    """
+    try:
+        rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+        return [row[3] for row in rows]
+    except sqlite3.Error as error:
+        return [f"explain failed: {error}"]
+
+
+def summarize(entries: list[dict]) -> list[dict]:
+    """
+    Aggregates slow query entries by statement
+    @param entries: entries as produced by QueryTracer
+    @return: list of dicts sorted by total time descending
+    """
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(entry["sql"], {
+            "sql": entry["sql"], "count": 0, "total_ms": 0.0, "max_ms": 0.0, "plan": entry["plan"],
+        })
+        group["count"] += 1
+        group["total_ms"] += entry["duration_ms"]
+        group["max_ms"] = max(group["max_ms"], entry["duration_ms"])
+    return sorted(groups.values(), key=lambda group: group["total_ms"], reverse=True)
+
+
+def load_log(path: str) -> list[dict]:
+    """
+    Reads a slow query JSON lines log
+    @param path: log file path
+    @return: list of entries
+    """
+    with open(path, encoding="utf8") as log_file:
+        return [json.loads(line) for line in log_file if line.strip()]
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Inspect slow SQLite queries")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="summarize a slow query log")
+    show.add_argument("log", help="JSON lines file written by QueryTracer")
+    show.add_argument("--top", type=int, default=20)
+    plan = commands.add_parser("explain", help="print the query plan of a statement")
+    plan.add_argument("database", help="sqlite database file")
+    plan.add_argument("sql", help="statement, use ? placeholders for parameters")
+    plan.add_argument("params", nargs="*", help="values for the placeholders")
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        for group in summarize(load_log(args.log))[:args.top]:
+            print(f"{group['total_ms']:10.1f} ms total {group['max_ms']:8.1f} ms max {group['count']:6d}x  {group['sql']}")
+            for detail in group["plan"]:
+                print(f"{'':>40}{detail}")
+    else:
+        connection = sqlite3.connect(args.database)
+        try:
+            for detail in explain(connection, args.sql, args.params):
+                print(detail)
+        finally:
+            connection.close()
+
+
+if __name__ == "__main__":
+    main()
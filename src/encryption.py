@@ -1,45 +1,83 @@
+import logging
 import os
-from cryptography.fernet import Fernet
+import time
+from cryptography.fernet import Fernet, MultiFernet
+from src.metrics import CRYPTO_SECONDS
+
+logger = logging.getLogger(__name__)
+
 
 class EncryptionService:
-    def __init__(self, key: bytes = None):
+    """
+    Field encryption with support for key rotation.
+    Keys are listed newest first: the first one encrypts, all of them can decrypt.
+    Sources in order: the key argument (bytes or list of bytes), ENCRYPTION_KEYS (comma separated),
+    ENCRYPTION_KEY, then secret.key (one key per line).
+    """
+
+    def __init__(self, key: bytes | list = None):
         if not key:
-            # Try env var first
+            # Try env vars first
+            env_keys = os.environ.get("ENCRYPTION_KEYS")
             env_key = os.environ.get("ENCRYPTION_KEY")
-            if env_key:
-                self.key = env_key.encode()
+            if env_keys:
+                keys = [k.strip().encode() for k in env_keys.split(",") if k.strip()]
+            elif env_key:
+                keys = [env_key.encode()]
             else:
                 # Try loading from file
                 key_file = "secret.key"
                 if os.path.exists(key_file):
                     with open(key_file, "rb") as f:
-                        self.key = f.read()
+                        keys = [line.strip() for line in f.read().splitlines() if line.strip()]
                 else:
                     # Generate and save
-                    self.key = Fernet.generate_key()
+                    keys = [Fernet.generate_key()]
                     with open(key_file, "wb") as f:
-                        f.write(self.key)
-                    print(f"WARNING: Generated new encryption key and saved to {key_file}.")
+                        f.write(keys[0])
+                    logger.warning("Generated new encryption key and saved to %s.", key_file)
+        elif isinstance(key, (list, tuple)):
+            keys = list(key)
         else:
-            self.key = key
+            keys = [key]
 
-        self.cipher_suite = Fernet(self.key)
+        self.keys = keys
+        self.key = keys[0]
+        self.cipher_suite = MultiFernet([Fernet(k) for k in keys])
 
     def encrypt(self, plain_text: str) -> str:
         if not plain_text:
             return ""
+        started = time.perf_counter()
         encrypted_text = self.cipher_suite.encrypt(plain_text.encode())
+        CRYPTO_SECONDS.observe(time.perf_counter() - started, "encrypt")
         return encrypted_text.decode()
 
     def decrypt(self, encrypted_text: str) -> str:
         if not encrypted_text:
             return ""
+        started = time.perf_counter()
         try:
             decrypted_text = self.cipher_suite.decrypt(encrypted_text.encode())
+            CRYPTO_SECONDS.observe(time.perf_counter() - started, "decrypt")
             return decrypted_text.decode()
         except Exception as e:
             # If decryption fails (e.g. wrong key or not encrypted), return original text or empty
             # For robustness in dev when mixing plain/encrypted, we might return original if it fails
             # But strictly, we should probably log error.
-            print(f"Decryption failed: {e}")
+            logger.error("Decryption failed: %s", e)
             return encrypted_text
+
+    def rotate(self, encrypted_text: str) -> str:
+        """
+        Re-encrypts a token under the primary key
+        @param encrypted_text: token produced with any configured key
+        @return: token encrypted with the primary key
+        @raise cryptography.fernet.InvalidToken: when no configured key can decrypt the token
+        """
+        if not encrypted_text:
+            return ""
+        started = time.perf_counter()
+        rotated = self.cipher_suite.rotate(encrypted_text.encode())
+        CRYPTO_SECONDS.observe(time.perf_counter() - started, "rotate")
+        return rotated.decode()
@@ -0,0 +1,59 @@
+"""
+Module for in-process publish/subscribe between the data layer and the web layer.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+PAGE_CHANGED = "page_changed"
+CONTACT_CHANGED = "contact_changed"
+
+
+class EventBus:
+    """
+    Synchronous event bus: handlers run in the publisher's thread, in subscription order.
+    A failing handler is logged and never breaks the publisher or the other handlers.
+    """
+
+    def __init__(self) -> None:
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic: str, handler) -> None:
+        """
+        Registers a handler for a topic
+        @param topic: event name, e.g. PAGE_CHANGED
+        @param handler: callable receiving the event payload as keyword arguments
+        @return: null
+        """
+        with self._lock:
+            self._handlers[topic].append(handler)
+
+    def unsubscribe(self, topic: str, handler) -> None:
+        """
+        Removes a handler
+        @param topic: event name
+        @param handler: previously subscribed callable
+        @return: null
+        """
+        with self._lock:
+            if handler in self._handlers[topic]:
+                self._handlers[topic].remove(handler)
+
+    def publish(self, topic: str, **payload) -> int:
+        """
+        Calls every handler of a topic
+        @param topic: event name
+        @param payload: keyword arguments passed to the handlers
+        @return: number of handlers called
+        """
+        with self._lock:
+            handlers = list(self._handlers[topic])
+        for handler in handlers:
+            try:
+                handler(**payload)
+            except Exception:
+                logger.exception("Handler %r for %s failed", handler, topic)
+        return len(handlers)
@@ -1,4 +1,85 @@
 import hashlib
+import hmac
+import os
+import unicodedata
+
+HASH_KEY_ENV = "HASH_KEY"
+HASH_KEY_FILE = "hash.key"
+
 
 def get_hash(text: str) -> str:
+    """
+    Legacy unkeyed SHA-256, kept so rows written before the keyed hash can still be found and migrated
+    @param text: value to hash
+    @return: hex str
+    """
     return hashlib.sha256(text.encode()).hexdigest()
+
+
+def canonicalize(text: str) -> str:
+    """
+    Canonical form used before hashing so A@x.com and a@x.com map to the same lead
+    @param text: raw value
+    @return: NFKC normalized, trimmed, case folded text
+    """
+    return unicodedata.normalize("NFKC", text).strip().casefold()
+
+
+def load_key(env_name: str, key_file: str) -> bytes:
+    """
+    Loads a secret key from an environment variable, then a key file, generating the file if needed
+    @param env_name: environment variable holding the key
+    @param key_file: fallback key file
+    @return: bytes
+    """
+    env_key = os.environ.get(env_name)
+    if env_key:
+        return env_key.encode()
+    if os.path.exists(key_file):
+        with open(key_file, "rb") as f:
+            return f.read()
+    key = os.urandom(32).hex().encode()
+    with open(key_file, "wb") as f:
+        f.write(key)
+    return key
+
+
+class HashingService:
+    """
+    Keyed HMAC-SHA256 hashing. The keyed context is built once and copied for every value,
+    so the key schedule isn't recomputed per call.
+    """
+
+    def __init__(self, key: bytes = None, domain: bytes = b"", canonicalizer=canonicalize,
+                 digest_size: int = 32) -> None:
+        if not key:
+            key = load_key(HASH_KEY_ENV, HASH_KEY_FILE)
+        self._base = hmac.new(key, domain, hashlib.sha256)
+        self.canonicalizer = canonicalizer
+        self.digest_size = digest_size
+
+    def hash(self, text: str) -> str:
+        """
+        Hashes one value
+        @param text: value to hash, canonicalized first
+        @return: hex str
+        """
+        mac = self._base.copy()
+        mac.update(self.canonicalizer(text).encode())
+        return mac.digest()[:self.digest_size].hex()
+
+    def hash_many(self, texts) -> list[str]:
+        """
+        Hashes a batch of values, e.g. for imports
+        @param texts: iterable of values
+        @return: list of hex str in input order
+        """
+        copy = self._base.copy
+        canonicalizer = self.canonicalizer
+        size = self.digest_size
+        hashes = []
+        for text in texts:
+            mac = copy()
+            mac.update(canonicalizer(text).encode())
+            hashes.append(mac.digest()[:size].hex())
+        return hashes
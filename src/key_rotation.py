@@ -0,0 +1,357 @@
+"""
+Module for re-encrypting stored fields after an encryption key rotation.
+
+Put the new key first in ENCRYPTION_KEYS (keeping the old ones after it), restart, then run the job.
+Live traffic keeps working throughout because every configured key can still decrypt. Progress is
+stored per primary key, so the first run after the next rotation starts over by itself.
+
+Archived leads keep their ciphertext inside compressed batches, so an old key may only be dropped once
+the job has also been run with the lead archive, which rewrites every batch with the primary key.
+
+Usage:
+    python -m src.key_rotation run contacts.db --batch-size 200 --rate 2000 --archive contacts-archive.db
+    python -m src.key_rotation benchmark --rows 20000
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from src.archive import ARCHIVE_BATCHES_TABLE_NAME, LEAD_COLUMNS
+from src.database.database import DatabaseOperation
+from src.encryption import EncryptionService
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TABLE_NAME = "reencryption_progress"
+ENCRYPTED_COLUMNS = {
+    "leads": ("phone_number", "email"),
+    "appointments": ("phone_number",),
+}
+
+
+class ReencryptionJob:
+    """
+    Resumable background job rotating every encrypted column to the primary key.
+    Rows are processed by primary key in small transactions, the position is stored in
+    reencryption_progress within the same transaction, and an optional rows/sec cap keeps
+    the job from starving live requests of the write lock. Given the lead archive, its batches
+    are rotated last, one per transaction.
+    """
+
+    def __init__(self, database: DatabaseOperation, batch_size: int = 200, rows_per_second: float = None,
+                 columns: dict = None, archive_path: str = None) -> None:
+        self.database = database
+        self.archive_path = archive_path
+        self.connection = database.connection
+        self.encryption = database.encryption
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+        self.columns = columns or ENCRYPTED_COLUMNS
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._progress = {"rows": 0, "failed": 0, "seconds": 0.0, "running": False, "tables": {}}
+
+    def create_progress_table(self) -> None:
+        self.connection.execute(
+            f"create table if not exists {PROGRESS_TABLE_NAME}("
+            "table_name TEXT PRIMARY KEY,"
+            "last_id INTEGER NOT NULL,"
+            "rows_done INTEGER NOT NULL,"
+            "finished INTEGER NOT NULL DEFAULT 0,"
+            "key_id TEXT)"
+        )
+        columns = {column[0] for column in
+                   self.connection.execute(f"select * from {PROGRESS_TABLE_NAME} limit 0").description}
+        if "key_id" not in columns:
+            self.connection.execute(f"ALTER TABLE {PROGRESS_TABLE_NAME} ADD COLUMN key_id TEXT")
+        self.connection.commit()
+
+    @property
+    def key_id(self) -> str:
+        """
+        Fingerprint of the primary key the stored progress belongs to
+        @return: str
+        """
+        return hashlib.sha256(self.encryption.key).hexdigest()[:16]
+
+    def reset(self) -> None:
+        """
+        Forgets stored positions so the next run starts over, e.g. after adding another new key
+        @return: null
+        """
+        self.create_progress_table()
+        self.connection.execute(f"DELETE FROM {PROGRESS_TABLE_NAME}")
+        self.connection.commit()
+
+    def run(self) -> dict:
+        """
+        Re-encrypts every table, resuming from the stored position
+        @return: progress dict
+        """
+        self.create_progress_table()
+        started = time.perf_counter()
+        with self._lock:
+            self._progress["running"] = True
+        try:
+            for table, columns in self.columns.items():
+                if self._stop.is_set():
+                    break
+                self._run_table(table, columns, started)
+            if self.archive_path and os.path.exists(self.archive_path) and not self._stop.is_set():
+                self._run_archive(started)
+        finally:
+            with self._lock:
+                self._progress["running"] = False
+                self._progress["seconds"] = time.perf_counter() - started
+        return self.progress()
+
+    def _position(self, table: str) -> tuple:
+        row = self.connection.execute(
+            f"select last_id, rows_done, finished, key_id from {PROGRESS_TABLE_NAME} where table_name = ?", (table,)
+        ).fetchone()
+        # Progress recorded for another primary key belongs to an earlier rotation
+        return row[:3] if row and row[3] == self.key_id else (0, 0, 0)
+
+    def _save_position(self, table: str, last_id: int, rows_done: int, finished: bool) -> None:
+        self.connection.execute(
+            f"INSERT INTO {PROGRESS_TABLE_NAME} (table_name, last_id, rows_done, finished, key_id)"
+            " VALUES (?, ?, ?, ?, ?) ON CONFLICT(table_name) DO UPDATE SET last_id = excluded.last_id,"
+            " rows_done = excluded.rows_done, finished = excluded.finished, key_id = excluded.key_id",
+            (table, last_id, rows_done, int(finished), self.key_id),
+        )
+
+    def _run_table(self, table: str, columns: tuple, started: float) -> None:
+        last_id, rows_done, finished = self._position(table)
+        total = self.connection.execute(f"select count(*) from {table} where id > ?", (last_id,)).fetchone()[0]
+        self._update_table_progress(table, rows_done, rows_done + total, bool(finished))
+        if finished:
+            return
+
+        column_list = ", ".join(columns)
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        guards = " and ".join(f"{column} = ?" for column in columns)
+        while not self._stop.is_set():
+            batch_started = time.perf_counter()
+            rows = self.connection.execute(
+                f"select id, {column_list} from {table} where id > ? order by id limit ?",
+                (last_id, self.batch_size),
+            ).fetchall()
+            if not rows:
+                self._save_position(table, last_id, rows_done, True)
+                self.connection.commit()
+                self._update_table_progress(table, rows_done, rows_done, True)
+                return
+
+            updates, failed = [], 0
+            for row_id, *values in rows:
+                try:
+                    rotated = [self.encryption.rotate(value) for value in values]
+                except InvalidToken:
+                    failed += 1
+                    continue
+                # Compare-and-set on the old ciphertext so a concurrent live update is never overwritten
+                updates.append((*rotated, row_id, *values))
+            self.connection.executemany(f"UPDATE {table} SET {assignments} WHERE id = ? and {guards}", updates)
+            last_id = rows[-1][0]
+            rows_done += len(rows)
+            self._save_position(table, last_id, rows_done, False)
+            self.connection.commit()
+
+            with self._lock:
+                self._progress["rows"] += len(rows)
+                self._progress["failed"] += failed
+                self._progress["seconds"] = time.perf_counter() - started
+            self._update_table_progress(table, rows_done, None, False)
+            if failed:
+                logger.warning("%s rows in %s could not be decrypted with any configured key", failed, table)
+            self._throttle(len(rows), time.perf_counter() - batch_started)
+
+    def _run_archive(self, started: float) -> None:
+        """
+        Rotates the leads inside the archive's compressed batches, one batch per transaction. The position is
+        stored in the live database after the archive commit, so a crash in between rotates a batch twice.
+        """
+        table = ARCHIVE_BATCHES_TABLE_NAME
+        last_id, rows_done, finished = self._position(table)
+        archive = sqlite3.connect(self.archive_path)
+        try:
+            total = archive.execute(
+                f"select coalesce(sum(rows), 0) from {table} where id > ?", (last_id,)
+            ).fetchone()[0]
+            self._update_table_progress(table, rows_done, rows_done + total, bool(finished))
+            if finished:
+                return
+            positions = [LEAD_COLUMNS.index(column) for column in self.columns.get("leads", ())]
+            while not self._stop.is_set():
+                batch_started = time.perf_counter()
+                batch = archive.execute(
+                    f"select id, data from {table} where id > ? order by id limit 1", (last_id,)
+                ).fetchone()
+                if batch is None:
+                    self._save_position(table, last_id, rows_done, True)
+                    self.connection.commit()
+                    self._update_table_progress(table, rows_done, rows_done, True)
+                    return
+
+                batch_id, data = batch
+                leads, failed = json.loads(zlib.decompress(data)), 0
+                for values in leads:
+                    try:
+                        rotated = [self.encryption.rotate(values[position]) for position in positions]
+                    except InvalidToken:
+                        failed += 1
+                        continue
+                    for position, value in zip(positions, rotated):
+                        values[position] = value
+                archive.execute(f"UPDATE {table} SET data = ? WHERE id = ?",
+                                (zlib.compress(json.dumps(leads).encode("utf-8"), 9), batch_id))
+                archive.commit()
+                last_id = batch_id
+                rows_done += len(leads)
+                self._save_position(table, last_id, rows_done, False)
+                self.connection.commit()
+
+                with self._lock:
+                    self._progress["rows"] += len(leads)
+                    self._progress["failed"] += failed
+                    self._progress["seconds"] = time.perf_counter() - started
+                self._update_table_progress(table, rows_done, None, False)
+                if failed:
+                    logger.warning("%s archived leads in batch %s could not be decrypted with any configured key",
+                                   failed, batch_id)
+                self._throttle(len(leads), time.perf_counter() - batch_started)
+        finally:
+            archive.close()
+
+    def _throttle(self, rows: int, elapsed: float) -> None:
+        if not self.rows_per_second:
+            return
+        wait = rows / self.rows_per_second - elapsed
+        if wait > 0:
+            self._stop.wait(wait)
+
+    def _update_table_progress(self, table: str, done: int, total: int | None, finished: bool) -> None:
+        with self._lock:
+            entry = self._progress["tables"].setdefault(table, {"done": 0, "total": 0, "finished": False})
+            entry["done"] = done
+            if total is not None:
+                entry["total"] = total
+            entry["finished"] = finished
+
+    def progress(self) -> dict:
+        """
+        Returns rows processed, failures, rows/sec and per table position
+        @return: dict
+        """
+        with self._lock:
+            progress = {
+                "rows": self._progress["rows"],
+                "failed": self._progress["failed"],
+                "seconds": self._progress["seconds"],
+                "running": self._progress["running"],
+                "tables": {name: dict(entry) for name, entry in self._progress["tables"].items()},
+            }
+        progress["rows_per_second"] = progress["rows"] / progress["seconds"] if progress["seconds"] else 0.0
+        return progress
+
+    def start(self) -> None:
+        """
+        Runs the job on a daemon thread
+        @return: null
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="reencryption", daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Waits for the background thread
+        @param timeout: seconds to wait
+        @return: True while the job is still running
+        """
+        if self._thread:
+            self._thread.join(timeout)
+            return self._thread.is_alive()
+        return False
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Asks the job to stop after the current batch; it can be resumed later
+        @param timeout: seconds to wait for the thread
+        @return: null
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+def benchmark(rows: int = 20000, batch_size: int = 200) -> dict:
+    """
+    Measures re-encryption throughput on a synthetic in-memory leads table
+    @param rows: number of leads
+    @param batch_size: rows per transaction
+    @return: progress dict including rows_per_second
+    """
+    old_key, new_key = Fernet.generate_key(), Fernet.generate_key()
+    old = EncryptionService(old_key)
+    connection = sqlite3.connect(":memory:")
+    database = DatabaseOperation(sqlite_connection=connection)
+    database.create_leads_table("leads")
+    database.create_appointment_table("appointments")
+    connection.executemany(
+        "INSERT INTO leads (first_name, last_name, phone_number, email, email_hash, subject, message, visible)"
+        " VALUES ('First', 'Last', ?, ?, ?, 'Subject', 'Message', 1)",
+        ((old.encrypt(f"1800555{i:04d}"), old.encrypt(f"lead{i}@example.com"), str(i)) for i in range(rows)),
+    )
+    connection.commit()
+    database.encryption = EncryptionService([new_key, old_key])
+    job = ReencryptionJob(database, batch_size=batch_size)
+    result = job.run()
+    database.close()
+    return result
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Re-encrypt stored fields with the primary key")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="rotate every encrypted column of a database")
+    run.add_argument("database", help="sqlite database file")
+    run.add_argument("--batch-size", type=int, default=200)
+    run.add_argument("--rate", type=float, default=None, help="maximum rows per second")
+    run.add_argument("--restart", action="store_true", help="ignore stored progress")
+    run.add_argument("--archive", default=None, help="lead archive file whose batches are rotated as well")
+    bench = commands.add_parser("benchmark", help="measure rows/sec on synthetic data")
+    bench.add_argument("--rows", type=int, default=20000)
+    bench.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.command == "benchmark":
+        result = benchmark(args.rows, args.batch_size)
+        print(f"{result['rows']} rows in {result['seconds']:.2f}s: {result['rows_per_second']:.0f} rows/sec")
+        return
+
+    with DatabaseOperation(args.database) as database:
+        job = ReencryptionJob(database, batch_size=args.batch_size, rows_per_second=args.rate,
+                              archive_path=args.archive)
+        if args.restart:
+            job.reset()
+        job.start()
+        while job.join(1.0):
+            progress = job.progress()
+            print(f"{progress['rows']} rows, {progress['failed']} failed, {progress['rows_per_second']:.0f} rows/sec")
+        print(job.progress())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Module for the admin change feed served as Server-Sent Events.
+
+A ChangeFeed per site listens to the site's EventBus and turns every contact and page change into one
+SSE message, formatted once in the writer's thread from data the writer already has, and kept in a
+small ring buffer. Streams only wait on a shared condition and copy the new messages out of the buffer,
+so an idle admin tab costs a blocked thread (or greenlet) and no database work. Message ids let a
+reconnecting browser resume where it stopped.
+
+The bus only sees writes made by this process. Changes committed by other workers are noticed by
+comparing the cache versions once per keepalive for the whole feed, and make the browsers resync by
+reloading the page, as do reconnects that cannot be resumed from the buffer.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from src.database.backends import DatabaseError
+from src.events import CONTACT_CHANGED, PAGE_CHANGED
+
+logger = logging.getLogger(__name__)
+
+FEED_VERSIONS = ("contacts", "pages")
+RETRY_MILLISECONDS = 3000
+
+
+def sse_message(event: str, data: dict, message_id: str = None) -> str:
+    """
+    Formats one Server-Sent Events message
+    @param event: event name the browser listens for
+    @param data: JSON serialisable payload, kept on a single data line
+    @param message_id: id the browser sends back as Last-Event-ID when it reconnects
+    @return: str
+    """
+    head = f"id: {message_id}\n" if message_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChangeFeed:
+    """
+    Fans out contact and page changes of one site to any number of SSE streams
+    """
+
+    def __init__(self, database, buffer_size: int = 256, keepalive_seconds: float = 15.0,
+                 max_streams: int = 100) -> None:
+        """
+        @param database: the site's DatabaseOperation, whose events are published
+        @param buffer_size: messages kept for reconnecting streams
+        @param keepalive_seconds: idle streams get a comment this often, which also detects gone clients
+        @param max_streams: open streams accepted
+        """
+        self.database = database
+        self.keepalive_seconds = keepalive_seconds
+        self.max_streams = max_streams
+        self._token = uuid.uuid4().hex[:8]
+        self._messages = deque(maxlen=buffer_size)
+        self._sequence = 0
+        self._streams = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._poll_lock = threading.Lock()
+        self._polled_at = time.monotonic()
+        self._versions = self._read_versions()
+        self._polled = dict(self._versions)
+        database.events.subscribe(CONTACT_CHANGED, self._on_contact_changed)
+        database.events.subscribe(PAGE_CHANGED, self._on_page_changed)
+
+    def _read_versions(self) -> dict:
+        versions = self.database.get_cache_versions()
+        return {name: versions.get(name, 0) for name in FEED_VERSIONS}
+
+    def _append(self, event: str, data: dict, versions: dict = None) -> None:
+        with self._condition:
+            self._sequence += 1
+            self._messages.append((self._sequence, sse_message(event, data, f"{self._token}-{self._sequence}")))
+            for name, version in (versions or {}).items():
+                if version is not None and version > self._versions.get(name, 0):
+                    self._versions[name] = version
+            self._condition.notify_all()
+
+    def _on_contact_changed(self, lead_id: int, contact=None, version: int = None) -> None:
+        if contact is None:
+            self._append("contact_removed", {"id": lead_id}, {"contacts": version})
+        else:
+            self._append("contact", contact._asdict(), {"contacts": version})
+
+    def _on_page_changed(self, route: str, version: int = None) -> None:
+        page = self.database.get_page_by_route(route)
+        data = {"route": route}
+        if page is not None:
+            data.update(title=page.title, preview=page.excerpt, image_url=page.image_url)
+        self._append("page" if page else "page_removed", data, {"pages": version})
+
+    def last_event_id(self) -> str:
+        """
+        Returns the id of the newest message, for a page rendered now to resume its stream from
+        @return: str
+        """
+        with self._condition:
+            return f"{self._token}-{self._sequence}"
+
+    def can_resume(self, last_event_id: str = None) -> bool:
+        """
+        Returns whether a stream starting at last_event_id would get every message since, without a resync
+        @param last_event_id: id a page was rendered at
+        @return: bool
+        """
+        with self._condition:
+            return bool(last_event_id) and self._resume_from(last_event_id) is not None
+
+    def accepting(self) -> bool:
+        with self._condition:
+            return not self._closed and self._streams < self.max_streams
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"streams": self._streams, "buffered": len(self._messages), "last_event_id": self.last_event_id()}
+
+    def _resume_from(self, last_event_id: str = None) -> int | None:
+        """
+        Returns the sequence a stream continues after, None when the messages since are gone
+        """
+        if not last_event_id:
+            return self._sequence
+        token, _, sequence = last_event_id.partition("-")
+        if token != self._token or not sequence.isdigit() or int(sequence) > self._sequence:
+            return None
+        oldest = self._messages[0][0] if self._messages else self._sequence + 1
+        return int(sequence) if int(sequence) >= oldest - 1 else None
+
+    def stream(self, last_event_id: str = None):
+        """
+        Yields SSE chunks until the client goes away or the feed is closed
+        @param last_event_id: Last-Event-ID of a reconnecting browser, or the id the page was rendered at
+        @return: generator of str
+        """
+        with self._condition:
+            self._streams += 1
+            cursor = self._resume_from(last_event_id)
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            while True:
+                if cursor is None:
+                    yield sse_message("resync", {})
+                    return
+                with self._condition:
+                    if not self._closed and self._sequence <= cursor:
+                        self._condition.wait(self.keepalive_seconds)
+                    if self._closed:
+                        return
+                    if self._messages and self._messages[0][0] > cursor + 1:
+                        # The stream fell further behind than the buffer reaches
+                        cursor = None
+                        continue
+                    pending = [message for sequence, message in self._messages if sequence > cursor]
+                    cursor = self._sequence
+                if pending:
+                    yield "".join(pending)
+                else:
+                    self._check_versions()
+                    yield ": keepalive\n\n"
+        finally:
+            with self._condition:
+                self._streams -= 1
+
+    def _check_versions(self) -> None:
+        """
+        Publishes a resync when another process changed contacts or pages, at most once per keepalive.
+        A version must be seen ahead on two polls in a row, so our own commit racing its event is no reason.
+        """
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self._polled_at < self.keepalive_seconds:
+                return
+            self._polled_at = time.monotonic()
+            try:
+                versions = self._read_versions()
+            except DatabaseError as error:
+                logger.warning("Change feed version check failed: %s", error)
+                return
+            with self._condition:
+                stale = any(
+                    versions[name] > self._versions.get(name, 0) and versions[name] == self._polled.get(name)
+                    for name in FEED_VERSIONS
+                )
+                self._polled = versions
+            if stale:
+                logger.info("Changes from another process, asking admin pages to resync")
+                self._append("resync", {}, versions)
+        finally:
+            self._poll_lock.release()
+
+    def close(self) -> None:
+        """
+        Ends every open stream
+        @return: null
+        """
+        self.database.events.unsubscribe(CONTACT_CHANGED, self._on_contact_changed)
+        self.database.events.unsubscribe(PAGE_CHANGED, self._on_page_changed)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
@@ -0,0 +1,140 @@
+"""
+Module for setting up the application logging pipeline.
+
+Request threads only put records on an in-memory queue; a background QueueListener formats them as
+JSON lines and writes them to a rotated file, so log I/O never happens on the request path.
+
+Environment:
+    LOG_FILE         output file (default app.log)
+    LOG_LEVEL        root level (default INFO)
+    LOG_LEVELS       per subsystem levels, e.g. "src.database=WARNING,src.notification=DEBUG"
+    LOG_SAMPLE_RATE  keep 1 in N INFO records from hot-path subsystems (default 10, 1 disables sampling)
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime, timezone
+
+LOG_FILE = "app.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+HOT_PATH_LOGGERS = ("src.database",)
+RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, including any extra= fields
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every `rate` INFO (and DEBUG) records from the given loggers; warnings and errors always pass
+    """
+
+    def __init__(self, rate: int, prefixes: tuple = HOT_PATH_LOGGERS) -> None:
+        super().__init__()
+        self.rate = max(1, rate)
+        self.prefixes = prefixes
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate == 1 or record.levelno > logging.INFO or not record.name.startswith(self.prefixes):
+            return True
+        return next(self._counter) % self.rate == 0
+
+
+def parse_levels(spec: str) -> dict:
+    """
+    Parses a "logger=LEVEL,logger=LEVEL" specification
+    @param spec: level specification
+    @return: dict of logger name -> level name
+    """
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(
+    log_file: str = None,
+    level: str = None,
+    levels: dict = None,
+    sample_rate: int = None,
+) -> logging.handlers.QueueListener:
+    """
+    Installs the queue based JSON logging pipeline on the root logger. Safe to call more than once.
+    @param log_file: rotated output file, defaults to $LOG_FILE or app.log
+    @param level: root level, defaults to $LOG_LEVEL or INFO
+    @param levels: per logger levels, defaults to $LOG_LEVELS
+    @param sample_rate: hot path INFO sampling rate, defaults to $LOG_SAMPLE_RATE or 10
+    @return: the running QueueListener
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+
+    log_file = log_file or os.environ.get("LOG_FILE", LOG_FILE)
+    level = level or os.environ.get("LOG_LEVEL", "INFO")
+    levels = levels if levels is not None else parse_levels(os.environ.get("LOG_LEVELS", ""))
+    if sample_rate is None:
+        sample_rate = int(os.environ.get("LOG_SAMPLE_RATE", "10"))
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf8"
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.addHandler(queue_handler)
+    _queue_handler = queue_handler
+    for name, logger_level in levels.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging() -> None:
+    """
+    Flushes queued records and stops the background listener
+    @return: null
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = None
+        _queue_handler = None
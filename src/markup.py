@@ -0,0 +1,198 @@
+"""
+Module for compiling page content from Markdown to HTML once, when a page is saved.
+
+The source is HTML escaped before any Markdown is recognised, so the output only contains the tags
+this module writes itself: raw HTML in a page shows up as text instead of being sanitised after the
+fact. Link and image URLs are limited to http(s), mailto and relative URLs.
+
+Supported: paragraphs, # headings, - / * / 1. lists, > quotes, ``` code blocks, --- rules, **strong**,
+*emphasis*, `code`, [links](url) and ![images](url "title").
+"""
+import hashlib
+import html
+import re
+from dataclasses import replace
+
+from src.page import Page
+
+EXCERPT_LENGTH = 160
+_FENCE = re.compile(r"^\s*```")
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+_UNORDERED = re.compile(r"^\s*[-*+]\s+(.*)$")
+_ORDERED = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+_QUOTE = re.compile(r"^\s*&gt;\s?(.*)$")
+_CODE_SPAN = re.compile(r"`([^`]+)`")
+_IMAGE = re.compile(r"!\[([^\]]*)\]\(\s*([^\s)]+)(?:\s+&quot;([^)]*?)&quot;)?\s*\)")
+_LINK = re.compile(r"\[([^\]]+)\]\(\s*([^\s)]+)\s*\)")
+_STRONG = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__")
+_EMPHASIS = re.compile(r"\*(?=\S)(.+?)(?<=\S)\*|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)")
+_PLACEHOLDER = re.compile("\x00(\\d+)\x00")
+_TAG = re.compile(r"<[^>]+>")
+_SCHEME = re.compile(r"^([a-z][a-z0-9+.\-]*):", re.IGNORECASE)
+_CONTROL = re.compile(r"[\x00-\x1f\x7f]")
+SAFE_SCHEMES = ("http", "https", "mailto")
+
+
+def _safe_url(url: str) -> str | None:
+    """
+    Returns an escaped URL if it is relative or has an allowed scheme, None for javascript: and the like.
+    Browsers strip leading and trailing controls and spaces and drop tabs and newlines anywhere before
+    reading the scheme, so the check runs on what they would see: the ends are trimmed the same way and
+    any control character left inside rejects the URL.
+    """
+    url = html.unescape(url).strip("".join(map(chr, range(0x21))))
+    if _CONTROL.search(url):
+        return None
+    scheme = _SCHEME.match(url)
+    if scheme and scheme.group(1).lower() not in SAFE_SCHEMES:
+        return None
+    return html.escape(url)
+
+
+def _inline(text: str, images: list) -> str:
+    """
+    Renders inline Markdown of escaped text; code spans are set aside first so nothing inside them is parsed
+    """
+    protected = []
+
+    def protect(fragment: str) -> str:
+        protected.append(fragment)
+        return f"\x00{len(protected) - 1}\x00"
+
+    text = _CODE_SPAN.sub(lambda match: protect(f"<code>{match.group(1)}</code>"), text)
+
+    def image(match) -> str:
+        alt, url, title = match.groups()
+        url = _safe_url(url)
+        if url is None:
+            return alt
+        # The list is for templates, which escape it again
+        if html.unescape(url) not in images:
+            images.append(html.unescape(url))
+        title_attribute = f' title="{title}"' if title else ""
+        return protect(f'<img src="{url}" alt="{alt}"{title_attribute} loading="lazy">')
+
+    def link(match) -> str:
+        label, url = match.groups()
+        url = _safe_url(url)
+        if url is None:
+            return label
+        # The tags are set aside so emphasis markers in the URL stay out of the href
+        return protect(f'<a href="{url}">') + label + protect("</a>")
+
+    text = _IMAGE.sub(image, text)
+    text = _LINK.sub(link, text)
+    text = _STRONG.sub(lambda match: f"<strong>{match.group(1) or match.group(2)}</strong>", text)
+    text = _EMPHASIS.sub(lambda match: f"<em>{match.group(1) or match.group(2)}</em>", text)
+    return _PLACEHOLDER.sub(lambda match: protected[int(match.group(1))], text)
+
+
+def render_markdown(source: str) -> tuple[str, list[str]]:
+    """
+    Compiles Markdown to HTML
+    @param source: page content
+    @return: (html, image URLs in order of appearance)
+    """
+    # NUL marks the protected fragments of _inline, so the source may not contain it
+    source = source.replace("\x00", "\ufffd").replace("\r\n", "\n")
+    lines = html.escape(source).split("\n")
+    blocks, images, paragraph, items, quote = [], [], [], None, []
+    list_tag = None
+
+    def flush() -> None:
+        nonlocal items, list_tag
+        if paragraph:
+            blocks.append(f"<p>{_inline(chr(10).join(paragraph), images)}</p>")
+            paragraph.clear()
+        if items is not None:
+            rendered = "".join(f"<li>{_inline(item, images)}</li>" for item in items)
+            blocks.append(f"<{list_tag}>{rendered}</{list_tag}>")
+            items, list_tag = None, None
+        if quote:
+            blocks.append(f"<blockquote><p>{_inline(chr(10).join(quote), images)}</p></blockquote>")
+            quote.clear()
+
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        index += 1
+        if _FENCE.match(line):
+            flush()
+            code = []
+            while index < len(lines) and not _FENCE.match(lines[index]):
+                code.append(lines[index])
+                index += 1
+            index += 1
+            blocks.append(f"<pre><code>{chr(10).join(code)}</code></pre>")
+            continue
+        if not line.strip():
+            flush()
+            continue
+        heading = _HEADING.match(line)
+        if heading:
+            flush()
+            level = len(heading.group(1))
+            blocks.append(f"<h{level}>{_inline(heading.group(2), images)}</h{level}>")
+            continue
+        if _RULE.match(line):
+            flush()
+            blocks.append("<hr>")
+            continue
+        unordered, ordered = _UNORDERED.match(line), _ORDERED.match(line)
+        if unordered or ordered:
+            tag = "ul" if unordered else "ol"
+            if items is None or list_tag != tag:
+                flush()
+                items, list_tag = [], tag
+            items.append((unordered or ordered).group(1))
+            continue
+        quoted = _QUOTE.match(line)
+        if quoted:
+            if not quote:
+                flush()
+            quote.append(quoted.group(1))
+            continue
+        if items is not None:
+            # A line right after a list item continues it
+            items[-1] += "\n" + line.strip()
+            continue
+        if quote:
+            flush()
+        paragraph.append(line)
+    flush()
+    return "\n".join(blocks), images
+
+
+def excerpt(content_html: str, length: int = EXCERPT_LENGTH) -> str:
+    """
+    Returns the start of the page as plain text, cut at a word boundary
+    @param content_html: compiled content
+    @param length: maximum characters
+    @return: str
+    """
+    text = " ".join(html.unescape(_TAG.sub(" ", content_html)).split())
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(" ", 1)[0] or text[:length]
+    return cut.rstrip(".,;:!?") + "…"
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def compile_page(page: Page, previous: Page = None) -> Page:
+    """
+    Fills in the compiled fields of a page, reusing those of the previous version when the content is unchanged
+    @param page: page as submitted
+    @param previous: stored version with its compiled fields, if any
+    @return: Page with content_html, excerpt, content_hash and images
+    """
+    digest = content_hash(page.content)
+    if previous is not None and previous.content_hash == digest:
+        return replace(page, content_html=previous.content_html, excerpt=previous.excerpt, content_hash=digest,
+                       images=previous.images)
+    content_html, images = render_markdown(page.content)
+    return replace(page, content_html=content_html, excerpt=excerpt(content_html), content_hash=digest,
+                   images=tuple(images))
@@ -0,0 +1,263 @@
+"""
+Module for low overhead in-process metrics exposed in the Prometheus text format.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int) -> None:
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """
+    Fixed bucket histogram with optional labels
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues) -> None:
+        """
+        Records one observation
+        @param value: observed value, seconds for latency histograms
+        @param labelvalues: label values in the order of labelnames
+        @return: null
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(labelvalues)
+            if child is None:
+                child = self._children[labelvalues] = _HistogramChild(len(self.buckets) + 1)
+            child.counts[index] += 1
+            child.sum += value
+            child.count += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """
+        Context manager observing the wall time of its block
+        @param labelvalues: label values in the order of labelnames
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def collect(self) -> list[str]:
+        """
+        Renders the histogram in the Prometheus text format
+        @return: list of lines
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            children = [(labels, list(c.counts), c.sum, c.count) for labels, c in self._children.items()]
+        for labelvalues, counts, total, count in sorted(children):
+            labels = _format_labels(self.labelnames, labelvalues)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_join(labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_join(labels, '+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_wrap(labels)} {total}")
+            lines.append(f"{self.name}_count{_wrap(labels)} {count}")
+        return lines
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labelvalues) -> None:
+        """
+        Increments the counter
+        @param amount: value to add
+        @param labelvalues: label values in the order of labelnames
+        @return: null
+        """
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self) -> list[str]:
+        """
+        Renders the counter in the Prometheus text format
+        @return: list of lines
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{_wrap(_format_labels(self.labelnames, labelvalues))} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds metrics and extra collectors and renders them for the /metrics endpoint
+    """
+
+    def __init__(self) -> None:
+        self._metrics = []
+        self._collectors = []
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector) -> None:
+        """
+        Adds a callable returning extra exposition lines, evaluated on every scrape
+        @param collector: callable returning a list of str
+        @return: null
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text format
+        @return: str
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    """
+    Per-request accumulator for SQL statements
+    """
+
+    __slots__ = ("started", "sql_count", "sql_seconds")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+
+_current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Wall time per route", ("method", "route", "status")
+)
+SQL_SECONDS = registry.histogram(
+    "db_statement_duration_seconds", "Duration of individual SQL statements, fetching their rows included",
+    ("statement",)
+)
+SQL_STATEMENTS_PER_REQUEST = registry.histogram(
+    "db_statements_per_request", "Number of SQL statements executed per request", ("route",), COUNT_BUCKETS
+)
+SQL_SECONDS_PER_REQUEST = registry.histogram(
+    "db_request_duration_seconds", "Total SQL time per request", ("route",)
+)
+CRYPTO_SECONDS = registry.histogram(
+    "encryption_duration_seconds", "Duration of field encryption and decryption", ("operation",)
+)
+PROVIDER_SECONDS = registry.histogram(
+    "notification_provider_duration_seconds", "Latency of outbound notification provider calls",
+    ("provider", "operation", "outcome"),
+)
+
+RATE_LIMITED = registry.counter(
+    "rate_limited_total", "Requests rejected by the rate limiter", ("endpoint",)
+)
+
+
+def begin_request() -> RequestStats:
+    """
+    Starts accumulating statistics for the current request context
+    @return: RequestStats
+    """
+    stats = RequestStats()
+    _current_request.set(stats)
+    return stats
+
+
+def end_request(method: str, route: str, status: int) -> None:
+    """
+    Observes the request wall time and its SQL totals, then clears the request context
+    @param method: HTTP method
+    @param route: matched route rule, not the raw path, to keep label cardinality bounded
+    @param status: response status code
+    @return: null
+    """
+    stats = _current_request.get()
+    if stats is None:
+        return
+    _current_request.set(None)
+    REQUEST_SECONDS.observe(time.perf_counter() - stats.started, method, route, str(status))
+    SQL_STATEMENTS_PER_REQUEST.observe(stats.sql_count, route)
+    SQL_SECONDS_PER_REQUEST.observe(stats.sql_seconds, route)
+
+
+def record_sql(sql: str, parameters, seconds: float) -> None:
+    """
+    Connection observer recording one SQL statement once its rows were fetched
+    @param sql: statement text
+    @param parameters: bound parameters (unused, part of the observer signature)
+    @param seconds: time spent executing the statement and fetching its rows
+    @return: null
+    """
+    SQL_SECONDS.observe(seconds, _statement_kind(sql))
+    stats = _current_request.get()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_seconds += seconds
+
+
+def _statement_kind(sql: str) -> str:
+    stripped = sql.lstrip()
+    return stripped[:stripped.find(" ")].lower() if " " in stripped else stripped.lower()
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _wrap(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+def _join(labels: str, bound) -> str:
+    upper = f'le="{bound}"'
+    return f"{{{labels},{upper}}}" if labels else f"{{{upper}}}"
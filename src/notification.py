@@ -1,42 +1,61 @@
+import logging
 import os
+import time
 from twilio.rest import Client
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
+from src.metrics import PROVIDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
 
 class NotificationService:
-    def __init__(self):
-        self.twilio_account_sid = os.environ.get("TWILIO_ACCOUNT_SID")
-        self.twilio_auth_token = os.environ.get("TWILIO_AUTH_TOKEN")
-        self.twilio_phone_number = os.environ.get("TWILIO_PHONE_NUMBER")
-        self.sendgrid_api_key = os.environ.get("SENDGRID_API_KEY")
-        self.sendgrid_from_email = os.environ.get("SENDGRID_FROM_EMAIL", "noreply@example.com")
+    def __init__(self, settings: dict = None):
+        # Per-site settings take precedence over the process environment
+        settings = settings or {}
+
+        def setting(name, default=None):
+            return settings.get(name) or os.environ.get(name, default)
+
+        self.twilio_account_sid = setting("TWILIO_ACCOUNT_SID")
+        self.twilio_auth_token = setting("TWILIO_AUTH_TOKEN")
+        self.twilio_phone_number = setting("TWILIO_PHONE_NUMBER")
+        self.sendgrid_api_key = setting("SENDGRID_API_KEY")
+        self.sendgrid_from_email = setting("SENDGRID_FROM_EMAIL", "noreply@example.com")
 
         if self.twilio_account_sid and self.twilio_auth_token:
             self.twilio_client = Client(self.twilio_account_sid, self.twilio_auth_token)
         else:
             self.twilio_client = None
-            print("Twilio credentials not found.")
+            logger.warning("Twilio credentials not found.")
 
     def send_sms(self, to_number: str, body: str) -> bool:
         if not self.twilio_client or not self.twilio_phone_number:
-            print("Twilio client not initialized or phone number missing.")
+            logger.warning("Twilio client not initialized or phone number missing.")
             return False
+        started = time.perf_counter()
+        outcome = "error"
         try:
             message = self.twilio_client.messages.create(
                 body=body,
                 from_=self.twilio_phone_number,
                 to=to_number
             )
-            print(f"SMS sent: {message.sid}")
+            logger.info("SMS sent: %s", message.sid)
+            outcome = "ok"
             return True
         except Exception as e:
-            print(f"Failed to send SMS: {e}")
+            logger.error("Failed to send SMS: %s", e)
             return False
+        finally:
+            PROVIDER_SECONDS.observe(time.perf_counter() - started, "twilio", "sms", outcome)
 
     def make_call(self, to_number: str, message: str) -> bool:
         if not self.twilio_client or not self.twilio_phone_number:
-            print("Twilio client not initialized or phone number missing.")
+            logger.warning("Twilio client not initialized or phone number missing.")
             return False
+        started = time.perf_counter()
+        outcome = "error"
         try:
             # TwiML to say the message
             twiml = f"<Response><Say>{message}</Say></Response>"
@@ -45,16 +64,21 @@ class NotificationService:
                 to=to_number,
                 from_=self.twilio_phone_number
             )
-            print(f"Call initiated: {call.sid}")
+            logger.info("Call initiated: %s", call.sid)
+            outcome = "ok"
             return True
         except Exception as e:
-            print(f"Failed to make call: {e}")
+            logger.error("Failed to make call: %s", e)
             return False
+        finally:
+            PROVIDER_SECONDS.observe(time.perf_counter() - started, "twilio", "call", outcome)
 
     def send_email(self, to_email: str, subject: str, content: str) -> bool:
         if not self.sendgrid_api_key:
-            print("SendGrid API key not found.")
+            logger.warning("SendGrid API key not found.")
             return False
+        started = time.perf_counter()
+        outcome = "error"
         try:
             message = Mail(
                 from_email=self.sendgrid_from_email,
@@ -64,8 +88,13 @@ class NotificationService:
             )
             sg = SendGridAPIClient(self.sendgrid_api_key)
             response = sg.send(message)
-            print(f"Email sent: {response.status_code}")
-            return response.status_code in [200, 201, 202]
+            logger.info("Email sent: %s", response.status_code)
+            if response.status_code in [200, 201, 202]:
+                outcome = "ok"
+                return True
+            return False
         except Exception as e:
-            print(f"Failed to send email: {e}")
+            logger.error("Failed to send email: %s", e)
             return False
+        finally:
+            PROVIDER_SECONDS.observe(time.perf_counter() - started, "sendgrid", "email", outcome)
@@ -0,0 +1,264 @@
+"""
+Module for relaying the outbox to the site's admins as digests.
+
+insert_contact_data and insert_appointment write an outbox row in the same transaction as the lead or
+appointment, so the public form only pays for one local write and no event is lost or invented by a
+rollback. The relay wakes every digest period, claims the waiting events with a lease, and sends one
+digest per batch by email and/or SMS through NotificationService. Events are deleted only after every
+channel accepted the digest. A failed send or a crash between sending and deleting means the events
+go out again in a later digest: delivery is at least once, never at most once.
+
+DIGEST_EMAIL and/or DIGEST_SMS enable the relay, from the site's notification settings or the
+environment; DIGEST_SECONDS sets the period (default 300). Several workers may run a relay for the
+same database; the lease keeps them from sending the same events twice.
+"""
+import html
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from src.database.backends import DatabaseError
+from src.database.database import DatabaseOperation, OUTBOX_TABLE_NAME
+
+logger = logging.getLogger(__name__)
+
+DIGEST_EMAIL_ENV = "DIGEST_EMAIL"
+DIGEST_SMS_ENV = "DIGEST_SMS"
+DIGEST_SECONDS_ENV = "DIGEST_SECONDS"
+TOPIC_LABELS = {"lead": ("new lead", "new leads"), "appointment": ("new booking", "new bookings")}
+MAX_BACKOFF_SECONDS = 3600.0
+
+
+def digest_summary(events: list[tuple]) -> str:
+    """
+    Counts events per topic, e.g. "3 new leads, 1 new booking"
+    @param events: list of (id, topic, payload dict, created_at)
+    @return: str
+    """
+    counts = Counter(topic for _, topic, _, _ in events)
+    parts = []
+    for topic, count in counts.items():
+        singular, plural = TOPIC_LABELS.get(topic, (topic, topic))
+        parts.append(f"{count} {singular if count == 1 else plural}")
+    return ", ".join(parts)
+
+
+def digest_sms(events: list[tuple]) -> str:
+    return f"{digest_summary(events)} since {datetime.fromtimestamp(events[0][3]):%b %d %H:%M}. See /admin."
+
+
+def digest_html(events: list[tuple]) -> str:
+    """
+    Lists every event of a digest; values come from the public forms and are escaped
+    @param events: list of (id, topic, payload dict, created_at)
+    @return: html str
+    """
+    items = []
+    for _, topic, payload, created_at in events:
+        when = f"{datetime.fromtimestamp(created_at):%b %d %H:%M}"
+        if topic == "lead":
+            text = f"Lead from {payload.get('name') or 'unknown'}: {payload.get('subject', '')}"
+        elif topic == "appointment":
+            text = f"Booking for {payload.get('event_name')} at {payload.get('location')} on {payload.get('date', '')[:10]}"
+        else:
+            text = f"{topic}: {json.dumps(payload)}"
+        items.append(f"<li>{when} {html.escape(text)}</li>")
+    return f"<p>{html.escape(digest_summary(events))}</p><ul>{''.join(items)}</ul>"
+
+
+class OutboxRelay:
+    """
+    Drains the outbox into periodic digests
+    """
+
+    def __init__(self, database: DatabaseOperation, notification_service, email: str = None, sms: str = None,
+                 interval_seconds: float = 300.0, batch_size: int = 200, lease_seconds: float = 300.0,
+                 clock=time.time) -> None:
+        """
+        @param database: database holding the outbox; the relay should own this connection
+        @param notification_service: NotificationService used to send the digests
+        @param email: digest email recipient
+        @param sms: digest SMS recipient
+        @param interval_seconds: digest period; events arriving in between are coalesced
+        @param batch_size: events per digest
+        @param lease_seconds: claimed events not deleted within this time are sent again, e.g. after a crash
+        @param clock: callable returning epoch seconds
+        """
+        self.database = database
+        self.connection = database.connection
+        self.notification_service = notification_service
+        self.email = email
+        self.sms = sms
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"digests": 0, "events": 0, "failed": 0}
+
+    def _claim(self) -> list[tuple]:
+        now = int(self.clock())
+        expired = now - int(self.lease_seconds)
+        # The outer condition is checked again by PostgreSQL on rows another relay claimed meanwhile
+        rows = self.connection.execute(
+            f"UPDATE {OUTBOX_TABLE_NAME} SET claimed_at = ? WHERE id IN"
+            f" (SELECT id FROM {OUTBOX_TABLE_NAME} WHERE claimed_at IS NULL OR claimed_at < ? ORDER BY id LIMIT ?)"
+            " AND (claimed_at IS NULL OR claimed_at < ?)"
+            " RETURNING id, topic, payload, created_at",
+            (now, expired, self.batch_size, expired),
+        ).fetchall()
+        self.connection.commit()
+        return sorted((row[0], row[1], json.loads(row[2]), row[3]) for row in rows)
+
+    def _deliver(self, events: list[tuple]) -> bool:
+        sent = True
+        if self.email:
+            subject = f"Digest: {digest_summary(events)}"
+            sent = self.notification_service.send_email(self.email, subject, digest_html(events)) and sent
+        if self.sms:
+            sent = self.notification_service.send_sms(self.sms, digest_sms(events)) and sent
+        return sent
+
+    def drain(self) -> int:
+        """
+        Sends every waiting event, one digest per batch, stopping at the first failed digest
+        @return: number of events delivered
+        """
+        delivered = 0
+        with self._lock:
+            while not self._stop.is_set():
+                events = self._claim()
+                if not events:
+                    break
+                ids = [event[0] for event in events]
+                placeholders = ", ".join("?" * len(ids))
+                try:
+                    sent = self._deliver(events)
+                except Exception as error:  # a failing provider must not kill the relay thread
+                    logger.error("Digest could not be sent: %s", error)
+                    sent = False
+                if not sent:
+                    # Released so the next attempt does not wait for the lease to expire
+                    self.connection.execute(
+                        f"UPDATE {OUTBOX_TABLE_NAME} SET claimed_at = NULL WHERE id IN ({placeholders})", ids
+                    )
+                    self.connection.commit()
+                    self._failures += 1
+                    self._stats["failed"] += 1
+                    logger.warning("Digest of %s events failed, retrying later", len(events))
+                    break
+                self.connection.execute(f"DELETE FROM {OUTBOX_TABLE_NAME} WHERE id IN ({placeholders})", ids)
+                self.connection.commit()
+                self._failures = 0
+                self._stats["digests"] += 1
+                self._stats["events"] += len(events)
+                delivered += len(events)
+        if delivered:
+            logger.info("%s outbox events sent as digests", delivered)
+        return delivered
+
+    def next_wait(self) -> float:
+        """
+        Returns the seconds until the next digest, backing off while sends fail
+        @return: float
+        """
+        if not self._failures:
+            return self.interval_seconds
+        return min(self.interval_seconds * 2 ** self._failures, max(MAX_BACKOFF_SECONDS, self.interval_seconds))
+
+    def has_pending(self) -> bool:
+        """
+        Returns whether events are waiting for a digest
+        @return: bool
+        """
+        try:
+            return self.connection.execute(f"select 1 from {OUTBOX_TABLE_NAME} limit 1").fetchone() is not None
+        except DatabaseError as error:
+            logger.warning("Unable to check the outbox: %s", error)
+            return True
+
+    def stats(self) -> dict:
+        """
+        Returns digest counters and the events waiting in the outbox
+        @return: dict
+        """
+        stats = dict(self._stats)
+        try:
+            with self._lock:
+                stats["waiting"], stats["oldest"] = self.connection.execute(
+                    f"select count(*), min(created_at) from {OUTBOX_TABLE_NAME}"
+                ).fetchone()
+        except DatabaseError:
+            stats["waiting"], stats["oldest"] = None, None
+        stats["recipients"] = [recipient for recipient in (self.email, self.sms) if recipient]
+        stats["running"] = bool(self._thread and self._thread.is_alive())
+        return stats
+
+    def start(self) -> None:
+        """
+        Sends a digest every interval on a daemon thread
+        @return: null
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.next_wait()):
+            try:
+                self.drain()
+            except DatabaseError as error:
+                self._failures += 1
+                logger.error("Outbox relay pass failed: %s", error)
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the relay and closes its connection; events still waiting are sent by the next relay to start
+        @param timeout: seconds to wait for the thread
+        @return: null
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning("Outbox relay still running after %ss, leaving its connection open", timeout)
+                return
+        self.database.close()
+
+
+def create_outbox_relay(database_file: str, notification_service, settings: dict = None) -> OutboxRelay | None:
+    """
+    Returns a started relay with its own connection when a digest recipient is configured, otherwise None
+    @param database_file: database of the site
+    @param notification_service: the site's NotificationService
+    @param settings: the site's notification settings, which take precedence over the environment
+    @return: OutboxRelay or None
+    """
+    settings = settings or {}
+
+    def setting(name, default=None):
+        return settings.get(name) or os.environ.get(name, default)
+
+    email, sms = setting(DIGEST_EMAIL_ENV), setting(DIGEST_SMS_ENV)
+    if not email and not sms:
+        return None
+    database = DatabaseOperation(database_file)
+    database.create_outbox_table()
+    relay = OutboxRelay(
+        database,
+        notification_service,
+        email=email,
+        sms=sms,
+        interval_seconds=float(setting(DIGEST_SECONDS_ENV, "300")),
+    )
+    relay.start()
+    return relay
@@ -1,14 +1,34 @@
+import json
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True, slots=True)
 class Page:
-    def __init__(self, route: str, title: str, content: str, image_url: str = ""):
-        self.route = route
-        self.title = title
-        self.content = content
-        self.image_url = image_url
+    """
+    Immutable page record; slots keep instances small when whole tables are listed.
+    content is the Markdown source; the fields after image_url are compiled from it when the page is
+    saved (see src.markup) and take no part in comparisons.
+    """
+    route: str
+    title: str
+    content: str
+    image_url: str = ""
+    content_html: str = field(default="", compare=False)
+    excerpt: str = field(default="", compare=False)
+    content_hash: str = field(default="", compare=False)
+    images: tuple = field(default=(), compare=False)
 
-    def __eq__(self, other):
-        if not isinstance(other, Page):
-            return False
-        return (self.route == other.route and
-                self.title == other.title and
-                self.content == other.content and
-                self.image_url == other.image_url)
+    @classmethod
+    def from_row(cls, cursor, row: tuple) -> "Page":
+        """
+        sqlite3 row factory for (route, title, content, image_url) rows, optionally followed by
+        (content_html, excerpt, content_hash, images JSON)
+        @param cursor: sqlite3 cursor, unused
+        @param row: tuple
+        @return: Page
+        """
+        if len(row) > 4:
+            route, title, content, image_url, content_html, excerpt, content_hash, images = row
+            return cls(route, title, content, image_url, content_html or "", excerpt or "", content_hash or "",
+                       tuple(json.loads(images)) if images else ())
+        return cls(*row)
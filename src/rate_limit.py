@@ -0,0 +1,130 @@
+"""
+Module for per-client token bucket rate limiting of the public form endpoints.
+
+MemoryRateLimiter keeps buckets in a fixed-size LRU inside the worker. SqliteRateLimiter keeps them in a
+small shared SQLite file so every worker process on a host enforces the same budget; each check is a
+single UPSERT ... RETURNING statement.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MAX_KEYS = 10000
+
+
+class MemoryRateLimiter:
+    """
+    In-process token buckets; the least recently seen keys are evicted once max_keys is reached
+    """
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = MAX_KEYS) -> None:
+        """
+        @param rate: tokens added per second
+        @param capacity: bucket size, i.e. the allowed burst
+        @param max_keys: maximum number of tracked clients
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        # key -> (tokens, updated); tuples keep each entry small
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key: str, cost: float = 1.0) -> tuple[bool, float]:
+        """
+        Takes tokens from a bucket if enough are available
+        @param key: client key, e.g. "ip:1.2.3.4"
+        @param cost: tokens this request costs
+        @return: (allowed, seconds until enough tokens are available)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / self.rate
+
+
+class SqliteRateLimiter:
+    """
+    Token buckets shared between worker processes through a SQLite file
+    """
+
+    def __init__(self, path: str, rate: float, capacity: float, max_keys: int = MAX_KEYS) -> None:
+        """
+        @param path: SQLite file shared by the workers
+        @param rate: tokens added per second
+        @param capacity: bucket size, i.e. the allowed burst
+        @param max_keys: above this many rows, idle full buckets are purged
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.connection = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute(
+            "create table if not exists rate_buckets("
+            "key TEXT PRIMARY KEY,"
+            "tokens REAL NOT NULL,"
+            "updated REAL NOT NULL,"
+            "allowed INTEGER NOT NULL) WITHOUT ROWID"
+        )
+
+    def allow(self, key: str, cost: float = 1.0) -> tuple[bool, float]:
+        """
+        Takes tokens from a bucket if enough are available
+        @param key: client key, e.g. "ip:1.2.3.4"
+        @param cost: tokens this request costs
+        @return: (allowed, seconds until enough tokens are available)
+        """
+        parameters = {"key": key, "cost": cost, "capacity": self.capacity, "rate": self.rate, "now": time.time()}
+        with self._lock:
+            # All SET expressions read the old row, so refill, check and deduct happen atomically
+            allowed, tokens = self.connection.execute(
+                "INSERT INTO rate_buckets (key, tokens, updated, allowed)"
+                " VALUES (:key, :capacity - :cost, :now, :capacity >= :cost)"
+                " ON CONFLICT(key) DO UPDATE SET"
+                "  tokens = min(:capacity, tokens + (:now - updated) * :rate)"
+                "   - (CASE WHEN min(:capacity, tokens + (:now - updated) * :rate) >= :cost THEN :cost ELSE 0 END),"
+                "  allowed = min(:capacity, tokens + (:now - updated) * :rate) >= :cost,"
+                "  updated = :now"
+                " RETURNING allowed, tokens",
+                parameters,
+            ).fetchone()
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                self._evict(parameters["now"])
+        return bool(allowed), 0.0 if allowed else (cost - tokens) / self.rate
+
+    def _evict(self, now: float) -> None:
+        count = self.connection.execute("select count(*) from rate_buckets").fetchone()[0]
+        if count > self.max_keys:
+            # A bucket idle long enough to be full again carries no state worth keeping
+            self.connection.execute(
+                "DELETE FROM rate_buckets WHERE updated < ?", (now - self.capacity / self.rate,)
+            )
+
+
+def create_limiter(rate: float, capacity: float, path: str = None):
+    """
+    Returns a shared SQLite limiter when a path is given, otherwise an in-process one
+    @param rate: tokens added per second
+    @param capacity: bucket size
+    @param path: optional shared SQLite file
+    @return: MemoryRateLimiter or SqliteRateLimiter
+    @raise ValueError: when rate or capacity is not positive
+    """
+    if rate <= 0 or capacity <= 0:
+        raise ValueError(f"Rate limits need a positive rate and burst, got rate={rate} and burst={capacity}")
+    if path:
+        return SqliteRateLimiter(path, rate, capacity)
+    return MemoryRateLimiter(rate, capacity)
@@ -0,0 +1,519 @@
+"""
+Module for sending appointment reminders.
+
+Reminder jobs (e.g. 24h and 1h before an appointment) are derived from the appointments table in
+batches, following a stored high-water mark of appointments.id, so a restart only looks at appointments
+added since. Pending jobs live in reminder_jobs with a partial index on their due time; only the jobs
+due within the next horizon are held in an in-memory heap, however many appointments are upcoming.
+Due jobs are claimed with a conditional update, so several workers can share one database, and sent
+through NotificationService.send_sms on a thread pool.
+
+REMINDER_OFFSETS enables the scheduler inside the app, e.g. "24h,1h". A site's scheduler runs while the
+site is open, and an idle site is not closed while it has reminders to send; the worker below can run
+instead of the in-app scheduler, e.g. on a separate node.
+
+Usage:
+    python -m src.reminders run contacts.db --offsets 24h,1h --workers 4
+    python -m src.reminders benchmark --appointments 100000
+"""
+import argparse
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from src.database.backends import DatabaseError
+from src.database.database import DatabaseOperation
+from src.database.seed import Seeder
+from src.notification import NotificationService
+
+logger = logging.getLogger(__name__)
+
+REMINDER_JOBS_TABLE_NAME = "reminder_jobs"
+REMINDER_CURSOR_TABLE_NAME = "reminder_cursor"
+REMINDER_OFFSETS_ENV = "REMINDER_OFFSETS"
+REMINDER_WORKERS_ENV = "REMINDER_WORKERS"
+DEFAULT_OFFSETS = "24h,1h"
+PENDING, SENDING, SENT, FAILED, SKIPPED = "pending", "sending", "sent", "failed", "skipped"
+UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+
+
+def parse_offsets(text: str) -> dict:
+    """
+    Parses reminder offsets
+    @param text: comma separated durations such as "24h,1h,30m"
+    @return: dict of label -> seconds before the appointment
+    """
+    offsets = {}
+    for label in (part.strip() for part in text.split(",")):
+        if not label:
+            continue
+        if label[-1] not in UNITS or not label[:-1].isdigit():
+            raise ValueError(f"Invalid reminder offset {label!r}, expected e.g. 24h or 30m")
+        offsets[label] = int(label[:-1]) * UNITS[label[-1]]
+    return offsets
+
+
+def reminder_message(event_name: str, location: str, when: datetime) -> str:
+    return f"Reminder: {event_name} at {location} on {when:%b %d at %H:%M}."
+
+
+class ReminderScheduler:
+    """
+    Persistent timer queue for appointment reminders
+    """
+
+    def __init__(self, database: DatabaseOperation, notification_service, offsets: dict = None, workers: int = 4,
+                 batch_size: int = 1000, horizon_seconds: float = 3600.0, scan_seconds: float = 30.0,
+                 max_attempts: int = 3, lease_seconds: float = 300.0, clock=time.time) -> None:
+        """
+        @param database: database holding the appointments; the scheduler should own this connection
+        @param notification_service: NotificationService used to send the reminders
+        @param offsets: label -> seconds before the appointment, defaults to 24h and 1h
+        @param workers: threads sending reminders
+        @param batch_size: appointments turned into jobs per transaction
+        @param horizon_seconds: how far ahead due jobs are loaded into memory
+        @param scan_seconds: how often new appointments are looked for
+        @param max_attempts: sends tried before a job is marked failed
+        @param lease_seconds: claimed jobs not finished within this time are retried, e.g. after a crash
+        @param clock: callable returning epoch seconds
+        """
+        self.database = database
+        self.connection = database.connection
+        self.notification_service = notification_service
+        self.offsets = offsets or parse_offsets(DEFAULT_OFFSETS)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.horizon_seconds = horizon_seconds
+        self.scan_seconds = scan_seconds
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._heap = []
+        self._queued = set()
+        self._loaded_until = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._scan_requested = False
+        self._pool = None
+        self._thread = None
+        self._stats = {"derived": 0, "sent": 0, "failed": 0, "retried": 0, "skipped": 0, "scanned": 0}
+
+    def create_tables(self) -> None:
+        with self._lock:
+            self.connection.execute(
+                f"create table if not exists {REMINDER_JOBS_TABLE_NAME}("
+                "id INTEGER PRIMARY KEY,"
+                "appointment_id INTEGER NOT NULL,"
+                "kind TEXT NOT NULL,"
+                "due_at INTEGER NOT NULL,"
+                "status TEXT NOT NULL,"
+                "attempts INTEGER NOT NULL DEFAULT 0,"
+                "claimed_at INTEGER,"
+                "UNIQUE(appointment_id, kind))"
+            )
+            # Only pending jobs are looked up by due time, so only they are indexed
+            self.connection.execute(
+                f"create index if not exists {REMINDER_JOBS_TABLE_NAME}_due on {REMINDER_JOBS_TABLE_NAME}(due_at)"
+                f" where status = '{PENDING}'"
+            )
+            self.connection.execute(
+                f"create table if not exists {REMINDER_CURSOR_TABLE_NAME}("
+                "name TEXT PRIMARY KEY,"
+                "last_id INTEGER NOT NULL)"
+            )
+            self.connection.commit()
+
+    def derive(self) -> int:
+        """
+        Creates the jobs of appointments added since the last scan, one transaction per batch
+        @return: number of jobs created
+        """
+        created = 0
+        while not self._stop.is_set():
+            with self._lock:
+                now = self.clock()
+                row = self.connection.execute(
+                    f"select last_id from {REMINDER_CURSOR_TABLE_NAME} where name = 'appointments'"
+                ).fetchone()
+                last_id = row[0] if row else 0
+                rows = self.connection.execute(
+                    "select id, date from appointments where id > ? order by id limit ?", (last_id, self.batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                jobs = []
+                for appointment_id, date in rows:
+                    starts_at = datetime.fromisoformat(date).timestamp()
+                    for kind, offset in self.offsets.items():
+                        due_at = int(starts_at - offset)
+                        # Reminders whose time passed before the appointment was booked are not worth sending
+                        if starts_at > now and due_at > now - self.scan_seconds:
+                            jobs.append((appointment_id, kind, due_at))
+                cursor = self.connection.executemany(
+                    f"INSERT INTO {REMINDER_JOBS_TABLE_NAME} (appointment_id, kind, due_at, status)"
+                    f" VALUES (?, ?, ?, '{PENDING}') ON CONFLICT(appointment_id, kind) DO NOTHING",
+                    jobs,
+                )
+                self.connection.execute(
+                    f"INSERT INTO {REMINDER_CURSOR_TABLE_NAME} (name, last_id) VALUES ('appointments', ?)"
+                    " ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id",
+                    (rows[-1][0],),
+                )
+                self.connection.commit()
+                created += max(cursor.rowcount, 0)
+                self._stats["scanned"] += len(rows)
+                if self._loaded_until is not None and any(due_at <= self._loaded_until for _, _, due_at in jobs):
+                    # Jobs inside the window already in memory would otherwise wait for a restart
+                    self._load(now, self._loaded_until, since=None)
+        self._stats["derived"] += created
+        if created:
+            logger.info("%s reminder jobs created", created)
+        return created
+
+    def refill(self) -> int:
+        """
+        Moves pending jobs due within the horizon into the heap; the first call also recovers jobs
+        claimed by a worker that never finished them
+        @return: number of jobs added
+        """
+        with self._lock:
+            now = self.clock()
+            if self._loaded_until is None:
+                self.connection.execute(
+                    f"UPDATE {REMINDER_JOBS_TABLE_NAME} SET status = '{PENDING}'"
+                    f" WHERE status = '{SENDING}' and claimed_at < ?",
+                    (int(now - self.lease_seconds),),
+                )
+                self.connection.commit()
+            elif now + self.horizon_seconds / 2 < self._loaded_until:
+                return 0
+            until = now + self.horizon_seconds
+            added = self._load(now, until, since=self._loaded_until)
+            self._loaded_until = until
+            return added
+
+    def _load(self, now: float, until: float, since: float = None) -> int:
+        query = f"select id, due_at from {REMINDER_JOBS_TABLE_NAME} where status = '{PENDING}' and due_at <= ?"
+        parameters = [int(until)]
+        if since is not None:
+            query += " and due_at > ?"
+            parameters.append(int(since))
+        added = 0
+        for job_id, due_at in self.connection.execute(query, parameters).fetchall():
+            if job_id not in self._queued:
+                heapq.heappush(self._heap, (due_at, job_id))
+                self._queued.add(job_id)
+                added += 1
+        return added
+
+    def next_due(self) -> float | None:
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def run_due(self) -> int:
+        """
+        Claims every job due now and hands it to the worker pool
+        @return: number of jobs submitted
+        """
+        submitted = 0
+        while True:
+            with self._lock:
+                now = self.clock()
+                if not self._heap or self._heap[0][0] > now:
+                    return submitted
+                _, job_id = heapq.heappop(self._heap)
+                self._queued.discard(job_id)
+                claimed = self.connection.execute(
+                    f"UPDATE {REMINDER_JOBS_TABLE_NAME} SET status = '{SENDING}', claimed_at = ?,"
+                    f" attempts = attempts + 1 WHERE id = ? and status = '{PENDING}'",
+                    (int(now), job_id),
+                ).rowcount
+                self.connection.commit()
+            if claimed:
+                # Another worker may have taken it since it was loaded
+                self._submit(job_id)
+                submitted += 1
+
+    def _submit(self, job_id: int) -> None:
+        if self._pool is None:
+            self.send(job_id)
+        else:
+            self._pool.submit(self.send, job_id)
+
+    def send(self, job_id: int) -> bool:
+        """
+        Sends one claimed reminder and records the outcome, retrying with backoff until max_attempts
+        @param job_id: reminder_jobs.id
+        @return: True if it was sent
+        """
+        try:
+            with self._lock:
+                row = self.connection.execute(
+                    f"select j.attempts, a.date, a.event_name, a.phone_number, a.location"
+                    f" from {REMINDER_JOBS_TABLE_NAME} j join appointments a on a.id = j.appointment_id"
+                    " where j.id = ?",
+                    (job_id,),
+                ).fetchone()
+            if row is None:
+                self._finish(job_id, SKIPPED)
+                return False
+            attempts, date, event_name, phone_number, location = row
+            when = datetime.fromisoformat(date)
+            if when.timestamp() <= self.clock():
+                self._finish(job_id, SKIPPED)
+                return False
+            phone_number = self.database.encryption.decrypt(phone_number)
+            sent = self.notification_service.send_sms(phone_number, reminder_message(event_name, location, when))
+        except Exception as error:  # a failing send must not kill the worker thread
+            logger.error("Reminder %s could not be sent: %s", job_id, error)
+            attempts, sent = self.max_attempts, False
+        if sent:
+            self._finish(job_id, SENT)
+        elif attempts < self.max_attempts:
+            self._retry(job_id, attempts)
+        else:
+            self._finish(job_id, FAILED)
+        return sent
+
+    def _finish(self, job_id: int, status: str) -> None:
+        with self._lock:
+            try:
+                self.connection.execute(
+                    f"UPDATE {REMINDER_JOBS_TABLE_NAME} SET status = ? WHERE id = ?", (status, job_id)
+                )
+                self.connection.commit()
+            except DatabaseError as error:
+                logger.error("Reminder %s status was not saved: %s", job_id, error)
+            self._stats[status] += 1
+
+    def _retry(self, job_id: int, attempts: int) -> None:
+        due_at = int(self.clock() + 60 * 2 ** attempts)
+        with self._lock:
+            self.connection.execute(
+                f"UPDATE {REMINDER_JOBS_TABLE_NAME} SET status = '{PENDING}', due_at = ? WHERE id = ?",
+                (due_at, job_id),
+            )
+            self.connection.commit()
+            if self._loaded_until is not None and due_at <= self._loaded_until:
+                heapq.heappush(self._heap, (due_at, job_id))
+                self._queued.add(job_id)
+            self._stats["retried"] += 1
+        self._wake.set()
+
+    def has_pending(self) -> bool:
+        """
+        Returns whether reminders are waiting to be derived or sent
+        @return: bool
+        """
+        if self._scan_requested or self._heap:
+            return True
+        try:
+            return self.connection.execute(
+                f"select 1 from {REMINDER_JOBS_TABLE_NAME} where status in ('{PENDING}', '{SENDING}') limit 1"
+            ).fetchone() is not None
+        except DatabaseError as error:
+            logger.warning("Unable to check for pending reminders: %s", error)
+            return True
+
+    def stats(self) -> dict:
+        """
+        Returns job counters, the heap size and the pending jobs by status
+        @return: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._heap)
+            stats["next_due"] = self._heap[0][0] if self._heap else None
+            try:
+                stats["jobs"] = dict(self.connection.execute(
+                    f"select status, count(*) from {REMINDER_JOBS_TABLE_NAME} group by status"
+                ).fetchall())
+            except DatabaseError:
+                stats["jobs"] = {}
+        stats["running"] = bool(self._thread and self._thread.is_alive())
+        return stats
+
+    def start(self) -> None:
+        """
+        Runs derive, refill and the due jobs on a daemon thread and sends on the worker pool
+        @return: null
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self.create_tables()
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reminder")
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        scanned = 0.0
+        while not self._stop.is_set():
+            try:
+                if self._scan_requested or time.monotonic() - scanned >= self.scan_seconds:
+                    self._scan_requested = False
+                    self.derive()
+                    scanned = time.monotonic()
+                self.refill()
+                self.run_due()
+            except DatabaseError as error:
+                logger.error("Reminder scheduler pass failed: %s", error)
+            next_due = self.next_due()
+            wait = self.scan_seconds if next_due is None else min(self.scan_seconds, next_due - self.clock())
+            self._wake.wait(max(wait, 0.05))
+            self._wake.clear()
+
+    def wake(self) -> None:
+        """
+        Runs the next pass, including a scan for new appointments, now, e.g. right after one was booked
+        @return: null
+        """
+        self._scan_requested = True
+        self._wake.set()
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the scheduler thread, waits for reminders being sent and closes the scheduler's connection
+        @param timeout: seconds to wait for the thread
+        @return: null
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._pool:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._thread and self._thread.is_alive():
+            logger.warning("Reminder scheduler still running after %ss, leaving its connection open", timeout)
+            return
+        self.database.close()
+
+
+def create_reminder_scheduler(database_file: str, notification_service) -> ReminderScheduler | None:
+    """
+    Returns a started scheduler with its own connection when REMINDER_OFFSETS is set, otherwise None
+    @param database_file: database of the site
+    @param notification_service: the site's NotificationService
+    @return: ReminderScheduler or None
+    """
+    offsets = os.environ.get(REMINDER_OFFSETS_ENV)
+    if not offsets:
+        return None
+    scheduler = ReminderScheduler(
+        DatabaseOperation(database_file),
+        notification_service,
+        offsets=parse_offsets(offsets),
+        workers=int(os.environ.get(REMINDER_WORKERS_ENV, "4")),
+    )
+    scheduler.start()
+    return scheduler
+
+
+class _CountingNotifier:
+    def __init__(self) -> None:
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def send_sms(self, to_number: str, body: str) -> bool:
+        with self._lock:
+            self.sent += 1
+        return True
+
+
+def benchmark(appointments: int = 100000, batch_size: int = 1000, workers: int = 4) -> dict:
+    """
+    Measures deriving jobs for upcoming appointments, loading the heap and draining due reminders
+    @param appointments: upcoming appointments spread over the next 30 days
+    @param batch_size: appointments per derive transaction
+    @param workers: sending threads
+    @return: dict of timings and counts
+    """
+    database = DatabaseOperation(sqlite_connection=sqlite3.connect(":memory:", check_same_thread=False))
+    Seeder(database, seed=1).create_tables()
+    start = datetime.now().replace(microsecond=0) + timedelta(hours=2)
+    database.bulk_insert(
+        "appointments",
+        ("date", "event_name", "phone_number", "location", "message"),
+        (
+            ((start + timedelta(seconds=i * 30 * 86400 // appointments)).isoformat(), "Estimate",
+             phone, "Main St", "")
+            for i, phone in enumerate([database.encryption.encrypt("18005550100")] * appointments)
+        ),
+    )
+    database.connection.commit()
+    notifier = _CountingNotifier()
+    now = [time.time()]
+    scheduler = ReminderScheduler(database, notifier, batch_size=batch_size, workers=workers,
+                                  clock=lambda: now[0])
+    scheduler.create_tables()
+    results = {"appointments": appointments}
+
+    started = time.perf_counter()
+    results["jobs"] = scheduler.derive()
+    results["derive_seconds"] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    scheduler.derive()
+    results["rescan_seconds"] = round(time.perf_counter() - started, 4)
+
+    started = time.perf_counter()
+    scheduler.refill()
+    results["heap_after_refill"] = scheduler.stats()["queued"]
+    results["refill_seconds"] = round(time.perf_counter() - started, 4)
+
+    # Jump a day ahead and drain everything that became due on the pool
+    now[0] += 86400
+    scheduler._pool = ThreadPoolExecutor(max_workers=workers)
+    started = time.perf_counter()
+    scheduler._loaded_until = None
+    scheduler.refill()
+    submitted = scheduler.run_due()
+    scheduler._pool.shutdown(wait=True)
+    seconds = time.perf_counter() - started
+    results.update({
+        "sent": notifier.sent,
+        "submitted": submitted,
+        "send_seconds": round(seconds, 3),
+        "reminders_per_second": round(notifier.sent / seconds) if seconds else 0,
+    })
+    database.close()
+    return results
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Send appointment reminders")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the scheduler for a database until interrupted")
+    run.add_argument("database", help="sqlite database file or postgresql:// URL")
+    run.add_argument("--offsets", default=DEFAULT_OFFSETS)
+    run.add_argument("--workers", type=int, default=4)
+    bench = commands.add_parser("benchmark", help="measure the scheduler on synthetic appointments")
+    bench.add_argument("--appointments", type=int, default=100000)
+    bench.add_argument("--batch-size", type=int, default=1000)
+    bench.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.command == "benchmark":
+        logging.disable(logging.CRITICAL)
+        print(benchmark(args.appointments, args.batch_size, args.workers))
+        return
+
+    scheduler = ReminderScheduler(DatabaseOperation(args.database), NotificationService(),
+                                  offsets=parse_offsets(args.offsets), workers=args.workers)
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(60)
+            print(scheduler.stats(), flush=True)
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Module for serving every row of the pages table through one view.
+
+RouteTable keeps URL path -> (template, page) in memory, so serving a page is a dict lookup. It is
+loaded at startup, patched when this process inserts or updates a page, and reloaded when the
+"pages" cache version shows another worker changed the table. Every change bumps the table's
+generation, which callers put in the keys of anything they cache per page, such as rendered output.
+"""
+import logging
+import threading
+import time
+
+from src.database.database import DatabaseOperation
+from src.events import PAGE_CHANGED
+from src.page import Page
+
+logger = logging.getLogger(__name__)
+
+HOME_ROUTE = "home"
+DEFAULT_TEMPLATE = "page.html"
+# Pages that predate the generic template keep their own
+PAGE_TEMPLATES = {
+    "home": "index.html",
+    "services": "services.html",
+    "gallery": "gallery.html",
+}
+
+
+def path_for(route: str) -> str:
+    """
+    Returns the URL path a page route is served at
+    @param route: pages.route
+    @return: str, "/" for the home page
+    """
+    return "/" if route == HOME_ROUTE else f"/{route.strip('/')}"
+
+
+class RouteTable:
+    """
+    In-memory route table over the pages table
+    """
+
+    def __init__(self, database: DatabaseOperation, templates: dict = None,
+                 default_template: str = DEFAULT_TEMPLATE, check_seconds: float = 5.0) -> None:
+        """
+        @param database: database holding the pages table
+        @param templates: route -> template overrides
+        @param default_template: template for every other page
+        @param check_seconds: how often the pages cache version is checked for changes by other workers
+        """
+        self.database = database
+        self.templates = PAGE_TEMPLATES if templates is None else templates
+        self.default_template = default_template
+        self.check_seconds = check_seconds
+        self._routes = {}
+        self._generation = 0
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        database.events.subscribe(PAGE_CHANGED, self._on_page_changed)
+
+    def load(self) -> int:
+        """
+        Loads every page, replacing the whole table at once
+        @return: number of routes
+        """
+        with self._lock:
+            version = self.database.get_cache_versions().get("pages", 0)
+            self._routes = {path_for(page.route): self._entry(page) for page in self.database.get_all_pages()}
+            self._generation += 1
+            self._version = version
+            self._checked = time.monotonic()
+        logger.info("Route table loaded with %s pages", len(self._routes))
+        return len(self._routes)
+
+    def lookup(self, path: str) -> tuple[str, Page] | None:
+        """
+        Finds the template and page for a URL path
+        @param path: request path, e.g. "/" or "/services"
+        @return: (template, page) or None
+        """
+        if time.monotonic() - self._checked > self.check_seconds:
+            self._reload_if_changed()
+        return self._routes.get(path)
+
+    @property
+    def generation(self) -> int:
+        """
+        Counter bumped whenever a page is loaded, changed or removed. Read it before lookup: a page
+        cached under an older generation is then never served once the table has moved on.
+        @return: int
+        """
+        return self._generation
+
+    def paths(self) -> list[str]:
+        """
+        Returns every served path, pages with their own template first
+        @return: list of str
+        """
+        routes = self._routes
+        return sorted(routes, key=lambda path: routes[path][0] == self.default_template)
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def _entry(self, page: Page) -> tuple[str, Page]:
+        return self.templates.get(page.route, self.default_template), page
+
+    def _reload_if_changed(self) -> None:
+        with self._lock:
+            if time.monotonic() - self._checked <= self.check_seconds:
+                return
+            self._checked = time.monotonic()
+            changed = self.database.get_cache_versions().get("pages", 0) != self._version
+        if changed:
+            self.load()
+
+    def _on_page_changed(self, route: str, version: int = None) -> None:
+        page = self.database.get_page_by_route(route)
+        with self._lock:
+            if page is None:
+                self._routes.pop(path_for(route), None)
+            else:
+                self._routes[path_for(route)] = self._entry(page)
+            self._generation += 1
+            # Only our own write happened since the last load; anything else is left to the version check
+            if version is not None and self._version == version - 1:
+                self._version = version
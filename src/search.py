@@ -0,0 +1,215 @@
+"""
+Module for searching encrypted leads without decrypting the table.
+
+Email and phone number get keyed blind indexes (truncated HMAC-SHA256 of the normalized value) so exact
+lookups are an index seek. Non sensitive columns are covered by an external content FTS5 table kept in
+sync by triggers, so name/subject/message search never touches ciphertext. On PostgreSQL the same
+columns feed a generated tsvector column with a GIN index instead.
+"""
+import re
+
+from src.hashing import HashingService, canonicalize, load_key
+
+BLIND_INDEX_KEY_ENV = "BLIND_INDEX_KEY"
+BLIND_INDEX_KEY_FILE = "blind_index.key"
+BLIND_INDEX_TABLE_NAME = "lead_blind_index"
+FTS_TABLE_NAME = "leads_fts"
+SEARCH_VECTOR_COLUMN = "search_vector"
+SEARCH_COLUMNS = "l.id, l.first_name, l.last_name, l.phone_number, l.email, l.subject, l.message"
+# 128 bits keeps collisions negligible while leaking less than a full digest
+BLIND_INDEX_BYTES = 16
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_email(email: str) -> str:
+    return canonicalize(email)
+
+
+def normalize_phone(phone_number: str) -> str:
+    return "".join(ch for ch in phone_number if ch.isdigit())
+
+
+class BlindIndex:
+    """
+    Keyed blind index builder with separate HMAC domains for email and phone number
+    """
+
+    def __init__(self, key: bytes = None) -> None:
+        if not key:
+            key = load_key(BLIND_INDEX_KEY_ENV, BLIND_INDEX_KEY_FILE)
+        self._email = HashingService(key, b"email:", normalize_email, BLIND_INDEX_BYTES)
+        self._phone = HashingService(key, b"phone:", normalize_phone, BLIND_INDEX_BYTES)
+
+    def email(self, email: str) -> str:
+        """
+        Returns the blind index of an email address
+        @param email: plain text email
+        @return: hex str
+        """
+        return self._email.hash(email)
+
+    def phone(self, phone_number: str) -> str:
+        """
+        Returns the blind index of a phone number (digits only)
+        @param phone_number: plain text phone number
+        @return: hex str
+        """
+        return self._phone.hash(phone_number)
+
+    def email_many(self, emails) -> list[str]:
+        """
+        Returns the blind indexes of a batch of email addresses
+        @param emails: iterable of plain text emails
+        @return: list of hex str in input order
+        """
+        return self._email.hash_many(emails)
+
+    def phone_many(self, phone_numbers) -> list[str]:
+        """
+        Returns the blind indexes of a batch of phone numbers
+        @param phone_numbers: iterable of plain text phone numbers
+        @return: list of hex str in input order
+        """
+        return self._phone.hash_many(phone_numbers)
+
+
+def fts_query(text: str) -> str:
+    """
+    Turns free text into a safe FTS5 query: every word must match, the last one as a prefix
+    @param text: user supplied search text
+    @return: FTS5 MATCH expression, empty when there is nothing to search for
+    """
+    tokens = _TOKEN.findall(text or "")
+    if not tokens:
+        return ""
+    terms = [f'"{token}"' for token in tokens[:-1]]
+    terms.append(f'"{tokens[-1]}"*')
+    return " ".join(terms)
+
+
+def tsquery(text: str) -> str:
+    """
+    Turns free text into a safe PostgreSQL tsquery: every word must match, the last one as a prefix
+    @param text: user supplied search text
+    @return: to_tsquery expression, empty when there is nothing to search for
+    """
+    tokens = _TOKEN.findall(text or "")
+    if not tokens:
+        return ""
+    return " & ".join([*(f"'{token}'" for token in tokens[:-1]), f"'{tokens[-1]}':*"])
+
+
+def search_schema(leads_table: str = "leads") -> list[str]:
+    """
+    Returns the statements creating the blind index table, the FTS5 table and its sync triggers
+    @param leads_table: name of the leads table
+    @return: list of SQL statements
+    """
+    return [
+        f"create table if not exists {BLIND_INDEX_TABLE_NAME}("
+        "lead_id INTEGER PRIMARY KEY,"
+        "email_bidx TEXT NOT NULL,"
+        "phone_bidx TEXT NOT NULL)",
+        f"create index if not exists {BLIND_INDEX_TABLE_NAME}_email on {BLIND_INDEX_TABLE_NAME}(email_bidx)",
+        f"create index if not exists {BLIND_INDEX_TABLE_NAME}_phone on {BLIND_INDEX_TABLE_NAME}(phone_bidx)",
+        f"create virtual table if not exists {FTS_TABLE_NAME} using fts5("
+        "first_name, last_name, subject, message,"
+        f"content='{leads_table}', content_rowid='id', prefix='2 3')",
+        f"create trigger if not exists {FTS_TABLE_NAME}_ai after insert on {leads_table} begin "
+        f"insert into {FTS_TABLE_NAME}(rowid, first_name, last_name, subject, message) "
+        "values (new.id, new.first_name, new.last_name, new.subject, new.message); end",
+        f"create trigger if not exists {FTS_TABLE_NAME}_ad after delete on {leads_table} begin "
+        f"insert into {FTS_TABLE_NAME}({FTS_TABLE_NAME}, rowid, first_name, last_name, subject, message) "
+        "values ('delete', old.id, old.first_name, old.last_name, old.subject, old.message); "
+        f"delete from {BLIND_INDEX_TABLE_NAME} where lead_id = old.id; end",
+        f"create trigger if not exists {FTS_TABLE_NAME}_au after update of first_name, last_name, subject, message "
+        f"on {leads_table} begin "
+        f"insert into {FTS_TABLE_NAME}({FTS_TABLE_NAME}, rowid, first_name, last_name, subject, message) "
+        "values ('delete', old.id, old.first_name, old.last_name, old.subject, old.message); "
+        f"insert into {FTS_TABLE_NAME}(rowid, first_name, last_name, subject, message) "
+        "values (new.id, new.first_name, new.last_name, new.subject, new.message); end",
+    ]
+
+
+def postgres_search_schema(leads_table: str = "leads") -> list[str]:
+    """
+    Returns the statements creating the blind index table and the tsvector column with its GIN index.
+    The generated column and the cascading foreign key replace the SQLite sync triggers.
+    @param leads_table: name of the leads table
+    @return: list of SQL statements
+    """
+    return [
+        f"create table if not exists {BLIND_INDEX_TABLE_NAME}("
+        f"lead_id BIGINT PRIMARY KEY REFERENCES {leads_table}(id) ON DELETE CASCADE,"
+        "email_bidx TEXT NOT NULL,"
+        "phone_bidx TEXT NOT NULL)",
+        f"create index if not exists {BLIND_INDEX_TABLE_NAME}_email on {BLIND_INDEX_TABLE_NAME}(email_bidx)",
+        f"create index if not exists {BLIND_INDEX_TABLE_NAME}_phone on {BLIND_INDEX_TABLE_NAME}(phone_bidx)",
+        f"alter table {leads_table} add column if not exists {SEARCH_VECTOR_COLUMN} tsvector generated always as "
+        "(to_tsvector('simple', first_name || ' ' || last_name || ' ' || subject || ' ' || message)) stored",
+        f"create index if not exists {leads_table}_{SEARCH_VECTOR_COLUMN} on {leads_table}"
+        f" using gin({SEARCH_VECTOR_COLUMN})",
+    ]
+
+
+def _exact_clauses(email_bidx: str, phone_bidx: str) -> tuple[list, list]:
+    clauses, parameters = [], []
+    if email_bidx:
+        clauses.append(f"l.id in (select lead_id from {BLIND_INDEX_TABLE_NAME} where email_bidx = ?)")
+        parameters.append(email_bidx)
+    if phone_bidx:
+        clauses.append(f"l.id in (select lead_id from {BLIND_INDEX_TABLE_NAME} where phone_bidx = ?)")
+        parameters.append(phone_bidx)
+    return clauses, parameters
+
+
+def search_query(text: str = None, email_bidx: str = None, phone_bidx: str = None, limit: int = 50) -> tuple:
+    """
+    Builds the lead id lookup for any combination of free text, email and phone
+    @param text: free text over names, subject and message
+    @param email_bidx: blind index of the email to match exactly
+    @param phone_bidx: blind index of the phone number to match exactly
+    @param limit: maximum number of ids
+    @return: (sql, parameters); sql is None when no criteria were given
+    """
+    clauses, parameters = _exact_clauses(email_bidx, phone_bidx)
+    match = fts_query(text)
+    columns = SEARCH_COLUMNS
+    if match and not clauses:
+        # Drive the query from the FTS index in rowid order so the LIMIT stops the scan early
+        sql = (
+            f"select {columns} from {FTS_TABLE_NAME} f join leads l on l.id = f.rowid"
+            f" where {FTS_TABLE_NAME} match ? and l.visible = 1 order by f.rowid desc limit ?"
+        )
+        return sql, (match, limit)
+    if not clauses:
+        return None, ()
+    if match:
+        # Exact lookups are the selective part, so only probe the FTS index for their few candidates
+        clauses.append(f"exists (select 1 from {FTS_TABLE_NAME} where {FTS_TABLE_NAME} match ? and rowid = l.id)")
+        parameters.append(match)
+    sql = f"select {columns} from leads l where l.visible = 1 and " + " and ".join(clauses) + " order by l.id desc limit ?"
+    return sql, (*parameters, limit)
+
+
+def postgres_search_query(text: str = None, email_bidx: str = None, phone_bidx: str = None,
+                          limit: int = 50) -> tuple:
+    """
+    PostgreSQL counterpart of search_query, matching free text against the GIN indexed tsvector
+    @param text: free text over names, subject and message
+    @param email_bidx: blind index of the email to match exactly
+    @param phone_bidx: blind index of the phone number to match exactly
+    @param limit: maximum number of ids
+    @return: (sql, parameters); sql is None when no criteria were given
+    """
+    clauses, parameters = _exact_clauses(email_bidx, phone_bidx)
+    query = tsquery(text)
+    if query:
+        clauses.append(f"l.{SEARCH_VECTOR_COLUMN} @@ to_tsquery('simple', ?)")
+        parameters.append(query)
+    if not clauses:
+        return None, ()
+    sql = (f"select {SEARCH_COLUMNS} from leads l where l.visible = 1 and " + " and ".join(clauses)
+           + " order by l.id desc limit ?")
+    return sql, (*parameters, limit)
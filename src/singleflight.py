@@ -0,0 +1,69 @@
+"""
+Module for coalescing concurrent loads of the same key.
+
+When a cached value goes missing (after a restart or a version bump), every request asking for it
+at that moment would load it itself. SingleFlight lets the first caller load while the others wait
+for its result, so one miss costs one query or render however many requests arrive together.
+Nothing is kept once the load finishes; remembering results is the cache's job.
+"""
+import threading
+
+
+class _Call:
+    """
+    One load in progress and the callers waiting for it
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one loader per key at a time and shares its result with concurrent callers
+    """
+
+    def __init__(self) -> None:
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.shared = 0
+
+    def do(self, key, loader):
+        """
+        Returns loader(), or the result of the load of key already in progress.
+        An exception raised by the loader is raised in every caller waiting for it.
+        @param key: hashable key of the value
+        @param loader: callable producing the value
+        @return: the loaded value
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.loads += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = loader()
+            return call.value
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
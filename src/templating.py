@@ -0,0 +1,173 @@
+"""
+Module for Jinja environment tuning: a shared bytecode cache and versioned fragment caching.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from src.singleflight import SingleFlight
+
+TEMPLATE_CACHE_DIR_ENV = "TEMPLATE_CACHE_DIR"
+FRAGMENT_CACHE_SIZE = 256
+
+
+class FragmentCache:
+    """
+    Bounded in-process LRU store for rendered template fragments
+    """
+
+    def __init__(self, max_entries: int = FRAGMENT_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> str | None:
+        """
+        Returns a cached fragment and marks it as recently used
+        @param key: fragment key including its versions
+        @return: rendered fragment or None
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Stores a fragment, evicting the least recently used one when full
+        @param key: fragment key including its versions
+        @param value: rendered fragment
+        @return: null
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_render(self, key: str, render) -> str:
+        """
+        Returns a cached fragment, rendering it on a miss. Concurrent misses for the same key wait for
+        one render instead of each running the queries behind it.
+        @param key: fragment key including its versions
+        @param render: callable returning the rendered fragment
+        @return: rendered fragment
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        def load() -> str:
+            # A render that finished while this caller was on its way in already stored the fragment
+            with self._lock:
+                stored = self._entries.get(key)
+            if stored is not None:
+                return stored
+            rendered = render()
+            self.set(key, rendered)
+            return rendered
+
+        return self._flight.do(key, load)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "renders": self._flight.loads, "coalesced": self._flight.shared}
+
+    def clear(self) -> None:
+        """
+        Drops every cached fragment
+        @return: null
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds a {% cache "name", version, ... %}...{% endcache %} tag.
+    The block is rendered once per distinct (name, versions) and served from the fragment cache afterwards,
+    so callers invalidate by bumping a version rather than by deleting entries.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment) -> None:
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_cache_support", [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_support(self, key_parts: list, caller) -> str:
+        key = ":".join(str(part) for part in key_parts)
+        return self.environment.fragment_cache.get_or_render(key, caller)
+
+
+class LazySequence:
+    """
+    Defers a loader until a template iterates it, so a cached fragment skips the query entirely
+    """
+
+    def __init__(self, loader) -> None:
+        self._loader = loader
+        self._items = None
+
+    def _load(self) -> list:
+        if self._items is None:
+            self._items = self._loader()
+        return self._items
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def __bool__(self) -> bool:
+        return bool(self._load())
+
+
+def configure_templates(app, cache_dir: str = None) -> None:
+    """
+    Enables the filesystem bytecode cache and the fragment cache tag on a Flask app.
+    The bytecode cache directory is shared by every worker process on the host;
+    Jinja writes entries atomically so concurrent workers can fill it safely.
+    @param app: Flask application
+    @param cache_dir: bytecode directory, defaults to $TEMPLATE_CACHE_DIR or Jinja's per-user temp dir
+    @return: null
+    """
+    cache_dir = cache_dir or os.environ.get(TEMPLATE_CACHE_DIR_ENV)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def precompile_templates(app) -> int:
+    """
+    Compiles every template once so the bytecode cache is warm before traffic arrives
+    @param app: Flask application
+    @return: number of templates compiled
+    """
+    names = app.jinja_env.list_templates(extensions=["html"])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
@@ -0,0 +1,473 @@
+"""
+Module for hosting several sites from one process.
+
+Each site has its own database, upload folder, optional template overrides, notification settings,
+route table, fragment cache, admin change feed, reminder scheduler and outbox relay. Sites are opened lazily on their first request and
+the least recently used idle ones are closed once more than max_open are loaded, so memory stays
+bounded however many sites are configured. A site with reminders or digest events still to send is
+not closed, so its background workers keep running while it gets no traffic.
+
+A site's DatabaseOperation is its connection pool and is shared by every request thread: a write
+transaction holds the pool's write connection for its thread until commit or rollback, reads run on
+the pool's read connections (SQLITE_READERS; POSTGRES_POOL_MIN/MAX on PostgreSQL), and the teardown of
+each request rolls back whatever its thread left open. The reminder scheduler, outbox relay and
+reporting snapshot open connections of their own. A registry warm-up hook runs before a newly opened site
+is handed to any request, so its pages are rendered once rather than by its first burst of traffic.
+
+SITES_CONFIG points to a JSON file:
+    {
+        "default": "acme",
+        "sites": [
+            {"name": "acme", "hosts": ["acme.com", "www.acme.com"], "database": "sites/acme/contacts.db",
+             "uploads": "sites/acme/uploads", "templates": "sites/acme/templates",
+             "notification": {"SENDGRID_FROM_EMAIL": "hello@acme.com"}}
+        ]
+    }
+Without it the app serves a single site on every host, exactly as before.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from jinja2 import BaseLoader, TemplateNotFound
+
+from src.database.backends import DatabaseError
+from src.database.database import DatabaseOperation
+from src.database.snapshot import create_snapshot
+from src.database.tracing import create_query_tracer
+from src.live import ChangeFeed
+from src.notification import NotificationService
+from src.outbox import create_outbox_relay
+from src.page import Page
+from src.reminders import create_reminder_scheduler
+from src.routing import RouteTable
+from src.templating import FragmentCache
+
+logger = logging.getLogger(__name__)
+
+SITES_CONFIG_ENV = "SITES_CONFIG"
+SITES_MAX_OPEN_ENV = "SITES_MAX_OPEN"
+SITES_IDLE_SECONDS_ENV = "SITES_IDLE_SECONDS"
+SITE_TEMPLATE_PREFIX = "sites"
+DEFAULT_PAGES = (
+    Page(route="home", title="Welcome", content="Welcome to our website!"),
+    Page(route="services", title="Our Services", content="Here are our services."),
+    Page(route="gallery", title="Gallery", content="Check out our work."),
+)
+
+
+@dataclass(frozen=True)
+class SiteConfig:
+    """
+    Static description of a site, cheap to keep for every configured site
+    """
+    name: str
+    database: str
+    uploads: str
+    hosts: tuple = ()
+    templates: str | None = None
+    notification: dict = field(default_factory=dict, compare=False)
+
+
+class Site:
+    """
+    An opened site and the per-site services built for it
+    """
+
+    def __init__(self, config: SiteConfig) -> None:
+        self.config = config
+        self.name = config.name
+        self.upload_folder = config.uploads
+        os.makedirs(self.upload_folder, exist_ok=True)
+        self.database = DatabaseOperation(config.database)
+        self.database.create_leads_table("leads")
+        self.database.create_appointment_table("appointments")
+        self.database.create_pages_table("pages")
+        self.database.create_page_revisions_table()
+        self.database.create_cache_versions_table()
+        self.database.create_search_tables()
+        self.database.create_idempotency_table()
+        for page in DEFAULT_PAGES:
+            if not self.database.get_page_by_route(page.route):
+                self.database.insert_page(page)
+        self.route_table = RouteTable(self.database)
+        self.route_table.load()
+        # Subscribed after the route table, so page events are sent once it serves the new version
+        self.change_feed = ChangeFeed(self.database)
+        self.notification_service = NotificationService(config.notification)
+        self.fragment_cache = FragmentCache()
+        self.query_tracer = create_query_tracer(self.database.connection)
+        self.reporting_snapshot = create_snapshot(config.database, position=self.change_feed.last_event_id)
+        self.reencryption_job = None
+        self.lead_archiver = None
+        self.reminder_scheduler = create_reminder_scheduler(config.database, self.notification_service)
+        self.outbox_relay = create_outbox_relay(config.database, self.notification_service, config.notification)
+        if self.outbox_relay:
+            self.database.create_outbox_table()
+        self.warm_stats = None
+        self._overrides = {}
+
+    def warm_up(self, render, limit: int = None) -> dict:
+        """
+        Renders pages into the fragment cache ahead of traffic. The route table already holds every
+        page; pages with their own template go first, and the rest follow while the cache has room.
+        A page that fails to render is logged and leaves the site not ready.
+        @param render: callable(site, path) rendering one page through the site's caches
+        @param limit: pages rendered at most, defaults to half the fragment cache so admin fragments keep room
+        @return: {"pages", "rendered", "failed", "seconds"}
+        """
+        started = time.monotonic()
+        limit = self.fragment_cache.max_entries // 2 if limit is None else limit
+        paths = self.route_table.paths()
+        rendered = failed = 0
+        for path in paths[:limit]:
+            try:
+                render(self, path)
+                rendered += 1
+            except Exception as error:  # one broken page must not keep the site from serving the others
+                failed += 1
+                logger.error("Warm-up of %s%s failed: %s", self.name, path, error)
+        self.warm_stats = {"pages": len(paths), "rendered": rendered, "failed": failed,
+                           "seconds": round(time.monotonic() - started, 3)}
+        logger.info("Site %s warmed up: %s", self.name, self.warm_stats)
+        return self.warm_stats
+
+    def ready(self) -> bool:
+        """
+        Returns whether the site finished warming up without errors and its database answers
+        @return: bool
+        """
+        if not self.warm_stats or self.warm_stats["failed"]:
+            return False
+        try:
+            self.database.connection.execute("select 1").fetchone()
+            return True
+        except DatabaseError as error:
+            logger.warning("Site %s database is not answering: %s", self.name, error)
+            return False
+
+    def template(self, name: str) -> str:
+        """
+        Returns the template name to render, pointing at the site's override when it has one
+        @param name: template name, e.g. index.html
+        @return: str
+        """
+        if not self.config.templates:
+            return name
+        override = self._overrides.get(name)
+        if override is None:
+            exists = os.path.isfile(os.path.join(self.config.templates, name))
+            override = self._overrides[name] = f"{SITE_TEMPLATE_PREFIX}/{self.name}/{name}" if exists else name
+        return override
+
+    def has_pending_work(self) -> bool:
+        """
+        Returns whether the site's background workers still have reminders or digest events to send
+        @return: bool
+        """
+        return any(worker.has_pending() for worker in (self.reminder_scheduler, self.outbox_relay) if worker)
+
+    @contextmanager
+    def reporting_database(self):
+        """
+        Lends the database reporting reads should use for the duration of the block
+        @return: context manager yielding the snapshot if enabled, otherwise the live database
+        """
+        if self.reporting_snapshot is None:
+            yield self.database
+            return
+        with self.reporting_snapshot.reader() as database:
+            yield database
+
+    @contextmanager
+    def admin_database(self):
+        """
+        Lends the database the admin page is rendered from, with the change feed id its stream resumes at.
+        The snapshot is used while the feed still buffers every change since it was copied; the stream
+        replays those, so nothing committed after the copy is missed. Otherwise the snapshot is refreshed
+        once, and the live database is the last resort.
+        @return: context manager yielding (DatabaseOperation, last event id)
+        """
+        if self.reporting_snapshot is not None:
+            for attempt in range(2):
+                with self.reporting_snapshot.reader() as database:
+                    since = self.reporting_snapshot.position(database)
+                    if self.change_feed.can_resume(since):
+                        yield database, since
+                        return
+                if attempt == 0:
+                    self.reporting_snapshot.refresh()
+        # Taken before the lists are read, so the feed resumes from here without a gap
+        since = self.change_feed.last_event_id()
+        yield self.database, since
+
+    def close(self) -> None:
+        """
+        Stops background work and closes the database
+        @return: null
+        """
+        self.change_feed.close()
+        if self.reencryption_job:
+            self.reencryption_job.stop()
+        if self.lead_archiver:
+            self.lead_archiver.stop()
+            self.lead_archiver.close()
+        if self.reminder_scheduler:
+            self.reminder_scheduler.stop()
+        if self.outbox_relay:
+            self.outbox_relay.stop()
+        if self.reporting_snapshot:
+            self.reporting_snapshot.stop()
+        self.database.close()
+        logger.info("Site %s closed", self.name)
+
+
+class SiteRegistry:
+    """
+    Maps Host headers to sites, opening them on demand and closing idle ones in LRU order.
+    Sites in use by a request are never closed; acquire/release bracket every request.
+    """
+
+    def __init__(self, configs: list[SiteConfig], default: str = None, max_open: int = 32,
+                 idle_seconds: float = 600.0, opener=Site, warm_up=None) -> None:
+        """
+        @param configs: every known site
+        @param default: name of the site served for unknown hosts, None to reject them
+        @param max_open: sites kept open before idle ones are evicted
+        @param idle_seconds: sites unused for longer are closed on the next eviction pass
+        @param opener: callable(SiteConfig) returning an opened site
+        @param warm_up: callable(site) run on every newly opened site before requests can use it
+        """
+        self.configs = {config.name: config for config in configs}
+        self.hosts = {host.lower(): config.name for config in configs for host in config.hosts}
+        self.default = default
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self.opener = opener
+        self.warm_up = warm_up
+        # name -> [site, active requests, last used]
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._opening = {}
+
+    def resolve(self, host: str) -> str | None:
+        """
+        Returns the site name serving a Host header
+        @param host: Host header, a port is ignored
+        @return: site name or None
+        """
+        name = self.hosts.get((host or "").split(":", 1)[0].lower())
+        return name or self.default
+
+    def acquire(self, host: str):
+        """
+        Returns the site for a host, opening it if needed, and marks it busy until release
+        @param host: Host header
+        @return: Site or None for unknown hosts
+        """
+        name = self.resolve(host)
+        if name is None:
+            return None
+        return self.acquire_site(name)
+
+    def acquire_site(self, name: str):
+        """
+        Returns a site by name, opening it if needed, and marks it busy until release
+        @param name: site name
+        @return: Site
+        """
+        while True:
+            with self._lock:
+                entry = self._open.get(name)
+                if entry is not None:
+                    entry[1] += 1
+                    entry[2] = time.monotonic()
+                    self._open.move_to_end(name)
+                    return entry[0]
+                opening = self._opening.get(name)
+                if opening is None:
+                    opening = self._opening[name] = threading.Event()
+                    break
+            # Another request is opening this site; wait and look again
+            opening.wait()
+
+        site = None
+        try:
+            site = self.opener(self.configs[name])
+            # Requests for the site keep waiting on the opening event meanwhile, so they share one warm-up
+            if self.warm_up is not None:
+                self.warm_up(site)
+        except Exception:
+            if site is not None:
+                site.close()
+            with self._lock:
+                self._opening.pop(name).set()
+            raise
+        with self._lock:
+            self._open[name] = [site, 1, time.monotonic()]
+            self._opening.pop(name).set()
+            evicted = self._evict()
+        for old in evicted:
+            old.close()
+        logger.info("Site %s opened, %s open", name, len(self._open))
+        return site
+
+    def release(self, site) -> None:
+        """
+        Marks one request on a site as finished
+        @param site: site returned by acquire
+        @return: null
+        """
+        with self._lock:
+            entry = self._open.get(site.name)
+            if entry is not None and entry[0] is site:
+                entry[1] -= 1
+                entry[2] = time.monotonic()
+            evicted = self._evict()
+        for old in evicted:
+            old.close()
+
+    def _evict(self) -> list:
+        """
+        Removes idle sites beyond max_open or past idle_seconds, least recently used first.
+        Sites with pending background work are kept, like busy ones, even beyond max_open.
+        @return: sites to close outside the lock
+        """
+        now = time.monotonic()
+        evicted = []
+        for name, (site, active, last_used) in list(self._open.items()):
+            over = len(self._open) > self.max_open
+            if not active and (over or now - last_used > self.idle_seconds) and not site.has_pending_work():
+                del self._open[name]
+                evicted.append(site)
+        return evicted
+
+    def open_sites(self) -> list[str]:
+        """
+        Returns the names of the opened sites, least recently used first
+        @return: list of str
+        """
+        with self._lock:
+            return list(self._open)
+
+    def close(self) -> None:
+        """
+        Closes every opened site
+        @return: null
+        """
+        with self._lock:
+            sites = [entry[0] for entry in self._open.values()]
+            self._open.clear()
+        for site in sites:
+            site.close()
+
+
+class SiteTemplateLoader(BaseLoader):
+    """
+    Loads "sites/<site>/<template>" names from that site's template folder. Site.template() only hands
+    out such names for existing overrides, and the name keeps every site's compiled copy apart in
+    Jinja's caches.
+    """
+
+    def __init__(self, registry: SiteRegistry) -> None:
+        self.registry = registry
+
+    def get_source(self, environment, template: str):
+        prefix, _, rest = template.partition("/")
+        name, _, filename = rest.partition("/")
+        config = self.registry.configs.get(name)
+        if prefix != SITE_TEMPLATE_PREFIX or config is None or not config.templates or ".." in filename.split("/"):
+            raise TemplateNotFound(template)
+        path = os.path.join(config.templates, filename)
+        if not os.path.isfile(path):
+            raise TemplateNotFound(template)
+        with open(path, encoding="utf-8") as source:
+            contents = source.read()
+        mtime = os.path.getmtime(path)
+        return contents, path, lambda: os.path.isfile(path) and os.path.getmtime(path) == mtime
+
+    def list_templates(self) -> list[str]:
+        names = []
+        for config in self.registry.configs.values():
+            if config.templates and os.path.isdir(config.templates):
+                names.extend(
+                    f"{SITE_TEMPLATE_PREFIX}/{config.name}/{filename}"
+                    for filename in sorted(os.listdir(config.templates))
+                    if os.path.isfile(os.path.join(config.templates, filename))
+                )
+        return names
+
+
+class SiteFragmentCache:
+    """
+    Fragment cache facade for the Jinja environment that stores into the current site's own cache
+    """
+
+    def __init__(self, current_site) -> None:
+        """
+        @param current_site: callable returning the site of the current request
+        """
+        self.current_site = current_site
+
+    def get(self, key: str) -> str | None:
+        return self.current_site().fragment_cache.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        self.current_site().fragment_cache.set(key, value)
+
+    def get_or_render(self, key: str, render) -> str:
+        return self.current_site().fragment_cache.get_or_render(key, render)
+
+    def clear(self) -> None:
+        self.current_site().fragment_cache.clear()
+
+
+def load_site_configs(path: str = None, database_file: str = "contacts.db",
+                      upload_folder: str = "static/uploads") -> tuple[list[SiteConfig], str]:
+    """
+    Reads SITES_CONFIG, or describes the single site used when it isn't set
+    @param path: JSON config file, defaults to $SITES_CONFIG
+    @param database_file: database of the single site
+    @param upload_folder: upload folder of the single site
+    @return: (site configs, default site name)
+    """
+    path = path or os.environ.get(SITES_CONFIG_ENV)
+    if not path:
+        return [SiteConfig(name="default", database=database_file, uploads=upload_folder)], "default"
+    with open(path, encoding="utf-8") as config_file:
+        raw = json.load(config_file)
+    configs = [
+        SiteConfig(
+            name=site["name"],
+            database=site["database"],
+            uploads=site.get("uploads", os.path.join("sites", site["name"], "uploads")),
+            hosts=tuple(site.get("hosts", ())),
+            templates=site.get("templates"),
+            notification=site.get("notification", {}),
+        )
+        for site in raw["sites"]
+    ]
+    return configs, raw.get("default")
+
+
+def create_registry(database_file: str, upload_folder: str, warm_up=None) -> SiteRegistry:
+    """
+    Builds the registry from SITES_CONFIG, SITES_MAX_OPEN and SITES_IDLE_SECONDS
+    @param database_file: database of the single site used without SITES_CONFIG
+    @param upload_folder: upload folder of that site
+    @param warm_up: callable(site) run on every newly opened site
+    @return: SiteRegistry
+    """
+    configs, default = load_site_configs(database_file=database_file, upload_folder=upload_folder)
+    return SiteRegistry(
+        configs,
+        default=default,
+        max_open=int(os.environ.get(SITES_MAX_OPEN_ENV, "32")),
+        idle_seconds=float(os.environ.get(SITES_IDLE_SECONDS_ENV, "600")),
+        warm_up=warm_up,
+    )
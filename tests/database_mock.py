@@ -1,15 +1,27 @@
 """
-Creates an in-memory sqlite database to run tests on.
+Creates an in-memory sqlite database to run tests on, or empty tables in a PostgreSQL database.
 """
+import atexit
+import os
+import shutil
 import sqlite3
+import subprocess
 import sys
 import logging
-from unittest import TestCase
+import tempfile
+from unittest import TestCase, SkipTest
 
+from src.database import backends
 from src.database.database import DatabaseOperation
 
 DB_NAME_FILENAME = ":memory:"
 DB_TABLE_NAME = "leads"
+POSTGRES_TEST_URL_ENV = "POSTGRES_TEST_URL"
+POSTGRES_TABLES = (
+    "lead_blind_index", "leads", "appointments", "pages", "cache_versions", "idempotency_keys",
+    "reencryption_progress", "page_revisions", "reminder_jobs", "reminder_cursor", "outbox",
+)
+_cluster = {}
 
 
 class MockDatabase(TestCase):
@@ -18,14 +30,20 @@ class MockDatabase(TestCase):
     """
 
     def setUp(self) -> None:
-        self.connection = sqlite3.connect(DB_NAME_FILENAME)
+        self.open_database()
         self.create_database()
-        self.db_operation = DatabaseOperation(sqlite_connection=self.connection)
 
     def tearDown(self) -> None:
-        self.connection.close()
+        self.close_database()
         logging.info("Connection has been closed.")
 
+    def open_database(self) -> None:
+        self.connection = sqlite3.connect(DB_NAME_FILENAME)
+        self.db_operation = DatabaseOperation(sqlite_connection=self.connection)
+
+    def close_database(self) -> None:
+        self.connection.close()
+
     def create_database(self) -> None:
         # Create table
         self.connection.execute("DROP TABLE IF EXISTS leads")
@@ -56,8 +74,74 @@ class MockDatabase(TestCase):
             "route TEXT UNIQUE NOT NULL,"
             "title TEXT NOT NULL,"
             "content TEXT NOT NULL,"
-            "image_url TEXT)"
+            "image_url TEXT,"
+            "content_html TEXT NOT NULL DEFAULT '',"
+            "excerpt TEXT NOT NULL DEFAULT '',"
+            "content_hash TEXT,"
+            "images TEXT NOT NULL DEFAULT '[]')"
+        )
+        self.connection.execute(
+            "CREATE TABLE cache_versions ("
+            "name TEXT PRIMARY KEY,"
+            "version INTEGER NOT NULL) WITHOUT ROWID"
         )
         self.connection.commit()
         logging.info(f"Database {DB_NAME_FILENAME} has been created.")
         logging.info(f"Database table {DB_TABLE_NAME} was created.")
+
+
+def postgres_test_url() -> str | None:
+    """
+    Returns $POSTGRES_TEST_URL (e.g. a local container), otherwise starts a throwaway cluster once per
+    test run when initdb and pg_ctl are on the PATH
+    @return: URL or None when PostgreSQL is not available
+    """
+    if os.environ.get(POSTGRES_TEST_URL_ENV):
+        return os.environ[POSTGRES_TEST_URL_ENV]
+    if "url" not in _cluster:
+        _cluster["url"] = _start_cluster()
+    return _cluster["url"]
+
+
+def _start_cluster() -> str | None:
+    initdb, pg_ctl = shutil.which("initdb"), shutil.which("pg_ctl")
+    if not initdb or not pg_ctl:
+        return None
+    directory = tempfile.mkdtemp(prefix="pgtest")
+    data = os.path.join(directory, "data")
+    try:
+        subprocess.run([initdb, "-D", data, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+                       check=True, capture_output=True)
+        subprocess.run([pg_ctl, "-D", data, "-l", os.path.join(directory, "server.log"), "-w",
+                        "-o", f"-k {directory} -c listen_addresses=''", "start"], check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as error:
+        logging.warning("Temporary PostgreSQL cluster did not start: %s", error)
+        shutil.rmtree(directory, ignore_errors=True)
+        return None
+
+    def stop() -> None:
+        subprocess.run([pg_ctl, "-D", data, "-m", "immediate", "stop"], capture_output=True)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    atexit.register(stop)
+    return f"postgresql://postgres@/postgres?host={directory}"
+
+
+class PostgresMockDatabase(MockDatabase):
+    """
+    Runs the same tests against PostgreSQL; self.connection is the DatabaseOperation's own connection
+    so statements in tests go through the same translation as the app's
+    """
+
+    def open_database(self) -> None:
+        if backends.psycopg is None:
+            raise SkipTest("psycopg is not installed")
+        url = postgres_test_url()
+        if not url:
+            raise SkipTest(f"set {POSTGRES_TEST_URL_ENV} or put initdb and pg_ctl on the PATH")
+        self.db_operation = DatabaseOperation(backend=backends.PostgresBackend(url, min_size=1, max_size=2))
+        self.connection = self.db_operation.connection
+        self.connection.execute(f"DROP TABLE IF EXISTS {', '.join(POSTGRES_TABLES)} CASCADE")
+
+    def close_database(self) -> None:
+        self.db_operation.close()
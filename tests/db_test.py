@@ -1,9 +1,14 @@
 """
 This module contains tests for class DatabaseOperation
 """
+import os
+import tempfile
+import threading
 import unittest
 from datetime import datetime
+from unittest import mock
 
+from src.database.backends import SqliteBackend
 from src.database.database import DatabaseOperation
 from src.appointment import Appointment
 from src.page import Page
@@ -122,9 +127,9 @@ class MyTestCase(tests.database_mock.MockDatabase):
         contact = self.db_operation.get_contact(data["email"])
         self.assertEqual({}, contact)
 
-    def test_insert_duplicate_email_fails(self) -> None:
+    def test_insert_duplicate_email_upserts(self) -> None:
         """
-        Test if the insert method returns an exception if a duplicate is attempted
+        Test that inserting a lead with an existing email updates it instead of failing
         @return:
         """
         data = {
@@ -138,9 +143,28 @@ class MyTestCase(tests.database_mock.MockDatabase):
         }
 
         self.db_operation.insert_contact_data(data)
-        op_result = self.db_operation.insert_contact_data(data)
+        op_result = self.db_operation.insert_contact_data(dict(data, message="Jedi escaped, please advise."))
 
-        self.assertEqual(False, op_result)
+        self.assertEqual(True, op_result)
+        contacts = self.db_operation.get_all_contacts()
+        self.assertEqual(1, len(contacts))
+        self.assertEqual((data["email"], data["phone_number"]), (contacts[0].email, contacts[0].phone_number))
+        self.assertEqual("Jedi escaped, please advise.", self.db_operation.get_contact(data["email"])["message"])
+
+    def test_idempotency_key_suppresses_resubmission(self) -> None:
+        """
+        Test that a repeated idempotency key returns the original result without a second row
+        @return:
+        """
+        self.db_operation.create_idempotency_table()
+        appointment = Appointment(datetime(2026, 5, 4), "Briefing", "18005551111", "Yavin", "Death Star plans")
+
+        self.assertTrue(self.db_operation.insert_appointment(appointment, idempotency_key="k1"))
+        self.assertTrue(self.db_operation.insert_appointment(appointment, idempotency_key="k1"))
+
+        self.assertEqual(1, len(self.db_operation.get_appointments(appointment.date)))
+        self.assertEqual({"success": True}, self.db_operation.get_idempotent_result("appointment", "k1"))
+        self.assertIsNone(self.db_operation.get_idempotent_result("contact", "k1"))
 
     def test_role_type_has_correct_permission(self) -> None:
         """
@@ -226,5 +250,141 @@ class MyTestCase(tests.database_mock.MockDatabase):
         self.assertTrue(page1 in pages)
         self.assertTrue(page2 in pages)
 
+    def test_writes_bump_cache_versions(self) -> None:
+        """
+        Tests that page and contact writes bump their fragment cache versions
+        """
+        self.db_operation.insert_page(Page(route="p1", title="T1", content="C1"))
+        self.db_operation.update_page(Page(route="p1", title="T2", content="C2"))
+        self.db_operation.insert_contact_data({
+            "first_name": "Ahsoka",
+            "last_name": "Tano",
+            "phone_number": "18005552222",
+            "email": "ahsoka@fulcrum.net",
+            "subject": "Rebellion",
+            "message": "Meet at the usual place.",
+            "visible": 1,
+        })
+
+        versions = self.db_operation.get_cache_versions()
+        self.assertEqual(2, versions["pages"])
+        self.assertEqual(1, versions["contacts"])
+
+
+class TestConcurrentSubmissions(unittest.TestCase):
+    """
+    Tests double submissions racing on one shared file database
+    """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = DatabaseOperation(os.path.join(self.directory.name, "contacts.db"))
+        self.database.create_leads_table("leads")
+        self.database.create_appointment_table("appointments")
+        self.database.create_cache_versions_table()
+        self.database.create_idempotency_table()
+
+    def tearDown(self) -> None:
+        self.database.close()
+        self.directory.cleanup()
+
+    def _race(self, submit) -> list:
+        """
+        Runs submit twice, the second while the first is paused inside its transaction
+        """
+        inside, resume = threading.Event(), threading.Event()
+        encrypt = self.database.encryption.encrypt
+
+        def paused_encrypt(value):
+            if not inside.is_set():
+                inside.set()
+                resume.wait(5)
+            return encrypt(value)
+
+        results = []
+        with mock.patch.object(self.database.encryption, "encrypt", side_effect=paused_encrypt):
+            first = threading.Thread(target=lambda: results.append(submit()))
+            first.start()
+            inside.wait(5)
+            second = threading.Thread(target=lambda: results.append(submit()))
+            second.start()
+            second.join(0.2)
+            resume.set()
+            first.join(5)
+            second.join(5)
+        return results
+
+    def test_double_submitted_appointment_is_stored_once(self) -> None:
+        """
+        Tests that the duplicate waits for the first submission instead of rolling it back
+        """
+        appointment = Appointment(datetime(2026, 5, 4), "Briefing", "18005551111", "Yavin", "Death Star plans")
+        results = self._race(lambda: self.database.insert_appointment(appointment, idempotency_key="k1"))
+        self.assertEqual([True, True], results)
+        self.assertEqual(1, len(self.database.get_appointments(appointment.date)))
+        self.assertEqual({"success": True}, self.database.get_idempotent_result("appointment", "k1"))
+
+    def test_double_submitted_contact_keeps_its_key(self) -> None:
+        """
+        Tests that the lead and its idempotency key both survive a racing duplicate
+        """
+        data = {"first_name": "Leia", "last_name": "Organa", "phone_number": "18005552222",
+                "email": "leia@alderaan.org", "subject": "Help", "message": "You're my only hope", "visible": 1}
+        results = self._race(lambda: self.database.insert_contact_data(data, idempotency_key="k2"))
+        self.assertEqual([True, True], results)
+        self.assertEqual(1, len(self.database.get_all_contacts()))
+        self.assertEqual({"success": True}, self.database.get_idempotent_result("contact", "k2"))
+
+
+class TestSqliteConnection(unittest.TestCase):
+    """
+    Tests that threads sharing a file database's connection keep their transactions apart
+    """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.connection = SqliteBackend(os.path.join(self.directory.name, "pool.db"), readers=2).connect()
+        self.connection.execute("create table t(x INTEGER)")
+
+    def tearDown(self) -> None:
+        self.connection.close()
+        self.directory.cleanup()
+
+    def _in_thread(self, target):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(target()))
+        thread.start()
+        thread.join(5)
+        return result[0]
+
+    def test_transactions_belong_to_their_thread(self) -> None:
+        """
+        Tests that another thread's rollback keeps a pending insert, reads only see commits and
+        a second writer waits for the first to finish
+        """
+        self.connection.execute("insert into t values (1)")
+        self._in_thread(self.connection.rollback)
+        self.assertEqual(0, self._in_thread(lambda: self.connection.execute("select count(*) from t").fetchone()[0]))
+        self.assertEqual(1, self.connection.execute("select count(*) from t").fetchone()[0])
+
+        second = threading.Thread(target=lambda: (self.connection.execute("insert into t values (2)"),
+                                                  self.connection.commit()))
+        second.start()
+        second.join(0.2)
+        self.assertTrue(second.is_alive())
+        self.connection.commit()
+        second.join(5)
+        self.assertEqual([(1,), (2,)], self.connection.execute("select x from t order by x").fetchall())
+
+    def test_abandoned_transactions_are_rolled_back(self) -> None:
+        """
+        Tests that a transaction left open by a finished thread does not block writers for good
+        """
+        self._in_thread(lambda: self.connection.execute("insert into t values (1)"))
+        self.connection.execute("insert into t values (2)")
+        self.connection.commit()
+        self.assertEqual([(2,)], self.connection.execute("select x from t").fetchall())
+
+
 if __name__ == "__main__":
     unittest.main()
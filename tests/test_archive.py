@@ -0,0 +1,139 @@
+"""
+This module contains tests for lead archiving and incremental vacuum.
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from src.archive import IncrementalVacuum, LeadArchiver, archive_path_for, enable_incremental_vacuum, file_stats
+from src.database.database import DatabaseOperation
+
+
+class TestArchivePath(unittest.TestCase):
+    def test_every_site_gets_its_own_archive(self) -> None:
+        """
+        Tests that archives sit next to SQLite files and are named after the site or database on PostgreSQL
+        """
+        with mock.patch.dict(os.environ, {"ARCHIVE_DATABASE": ""}):
+            self.assertEqual("data/acme-archive.db", archive_path_for("data/acme.db", "acme"))
+            self.assertEqual("acme-archive.db", archive_path_for("postgresql://web@db/shared", "acme"))
+            self.assertEqual("zenith-archive.db", archive_path_for("postgresql://web@db/zenith?sslmode=require"))
+        with mock.patch.dict(os.environ, {"ARCHIVE_DATABASE": "/archives/{site}.db"}):
+            self.assertEqual("/archives/acme.db", archive_path_for("postgresql://web@db/shared", "acme"))
+
+
+class TestLeadArchiver(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "contacts.db")
+        self.archive_path = os.path.join(self.directory.name, "contacts-archive.db")
+        self.database = DatabaseOperation(self.path)
+        self.database.create_leads_table("leads")
+        self.database.create_cache_versions_table()
+        self.database.create_search_tables()
+        for number in range(40):
+            self.database.insert_contact_data({
+                "first_name": "Jyn", "last_name": f"Erso{number}", "phone_number": f"1800555{number:04d}",
+                "email": f"jyn{number}@rebellion.org", "subject": "Scarif", "message": "Plans " * 1000, "visible": 1,
+            })
+        for number in range(0, 40, 2):
+            self.database.disable_contact(f"jyn{number}@rebellion.org")
+
+    def tearDown(self) -> None:
+        self.database.close()
+        self.directory.cleanup()
+
+    def _archiver(self, **options) -> LeadArchiver:
+        archiver = LeadArchiver(self.database, self.archive_path, batch_size=7,
+                                vacuum=IncrementalVacuum(self.database, pages_per_step=4, pause_seconds=0), **options)
+        self.addCleanup(archiver.close)
+        return archiver
+
+    def _count(self, query: str) -> int:
+        return self.database.connection.execute(query).fetchone()[0]
+
+    def test_hidden_leads_are_archived_and_space_reclaimed(self) -> None:
+        """
+        Tests that hidden leads leave the live tables and indexes, can be found in the archive and
+        that the freed pages are returned to the file system
+        """
+        version = self.database.get_cache_versions()["contacts"]
+        report = self._archiver().run()
+
+        self.assertEqual(20, report["archived"])
+        self.assertEqual(3, report["batches"])
+        self.assertEqual(20, self._count("select count(*) from leads"))
+        self.assertEqual(20, self._count("select count(*) from lead_blind_index"))
+        self.assertEqual(20, len(self.database.get_all_contacts()))
+        self.assertEqual(version + 3, self.database.get_cache_versions()["contacts"])
+        self.assertGreater(report["reclaimed_bytes"], 0)
+        self.assertEqual(report["bytes_before"] - report["reclaimed_bytes"], report["bytes_after"])
+        self.assertEqual(0, file_stats(self.database)["free_bytes"])
+        self.assertLess(report["compression_ratio"], 1)
+
+        lead = self._archiver().lookup("JYN4@rebellion.org")
+        self.assertEqual(("Erso4", "18005550004", 0), (lead["last_name"], lead["phone_number"], lead["visible"]))
+        self.assertIsNone(self._archiver().lookup("jyn5@rebellion.org"))
+        self.assertEqual(0, self._archiver().run()["archived"])
+
+    def test_aged_leads_beyond_keep_latest_are_archived(self) -> None:
+        """
+        Tests that only the newest keep_latest visible leads stay live
+        """
+        report = self._archiver(keep_latest=5).run()
+        self.assertEqual(35, report["archived"])
+        names = sorted(contact.last_name for contact in self.database.get_all_contacts())
+        self.assertEqual(["Erso31", "Erso33", "Erso35", "Erso37", "Erso39"], names)
+
+    def test_reused_lead_ids_keep_both_archived_leads(self) -> None:
+        """
+        Tests that a lead getting the id of an archived one is archived next to it instead of replacing it
+        """
+        self.assertEqual(40, self._archiver(keep_latest=0).run()["archived"])
+        self.database.insert_contact_data({
+            "first_name": "Cassian", "last_name": "Andor", "phone_number": "18005550100",
+            "email": "cassian@rebellion.org", "subject": "Scarif", "message": "Plans", "visible": 1,
+        })
+        self.assertEqual(1, self._count("select id from leads"))
+        self.database.disable_contact("cassian@rebellion.org")
+        archiver = self._archiver()
+        self.assertEqual(1, archiver.run()["archived"])
+
+        self.assertEqual(41, archiver.archive.execute("select count(*) from archived_leads").fetchone()[0])
+        self.assertEqual("Erso0", archiver.lookup("jyn0@rebellion.org")["last_name"])
+        self.assertEqual("Andor", archiver.lookup("cassian@rebellion.org")["last_name"])
+
+    def test_lead_keyed_indexes_are_migrated(self) -> None:
+        """
+        Tests that an archive index keyed by lead_id alone is rebuilt with its entries
+        """
+        connection = sqlite3.connect(self.archive_path)
+        connection.execute("create table archived_leads(lead_id INTEGER PRIMARY KEY, email_hash TEXT,"
+                           " batch_id INTEGER NOT NULL)")
+        connection.execute("insert into archived_leads values (1, 'hash', 1)")
+        connection.commit()
+        connection.close()
+        archive = self._archiver().archive
+        archive.execute("insert into archived_leads values (1, 'hash', 2)")
+        self.assertEqual(2, archive.execute("select count(*) from archived_leads").fetchone()[0])
+
+    def test_existing_files_are_converted_once(self) -> None:
+        """
+        Tests that a file created without incremental auto vacuum is switched over, and skipped afterwards
+        """
+        path = os.path.join(self.directory.name, "legacy.db")
+        connection = sqlite3.connect(path)
+        connection.execute("create table t(x)")
+        connection.commit()
+        connection.close()
+        with DatabaseOperation(path) as legacy:
+            self.assertFalse(IncrementalVacuum(legacy).run()["enabled"])
+            self.assertTrue(enable_incremental_vacuum(legacy))
+            self.assertFalse(enable_incremental_vacuum(legacy))
+            self.assertTrue(IncrementalVacuum(legacy).run()["enabled"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+This module contains tests for module compression.
+"""
+import gzip
+import unittest
+
+from flask import Flask, Response
+
+from src.compression import CompressionMiddleware, negotiate_encoding
+
+
+class TestCompressionMiddleware(unittest.TestCase):
+    def setUp(self) -> None:
+        app = Flask(__name__)
+
+        @app.route("/big")
+        def big():
+            return "<p>hello</p>" * 200
+
+        @app.route("/small")
+        def small():
+            return "tiny"
+
+        @app.route("/image")
+        def image():
+            return Response(b"\x89PNG" * 500, mimetype="image/png")
+
+        @app.route("/stream")
+        def stream():
+            return Response((f"<li>{i}</li>" for i in range(100)), mimetype="text/html")
+
+        self.middleware = CompressionMiddleware(app.wsgi_app)
+        app.wsgi_app = self.middleware
+        self.client = app.test_client()
+
+    def test_negotiate_prefers_available_encoding(self) -> None:
+        """
+        Tests Accept-Encoding parsing with q-values
+        """
+        self.assertEqual("gzip", negotiate_encoding("gzip, br", brotli_available=False))
+        self.assertEqual("br", negotiate_encoding("gzip;q=0.5, br", brotli_available=True))
+        self.assertIsNone(negotiate_encoding("gzip;q=0", brotli_available=False))
+        self.assertIsNone(negotiate_encoding("", brotli_available=True))
+
+    def test_large_html_is_gzipped(self) -> None:
+        """
+        Tests that a large html response is compressed with a matching Content-Length
+        """
+        response = self.client.get("/big", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertEqual(len(response.data), int(response.headers["Content-Length"]))
+        self.assertEqual(b"<p>hello</p>" * 200, gzip.decompress(response.data))
+        self.assertLess(self.middleware.stats.ratio, 1.0)
+
+    def test_compressed_responses_get_a_weak_etag_and_no_ranges(self) -> None:
+        """
+        Tests that a compressed response has a weak ETag and no Accept-Ranges, and an identity one keeps both
+        """
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/html"), ("ETag", environ["etag"]),
+                                      ("Accept-Ranges", "bytes")])
+            return [b"<p>hello</p>" * 200]
+
+        middleware = CompressionMiddleware(app)
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append(dict(headers))
+
+        body = middleware({"HTTP_ACCEPT_ENCODING": "gzip", "etag": '"v1"'}, start_response)
+        self.assertEqual(b"<p>hello</p>" * 200, gzip.decompress(b"".join(body)))
+        middleware({"HTTP_ACCEPT_ENCODING": "gzip", "etag": 'W/"v2"'}, start_response)
+        middleware({"HTTP_ACCEPT_ENCODING": "", "etag": '"v1"'}, start_response)
+        self.assertEqual('W/"v1"', started[0]["ETag"])
+        self.assertNotIn("Accept-Ranges", started[0])
+        self.assertEqual('W/"v2"', started[1]["ETag"])
+        self.assertEqual(('"v1"', "bytes"), (started[2]["ETag"], started[2]["Accept-Ranges"]))
+
+    def test_small_and_binary_bodies_are_skipped(self) -> None:
+        """
+        Tests that small bodies and images are passed through untouched
+        """
+        small = self.client.get("/small", headers={"Accept-Encoding": "gzip"})
+        image = self.client.get("/image", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", small.headers)
+        self.assertEqual(b"tiny", small.data)
+        self.assertNotIn("Content-Encoding", image.headers)
+        self.assertEqual(2, self.middleware.stats.skipped)
+
+    def test_streamed_response_is_compressed(self) -> None:
+        """
+        Tests that generator responses are compressed incrementally
+        """
+        response = self.client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        expected = "".join(f"<li>{i}</li>" for i in range(100)).encode()
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertEqual(expected, gzip.decompress(response.data))
+
+    def test_deferred_start_response(self) -> None:
+        """
+        Tests that a generator application calling start_response on its first iteration is compressed
+        """
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/html")])
+            yield b""
+            yield b"<p>late</p>" * 200
+
+        middleware = CompressionMiddleware(app)
+        started = []
+        body = middleware({"HTTP_ACCEPT_ENCODING": "gzip"}, lambda status, headers, exc_info=None: started.append(
+            dict(headers)))
+        data = b"".join(body)
+        body.close()
+        self.assertEqual("gzip", started[0]["Content-Encoding"])
+        self.assertEqual(b"<p>late</p>" * 200, gzip.decompress(data))
+
+    def test_no_accept_encoding_is_untouched(self) -> None:
+        """
+        Tests that clients without Accept-Encoding get the identity body
+        """
+        response = self.client.get("/big", headers={"Accept-Encoding": ""})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(b"<p>hello</p>" * 200, response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
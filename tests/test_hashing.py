@@ -0,0 +1,100 @@
+"""
+This module contains tests for module hashing and the email hash migration.
+"""
+import unittest
+
+from src.hashing import HashingService, get_hash
+from src.database.migrations import rehash_email_hashes
+import tests.database_mock
+
+
+class TestHashingService(unittest.TestCase):
+    def test_hash_is_canonical_and_keyed(self) -> None:
+        """
+        Tests that case/whitespace variants match and that the key changes the hash
+        """
+        service = HashingService(b"k" * 32)
+        self.assertEqual(service.hash("A@x.com "), service.hash("a@X.com"))
+        self.assertNotEqual(service.hash("a@x.com"), HashingService(b"j" * 32).hash("a@x.com"))
+        self.assertNotEqual(get_hash("a@x.com"), service.hash("a@x.com"))
+
+    def test_hash_many_matches_hash(self) -> None:
+        """
+        Tests that the batch API gives the same result as single calls
+        """
+        service = HashingService(b"k" * 32)
+        values = ["one@x.com", "Two@x.com", "three@x.com"]
+        self.assertEqual([service.hash(v) for v in values], service.hash_many(values))
+
+
+class TestRehashMigration(tests.database_mock.MockDatabase):
+    def _insert_legacy(self, email: str) -> None:
+        self.connection.execute(
+            "INSERT INTO leads (first_name, last_name, phone_number, email, email_hash, subject, message, visible)"
+            " VALUES ('Din', 'Djarin', ?, ?, ?, 'Bounty', 'This is the way.', 1)",
+            (self.db_operation.encryption.encrypt("18005550000"), self.db_operation.encryption.encrypt(email),
+             get_hash(email)),
+        )
+        self.connection.commit()
+
+    def test_legacy_rows_are_found_before_and_after_migration(self) -> None:
+        """
+        Tests that lookups work during and after the in-place rehash
+        """
+        for i in range(5):
+            self._insert_legacy(f"mando{i}@guild.org")
+        self.assertEqual("Din", self.db_operation.get_contact("mando3@guild.org")["first_name"])
+
+        progress = []
+        stats = rehash_email_hashes(self.db_operation, chunk_size=2, progress=progress.append)
+
+        self.assertEqual(5, stats["updated"])
+        self.assertEqual(3, len(progress))
+        self.assertEqual("Din", self.db_operation.get_contact("MANDO3@guild.org")["first_name"])
+        hashes = [row[0] for row in self.connection.execute("select email_hash from leads")]
+        self.assertNotIn(get_hash("mando3@guild.org"), hashes)
+
+    def test_resubmissions_update_legacy_rows(self) -> None:
+        """
+        Tests that a lead still on the legacy hash is updated, and rehashed, instead of stored twice
+        """
+        self._insert_legacy("mando@guild.org")
+        self.assertTrue(self.db_operation.insert_contact_data({
+            "first_name": "Din", "last_name": "Djarin", "phone_number": "18005550001", "email": "mando@guild.org",
+            "subject": "Bounty", "message": "Again.", "visible": 1,
+        }))
+        rows = self.connection.execute("select email_hash, message from leads").fetchall()
+        self.assertEqual([(self.db_operation.hashing.hash("mando@guild.org"), "Again.")], rows)
+
+    def test_canonical_duplicates_are_reported(self) -> None:
+        """
+        Tests that legacy rows differing only in case collide and the later one is cleared
+        """
+        self._insert_legacy("Grogu@guild.org")
+        self._insert_legacy("grogu@guild.org")
+
+        stats = rehash_email_hashes(self.db_operation)
+
+        self.assertEqual(1, stats["collisions"])
+        self.assertEqual(1, self.connection.execute("select count(*) from leads where email_hash is null").fetchone()[0])
+
+    def test_collision_in_the_middle_of_a_chunk_keeps_the_other_rows(self) -> None:
+        """
+        Tests that the rows of a chunk updated around a collision, and the chunks before it, keep their new hash
+        """
+        emails = ["boba@guild.org", "cara@guild.org", "Fennec@guild.org", "fennec@guild.org", "greef@guild.org",
+                  "kuiil@guild.org"]
+        for email in emails:
+            self._insert_legacy(email)
+
+        stats = rehash_email_hashes(self.db_operation, chunk_size=4)
+
+        self.assertEqual((5, 1), (stats["updated"], stats["collisions"]))
+        hashes = [row[0] for row in self.connection.execute("select email_hash from leads order by id")]
+        expected = [self.db_operation.hashing.hash(email) for email in emails]
+        expected[3] = None
+        self.assertEqual(expected, hashes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+This module contains tests for key rotation in EncryptionService and ReencryptionJob
+"""
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from src.appointment import Appointment
+from src.archive import LeadArchiver
+from src.encryption import EncryptionService
+from src.key_rotation import ReencryptionJob
+import tests.database_mock
+
+
+class TestMultiKeyEncryption(unittest.TestCase):
+    def test_old_tokens_decrypt_and_rotate(self) -> None:
+        """
+        Tests that tokens from a retired key still decrypt and rotate to the primary key
+        """
+        old_key, new_key = Fernet.generate_key(), Fernet.generate_key()
+        token = EncryptionService(old_key).encrypt("18005551234")
+        service = EncryptionService([new_key, old_key])
+
+        self.assertEqual("18005551234", service.decrypt(token))
+        rotated = service.rotate(token)
+        self.assertEqual("18005551234", EncryptionService(new_key).decrypt(rotated))
+        with self.assertRaises(InvalidToken):
+            EncryptionService(Fernet.generate_key()).rotate(token)
+
+
+class TestReencryptionJob(tests.database_mock.MockDatabase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.old_key, self.new_key = Fernet.generate_key(), Fernet.generate_key()
+        self.db_operation.encryption = EncryptionService(self.old_key)
+        for i in range(5):
+            self.db_operation.insert_contact_data({
+                "first_name": "Cassian",
+                "last_name": "Andor",
+                "phone_number": f"1800555{i:04d}",
+                "email": f"cassian{i}@rebellion.org",
+                "subject": "Ferrix",
+                "message": "I'm in.",
+                "visible": 1,
+            })
+        self.db_operation.insert_appointment(Appointment(datetime(2026, 1, 1), "Heist", "18005559999", "Aldhani", "Payroll"))
+        self.db_operation.encryption = EncryptionService([self.new_key, self.old_key])
+
+    def test_all_columns_rotate_and_resume(self) -> None:
+        """
+        Tests that the job rotates every encrypted column in batches and records its position
+        """
+        job = ReencryptionJob(self.db_operation, batch_size=2)
+        progress = job.run()
+
+        self.assertEqual(6, progress["rows"])
+        self.assertTrue(progress["tables"]["leads"]["finished"])
+        only_new = EncryptionService(self.new_key)
+        for phone, email in self.connection.execute("select phone_number, email from leads"):
+            self.assertTrue(only_new.decrypt(email).startswith("cassian"))
+        phone = self.connection.execute("select phone_number from appointments").fetchone()[0]
+        self.assertEqual("18005559999", only_new.decrypt(phone))
+
+        self.assertEqual(0, ReencryptionJob(self.db_operation).run()["rows"])
+
+    def test_a_later_rotation_starts_over(self) -> None:
+        """
+        Tests that finished progress recorded under the previous primary key does not stop the next rotation
+        """
+        ReencryptionJob(self.db_operation).run()
+        newest = Fernet.generate_key()
+        self.db_operation.encryption = EncryptionService([newest, self.new_key, self.old_key])
+        self.assertEqual(6, ReencryptionJob(self.db_operation).run()["rows"])
+        email = self.connection.execute("select email from leads").fetchone()[0]
+        self.assertTrue(EncryptionService(newest).decrypt(email).startswith("cassian"))
+
+    def test_concurrent_update_is_not_overwritten(self) -> None:
+        """
+        Tests that a row changed between read and write keeps the live value
+        """
+        job = ReencryptionJob(self.db_operation, batch_size=10, columns={"leads": ("phone_number", "email")})
+        original_rotate = self.db_operation.encryption.rotate
+
+        def rotate_and_race(token):
+            self.connection.execute("UPDATE leads SET subject = 'raced', email = ? WHERE id = 1",
+                                    (self.db_operation.encryption.encrypt("live@rebellion.org"),))
+            return original_rotate(token)
+
+        self.db_operation.encryption.rotate = rotate_and_race
+        job.run()
+
+        email = self.connection.execute("select email from leads where id = 1").fetchone()[0]
+        self.assertEqual("live@rebellion.org", self.db_operation.encryption.decrypt(email))
+
+    def test_archived_leads_rotate(self) -> None:
+        """
+        Tests that the batches of the lead archive are rotated after the live tables, so the old key can go
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive_path = os.path.join(directory.name, "archive.db")
+        for i in range(0, 5, 2):
+            self.db_operation.disable_contact(f"cassian{i}@rebellion.org")
+        archiver = LeadArchiver(self.db_operation, archive_path, batch_size=2)
+        self.addCleanup(archiver.close)
+        self.assertEqual(3, archiver.run()["archived"])
+
+        progress = ReencryptionJob(self.db_operation, archive_path=archive_path).run()
+
+        self.assertEqual(6, progress["rows"])
+        self.assertEqual({"done": 3, "total": 3, "finished": True}, progress["tables"]["archived_lead_batches"])
+        self.db_operation.encryption = EncryptionService(self.new_key)
+        lead = archiver.lookup("cassian2@rebellion.org")
+        self.assertEqual(("18005550002", "cassian2@rebellion.org"), (lead["phone_number"], lead["email"]))
+        self.assertEqual(0, ReencryptionJob(self.db_operation, archive_path=archive_path).run()["rows"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+This module contains tests for the admin change feed.
+"""
+import json
+import threading
+import unittest
+
+from src.events import CONTACT_CHANGED
+from src.live import ChangeFeed, sse_message
+from src.page import Page
+import tests.database_mock
+
+
+def events(chunk: str) -> list[tuple]:
+    """
+    Parses the (event, data) pairs of an SSE chunk
+    """
+    parsed = []
+    for message in chunk.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            parsed.append((fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+class TestChangeFeed(tests.database_mock.MockDatabase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.feed = ChangeFeed(self.db_operation, buffer_size=4, keepalive_seconds=0.01)
+        self.lead = {
+            "first_name": "Leia", "last_name": "Organa", "phone_number": "18005550100",
+            "email": "leia@example.com", "subject": "Plans", "message": "Help", "visible": 1,
+        }
+
+    def tearDown(self) -> None:
+        self.feed.close()
+        super().tearDown()
+
+    def test_sse_message(self) -> None:
+        """
+        Tests the wire format of one message
+        """
+        self.assertEqual('id: a-1\nevent: page\ndata: {"route": "x"}\n\n', sse_message("page", {"route": "x"}, "a-1"))
+
+    def test_changes_are_streamed_as_row_deltas(self) -> None:
+        """
+        Tests that a stream opened at a rendered page's id receives the contact and page changes made since
+        """
+        since = self.feed.last_event_id()
+        self.db_operation.insert_contact_data(self.lead)
+        self.db_operation.insert_page(Page("faq", "FAQ", "Questions"))
+        self.db_operation.disable_contact(self.lead["email"])
+        stream = self.feed.stream(since)
+        self.assertEqual("retry: 3000\n\n", next(stream))
+        received = events(next(stream))
+        self.assertEqual(["contact", "page", "contact_removed"], [event for event, _ in received])
+        self.assertEqual("leia@example.com", received[0][1]["email"])
+        self.assertEqual(received[0][1]["id"], received[2][1]["id"])
+        self.assertEqual({"route": "faq", "title": "FAQ", "preview": "Questions", "image_url": ""}, received[1][1])
+        self.assertEqual(self.connection.execute("select id from leads").fetchone()[0], received[0][1]["id"])
+        self.assertEqual(": keepalive\n\n", next(stream))
+        self.assertEqual(1, self.feed.stats()["streams"])
+        stream.close()
+        self.assertEqual(0, self.feed.stats()["streams"])
+
+    def test_unresumable_streams_resync(self) -> None:
+        """
+        Tests that unknown ids and streams behind the buffer are told to reload
+        """
+        self.assertFalse(self.feed.can_resume("other-3"))
+        stream = self.feed.stream("other-3")
+        next(stream)
+        self.assertEqual([("resync", {})], events(next(stream)))
+
+        since = self.feed.last_event_id()
+        self.assertTrue(self.feed.can_resume(since))
+        for number in range(5):
+            self.db_operation.insert_page(Page(f"p{number}", "T", "C"))
+        self.assertFalse(self.feed.can_resume(since))
+        stream = self.feed.stream(since)
+        next(stream)
+        self.assertEqual([("resync", {})], events(next(stream)))
+
+    def test_waiting_streams_wake_on_changes(self) -> None:
+        """
+        Tests that a change made by another thread is delivered to a stream blocked waiting
+        """
+        self.feed.keepalive_seconds = 5
+        stream = self.feed.stream()
+        next(stream)
+        publish = lambda: self.db_operation.events.publish(CONTACT_CHANGED, lead_id=1, contact=None, version=1)
+        timer = threading.Timer(0.05, publish)
+        timer.start()
+        self.assertEqual([("contact_removed", {"id": 1})], events(next(stream)))
+        timer.join()
+        self.feed.close()
+        self.assertEqual([], list(stream))
+
+    def test_changes_from_other_processes_resync(self) -> None:
+        """
+        Tests that a version bump not seen on the bus makes streams resync after two polls
+        """
+        stream = self.feed.stream()
+        next(stream)
+        self.connection.execute("INSERT INTO cache_versions (name, version) VALUES ('contacts', 7)")
+        self.connection.commit()
+        received = []
+        for _ in range(50):
+            received = events(next(stream))
+            if received:
+                break
+            self.feed._polled_at = 0
+        self.assertEqual([("resync", {})], received)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+This module contains tests for module logging_config.
+"""
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from src.logging_config import configure_logging, stop_logging, parse_levels, SamplingFilter
+
+
+class TestLoggingPipeline(unittest.TestCase):
+    def setUp(self) -> None:
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.log_dir.name, "app.log")
+
+    def tearDown(self) -> None:
+        stop_logging()
+        logging.getLogger("src.database").setLevel(logging.NOTSET)
+        logging.getLogger().setLevel(logging.WARNING)
+        self.log_dir.cleanup()
+
+    def test_records_are_written_as_json(self) -> None:
+        """
+        Tests that records pass through the queue listener as JSON lines with extra fields
+        """
+        configure_logging(log_file=self.log_path, level="INFO", levels={}, sample_rate=1)
+        logging.getLogger("src.test").info("Saved %s", "page", extra={"route": "home"})
+        stop_logging()
+
+        with open(self.log_path, encoding="utf8") as log_file:
+            record = json.loads(log_file.readline())
+        self.assertEqual("Saved page", record["message"])
+        self.assertEqual("src.test", record["logger"])
+        self.assertEqual("home", record["route"])
+
+    def test_subsystem_levels_are_applied(self) -> None:
+        """
+        Tests that per subsystem levels silence lower severity records
+        """
+        configure_logging(log_file=self.log_path, level="INFO", levels={"src.database": "WARNING"}, sample_rate=1)
+        logging.getLogger("src.database.database").info("hidden")
+        logging.getLogger("src.database.database").warning("shown")
+        stop_logging()
+
+        with open(self.log_path, encoding="utf8") as log_file:
+            messages = [json.loads(line)["message"] for line in log_file]
+        self.assertEqual(["shown"], messages)
+
+    def test_sampling_keeps_warnings(self) -> None:
+        """
+        Tests that sampling thins hot path INFO records but never drops warnings
+        """
+        sampler = SamplingFilter(rate=5)
+        info = [logging.makeLogRecord({"name": "src.database.database", "levelno": logging.INFO}) for _ in range(10)]
+        warning = logging.makeLogRecord({"name": "src.database.database", "levelno": logging.WARNING})
+        self.assertEqual(2, sum(sampler.filter(record) for record in info))
+        self.assertTrue(sampler.filter(warning))
+
+    def test_parse_levels(self) -> None:
+        """
+        Tests LOG_LEVELS parsing
+        """
+        self.assertEqual({"src.database": "WARNING", "src.notification": "DEBUG"},
+                         parse_levels("src.database=warning, src.notification=DEBUG"))
+
+
+if __name__ == "__main__":
+    unittest.main()
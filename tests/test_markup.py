@@ -0,0 +1,117 @@
+"""
+This module contains tests for compiling page content at save time.
+"""
+import sqlite3
+import unittest
+from unittest import mock
+
+from src.database.database import DatabaseOperation
+from src.markup import compile_page, content_hash, excerpt, render_markdown
+from src.page import Page
+import tests.database_mock
+
+
+class TestRenderMarkdown(unittest.TestCase):
+    def test_blocks_and_inline_formatting(self) -> None:
+        """
+        Tests headings, lists, quotes, code and inline markup
+        """
+        source = "# Title\n\nSome **bold** and *soft* `x*y*`.\n\n- one\n- two\n\n1. first\n\n> quoted\n\n```\n<b>\n```\n\n---"
+        rendered, images = render_markdown(source)
+        self.assertEqual(
+            "<h1>Title</h1>\n"
+            "<p>Some <strong>bold</strong> and <em>soft</em> <code>x*y*</code>.</p>\n"
+            "<ul><li>one</li><li>two</li></ul>\n"
+            "<ol><li>first</li></ol>\n"
+            "<blockquote><p>quoted</p></blockquote>\n"
+            "<pre><code>&lt;b&gt;</code></pre>\n"
+            "<hr>",
+            rendered,
+        )
+        self.assertEqual([], images)
+
+    def test_html_and_unsafe_urls_are_neutralised(self) -> None:
+        """
+        Tests that raw HTML stays text and only safe link and image URLs are kept
+        """
+        rendered, images = render_markdown(
+            '<script>alert(1)</script> [bad](javascript:alert(1)) [ok](/a/*b*/c) ![Van](/static/van.png "Our van")'
+        )
+        self.assertNotIn("<script>", rendered)
+        self.assertNotIn("javascript", rendered.replace("&lt;script&gt;", ""))
+        self.assertIn('<a href="/a/*b*/c">ok</a>', rendered)
+        self.assertIn('<img src="/static/van.png" alt="Van" title="Our van" loading="lazy">', rendered)
+        self.assertEqual(["/static/van.png"], images)
+
+    def test_control_characters_cannot_smuggle_schemes(self) -> None:
+        """
+        Tests that URLs browsers would read as javascript: after dropping control characters are rejected
+        """
+        for url in ("\x01javascript:alert(1)", " javascript:onerror=alert;throw%201", "java\tscript:alert(1)",
+                    "\x1f\x01JavaScript:alert(1)"):
+            rendered, images = render_markdown(f"[x]({url}) ![y]({url})")
+            self.assertNotIn("<a", rendered, url)
+            self.assertNotIn("<img", rendered, url)
+            self.assertEqual([], images)
+
+    def test_source_cannot_forge_placeholders(self) -> None:
+        """
+        Tests that NUL characters in the source are replaced rather than read as protected fragments
+        """
+        rendered, _ = render_markdown("a \x005\x00 `b`")
+        self.assertEqual("<p>a \ufffd5\ufffd <code>b</code></p>", rendered)
+
+    def test_excerpt(self) -> None:
+        """
+        Tests that excerpts are plain text cut at a word boundary
+        """
+        self.assertEqual("Fish & chips", excerpt("<h1>Fish &amp; chips</h1>"))
+        self.assertEqual("one two…", excerpt("<p>one two three</p>", length=10))
+
+
+class TestCompilePage(unittest.TestCase):
+    def test_unchanged_content_is_not_rendered_again(self) -> None:
+        """
+        Tests that the compiled fields of the previous version are reused when the source is unchanged
+        """
+        previous = compile_page(Page("faq", "FAQ", "**Questions**"))
+        self.assertEqual(content_hash("**Questions**"), previous.content_hash)
+        with mock.patch("src.markup.render_markdown") as render:
+            page = compile_page(Page("faq", "Answers", "**Questions**"), previous)
+        render.assert_not_called()
+        self.assertEqual("<p><strong>Questions</strong></p>", page.content_html)
+        self.assertEqual("Answers", page.title)
+
+
+class TestCompiledPages(tests.database_mock.MockDatabase):
+    def test_pages_are_stored_compiled(self) -> None:
+        """
+        Tests that inserted and updated pages are read back with their compiled HTML, excerpt and images
+        """
+        self.db_operation.insert_page(Page("faq", "FAQ", "## Help\n\n![Map](/static/map.png)"))
+        page = self.db_operation.get_page_by_route("faq")
+        self.assertEqual('<h2>Help</h2>\n<p><img src="/static/map.png" alt="Map" loading="lazy"></p>', page.content_html)
+        self.assertEqual("Help", page.excerpt)
+        self.assertEqual(("/static/map.png",), page.images)
+
+        self.db_operation.update_page(Page("faq", "FAQ", "*Updated*"))
+        page = self.db_operation.get_all_pages()[0]
+        self.assertEqual(("<p><em>Updated</em></p>", "Updated", ()), (page.content_html, page.excerpt, page.images))
+
+    def test_existing_tables_are_migrated(self) -> None:
+        """
+        Tests that a pages table without the compiled columns gains them and its pages are compiled
+        """
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE pages (id INTEGER PRIMARY KEY, route TEXT UNIQUE NOT NULL,"
+                           " title TEXT NOT NULL, content TEXT NOT NULL, image_url TEXT)")
+        connection.execute("INSERT INTO pages (route, title, content) VALUES ('home', 'Home', '**Hi**')")
+        connection.commit()
+        database = DatabaseOperation(sqlite_connection=connection)
+        self.assertTrue(database.create_pages_table("pages"))
+        self.assertEqual("<p><strong>Hi</strong></p>", database.get_page_by_route("home").content_html)
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+This module contains tests for module metrics.
+"""
+import time
+import unittest
+
+from src import metrics
+from src.metrics import MetricsRegistry
+from src.page import Page
+import tests.database_mock
+
+
+class TestHistogram(unittest.TestCase):
+    def test_render_is_cumulative(self) -> None:
+        """
+        Tests that bucket counts are cumulative and labelled in the exposition format
+        """
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, "/")
+        histogram.observe(0.5, "/")
+        histogram.observe(5, "/")
+
+        text = registry.render()
+        self.assertIn('latency_seconds_bucket{route="/",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{route="/",le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="/",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{route="/"} 3', text)
+
+
+class TestRequestMetrics(tests.database_mock.MockDatabase):
+    def test_sql_statements_are_counted_per_request(self) -> None:
+        """
+        Tests that statements run through DatabaseOperation are attributed to the current request
+        """
+        stats = metrics.begin_request()
+        self.db_operation.insert_page(Page(route="m", title="T", content="C"))
+        self.db_operation.get_page_by_route("m")
+        self.assertEqual(3, stats.sql_count)
+        self.assertGreater(stats.sql_seconds, 0)
+        metrics.end_request("GET", "/test", 200)
+
+        text = metrics.registry.render()
+        self.assertIn('db_statements_per_request_count{route="/test"}', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/test",status="200"}', text)
+
+    def test_sql_time_includes_fetching_rows(self) -> None:
+        """
+        Tests that the request's SQL time covers stepping through a result, not just its first row
+        """
+        self.connection.create_function("pause", 1, lambda value: time.sleep(0.01) or value)
+        self.connection.execute("create table t(x INTEGER)")
+        self.connection.executemany("insert into t values (?)", [(i,) for i in range(10)])
+        stats = metrics.begin_request()
+        self.assertEqual(10, len(self.db_operation.connection.execute("select pause(x) from t").fetchall()))
+        self.assertEqual(1, stats.sql_count)
+        self.assertGreaterEqual(stats.sql_seconds, 0.09)
+        metrics.end_request("GET", "/fetch", 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+This module contains tests for the outbox and the admin digest relay.
+"""
+import unittest
+from datetime import datetime
+
+from src.appointment import Appointment
+from src.database.database import DatabaseOperation
+from src.outbox import OutboxRelay, digest_summary
+import tests.database_mock
+
+NOW = datetime(2026, 5, 4, 9, 0).timestamp()
+
+
+class FakeNotifier:
+    def __init__(self, results: list = None) -> None:
+        self.emails = []
+        self.messages = []
+        self.results = list(results or [])
+
+    def send_email(self, to_email: str, subject: str, content: str) -> bool:
+        self.emails.append((to_email, subject, content))
+        return self.results.pop(0) if self.results else True
+
+    def send_sms(self, to_number: str, body: str) -> bool:
+        self.messages.append((to_number, body))
+        return True
+
+
+class TestOutbox(tests.database_mock.MockDatabase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.db_operation.create_idempotency_table()
+        self.db_operation.create_outbox_table()
+        self.now = NOW
+        self.notifier = FakeNotifier()
+        self.relay = self._relay()
+
+    def _relay(self) -> OutboxRelay:
+        return OutboxRelay(self.db_operation, self.notifier, email="owner@example.com", sms="18005550199",
+                           batch_size=3, clock=lambda: self.now)
+
+    def _lead(self, number: int) -> dict:
+        return {
+            "first_name": f"Lead{number}", "last_name": "<b>Smith</b>", "phone_number": "18005550100",
+            "email": f"lead{number}@example.com", "subject": "Quote", "message": "Hi", "visible": 1,
+        }
+
+    def _waiting(self) -> int:
+        return self.connection.execute("select count(*) from outbox").fetchone()[0]
+
+    def test_events_are_written_with_the_record(self) -> None:
+        """
+        Tests that each stored lead and booking queues one event and a repeated submission queues none
+        """
+        self.assertTrue(self.db_operation.insert_contact_data(self._lead(1), idempotency_key="k1"))
+        self.assertTrue(self.db_operation.insert_contact_data(self._lead(1), idempotency_key="k1"))
+        self.assertTrue(self.db_operation.insert_appointment(
+            Appointment(datetime(2026, 5, 6), "Estimate", "18005550100", "Main St", "")
+        ))
+        rows = self.connection.execute("select topic, payload from outbox order by id").fetchall()
+        self.assertEqual(["lead", "appointment"], [topic for topic, _ in rows])
+        self.assertNotIn("18005550100", "".join(payload for _, payload in rows))
+
+    def test_only_new_leads_queue_events(self) -> None:
+        """
+        Tests that a resubmission updating an existing lead queues nothing, and that a process which
+        did not enable the outbox queues nothing even though the table exists
+        """
+        self.db_operation.insert_contact_data(self._lead(1))
+        self.db_operation.insert_contact_data(self._lead(1))
+        self.assertEqual(1, self._waiting())
+
+        other_process = DatabaseOperation(sqlite_connection=self.connection)
+        other_process.insert_contact_data(self._lead(2))
+        self.assertEqual(1, self._waiting())
+
+    def test_a_failed_insert_queues_no_event(self) -> None:
+        """
+        Tests that the event is rolled back together with the record it describes
+        """
+        data = self._lead(1)
+        del data["subject"]
+        self.assertFalse(self.db_operation.insert_contact_data(data))
+        self.assertEqual(0, self._waiting())
+
+    def test_events_are_coalesced_into_digests(self) -> None:
+        """
+        Tests that waiting events go out as one email and one SMS per batch and are then removed
+        """
+        for number in range(4):
+            self.db_operation.insert_contact_data(self._lead(number))
+        self.db_operation.insert_appointment(Appointment(datetime(2026, 5, 6), "Estimate", "1800", "Main St", ""))
+        self.assertEqual(5, self.relay.drain())
+        self.assertEqual(2, len(self.notifier.emails))
+        self.assertEqual("Digest: 3 new leads", self.notifier.emails[0][1])
+        self.assertIn("&lt;b&gt;Smith&lt;/b&gt;", self.notifier.emails[0][2])
+        self.assertIn("1 new lead, 1 new booking", self.notifier.messages[1][1])
+        self.assertEqual(0, self._waiting())
+        self.assertEqual(0, self.relay.drain())
+
+    def test_failed_digests_are_sent_again(self) -> None:
+        """
+        Tests at-least-once delivery: events stay queued until a digest succeeds, and claims of a relay
+        that died are picked up once their lease expires
+        """
+        self.notifier.results = [False]
+        self.db_operation.insert_contact_data(self._lead(1))
+        self.assertEqual(0, self.relay.drain())
+        self.assertEqual(1, self._waiting())
+        self.assertGreater(self.relay.next_wait(), self.relay.interval_seconds)
+
+        self.connection.execute("UPDATE outbox SET claimed_at = ?", (int(NOW),))
+        self.connection.commit()
+        self.assertEqual(0, self._relay().drain())
+        self.now += self.relay.lease_seconds + 1
+        self.assertEqual(1, self.relay.drain())
+        self.assertEqual(2, len(self.notifier.emails))
+        self.assertEqual(self.relay.interval_seconds, self.relay.next_wait())
+        self.assertEqual(0, self.relay.stats()["waiting"])
+
+    def test_digest_summary(self) -> None:
+        """
+        Tests the per topic counts
+        """
+        events = [(1, "appointment", {}, NOW), (2, "lead", {}, NOW), (3, "appointment", {}, NOW)]
+        self.assertEqual("2 new bookings, 1 new lead", digest_summary(events))
+
+
+if __name__ == "__main__":
+    unittest.main()
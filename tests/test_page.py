@@ -21,3 +21,13 @@ class TestPage(unittest.TestCase):
         page1 = Page(route="home", title="Welcome", content="Welcome to our website!")
         page2 = Page(route="services", title="Our Services", content="Here are our services.")
         self.assertNotEqual(page1, page2)
+
+    def test_page_is_immutable_and_slotted(self) -> None:
+        """
+        tests that pages can't be changed in place and carry no per-instance __dict__
+        """
+        page = Page.from_row(None, ("home", "Welcome", "Welcome to our website!", "/static/uploads/home.png"))
+        self.assertEqual("/static/uploads/home.png", page.image_url)
+        self.assertFalse(hasattr(page, "__dict__"))
+        with self.assertRaises(AttributeError):
+            page.title = "Changed"
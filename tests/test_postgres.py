@@ -0,0 +1,91 @@
+"""
+This module runs the database test cases against PostgreSQL and tests the SQL translation.
+The PostgreSQL cases are skipped unless psycopg is installed and a server is reachable, see
+tests.database_mock.postgres_test_url.
+"""
+import unittest
+
+from src.database.backends import SqliteBackend, create_backend, translate
+from src.search import postgres_search_query, tsquery
+from tests import db_test, test_hashing, test_key_rotation, test_outbox, test_reminders, test_revisions, test_search, test_seed
+from tests.database_mock import PostgresMockDatabase
+
+
+class TestDatabaseOperationPostgres(PostgresMockDatabase, db_test.MyTestCase):
+    pass
+
+
+class TestContactSearchPostgres(PostgresMockDatabase, test_search.TestContactSearch):
+    pass
+
+
+class TestSeederPostgres(PostgresMockDatabase, test_seed.TestSeeder):
+    pass
+
+
+class TestRehashMigrationPostgres(PostgresMockDatabase, test_hashing.TestRehashMigration):
+    pass
+
+
+class TestReencryptionJobPostgres(PostgresMockDatabase, test_key_rotation.TestReencryptionJob):
+    pass
+
+
+class TestPageRevisionsPostgres(PostgresMockDatabase, test_revisions.TestPageRevisions):
+    pass
+
+
+class TestOutboxPostgres(PostgresMockDatabase, test_outbox.TestOutbox):
+    pass
+
+
+class TestReminderSchedulerPostgres(PostgresMockDatabase, test_reminders.TestReminderScheduler):
+    pass
+
+
+class TestTranslate(unittest.TestCase):
+    def test_placeholders(self) -> None:
+        """
+        Tests that qmark and named placeholders are rewritten outside of quotes only
+        """
+        self.assertEqual(
+            "select '?', ':x', 'a%%' from t where a = %s and b like %s",
+            translate("select '?', ':x', 'a%' from t where a = ? and b like ?"),
+        )
+        self.assertEqual(
+            "UPDATE leads SET email = %(email)s WHERE email_hash in (%(old)s, %(legacy)s) and x::text = %s",
+            translate("UPDATE leads SET email = :email WHERE email_hash in (:old, :legacy) and x::text = ?"),
+        )
+
+    def test_sqlite_ddl(self) -> None:
+        """
+        Tests that rowid primary keys and WITHOUT ROWID are rewritten for PostgreSQL
+        """
+        self.assertEqual(
+            "create table t(id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,name TEXT)",
+            translate("create table t(id INTEGER PRIMARY KEY,name TEXT)"),
+        )
+        self.assertEqual(
+            "create table v(name TEXT PRIMARY KEY)", translate("create table v(name TEXT PRIMARY KEY) WITHOUT ROWID")
+        )
+
+    def test_backend_selection(self) -> None:
+        """
+        Tests that only postgresql URLs select the PostgreSQL backend
+        """
+        self.assertIsInstance(create_backend("contacts.db"), SqliteBackend)
+        self.assertEqual("contacts.db", create_backend("contacts.db").path)
+
+    def test_postgres_search_query(self) -> None:
+        """
+        Tests the tsquery built for free text and its combination with exact lookups
+        """
+        self.assertEqual("'Droid' & 'purch':*", tsquery("Droid purch"))
+        sql, parameters = postgres_search_query(text="droi", email_bidx="ab", limit=5)
+        self.assertIn("to_tsquery('simple', ?)", sql)
+        self.assertEqual(("ab", "'droi':*", 5), parameters)
+        self.assertEqual((None, ()), postgres_search_query())
+
+
+if __name__ == "__main__":
+    unittest.main()
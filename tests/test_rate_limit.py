@@ -0,0 +1,76 @@
+"""
+This module contains tests for module rate_limit.
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src.rate_limit import MemoryRateLimiter, SqliteRateLimiter, create_limiter
+
+
+class TestMemoryRateLimiter(unittest.TestCase):
+    @patch("src.rate_limit.time.monotonic")
+    def test_burst_then_refill(self, mock_time) -> None:
+        """
+        Tests that a bucket allows its burst, rejects with a retry time, then refills
+        """
+        mock_time.return_value = 100.0
+        limiter = MemoryRateLimiter(rate=1.0, capacity=2)
+        self.assertTrue(limiter.allow("ip:1")[0])
+        self.assertTrue(limiter.allow("ip:1")[0])
+        allowed, retry_after = limiter.allow("ip:1")
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(1.0, retry_after)
+        self.assertTrue(limiter.allow("ip:2")[0])
+
+        mock_time.return_value = 101.0
+        self.assertTrue(limiter.allow("ip:1")[0])
+
+    def test_least_recent_keys_are_evicted(self) -> None:
+        """
+        Tests that the bucket table never grows past max_keys
+        """
+        limiter = MemoryRateLimiter(rate=1.0, capacity=1, max_keys=3)
+        for i in range(10):
+            limiter.allow(f"ip:{i}")
+        self.assertEqual(3, len(limiter._buckets))
+        self.assertIn("ip:9", limiter._buckets)
+
+    def test_non_positive_limits_are_rejected(self) -> None:
+        """
+        Tests that a zero rate from the environment fails at startup instead of on every request
+        """
+        with self.assertRaises(ValueError):
+            create_limiter(rate=0, capacity=3)
+        with self.assertRaises(ValueError):
+            create_limiter(rate=1.0, capacity=0)
+
+
+class TestSqliteRateLimiter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "rate.db")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_budget_is_shared_between_instances(self) -> None:
+        """
+        Tests that two limiters on the same file (two workers) draw from one bucket
+        """
+        worker_a = SqliteRateLimiter(self.path, rate=0.001, capacity=2)
+        worker_b = SqliteRateLimiter(self.path, rate=0.001, capacity=2)
+        self.assertTrue(worker_a.allow("ip:1")[0])
+        self.assertTrue(worker_b.allow("ip:1")[0])
+        allowed, retry_after = worker_a.allow("ip:1")
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertFalse(worker_b.allow("ip:1")[0])
+        self.assertTrue(worker_b.allow("ip:2")[0])
+        worker_a.connection.close()
+        worker_b.connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+This module contains tests for the appointment reminder scheduler.
+"""
+import unittest
+from datetime import datetime
+
+from src.appointment import Appointment
+from src.reminders import ReminderScheduler, parse_offsets
+import tests.database_mock
+
+NOW = datetime(2026, 5, 4, 9, 0).timestamp()
+
+
+class FakeNotifier:
+    def __init__(self, results: list = None) -> None:
+        self.messages = []
+        self.results = list(results or [])
+
+    def send_sms(self, to_number: str, body: str) -> bool:
+        self.messages.append((to_number, body))
+        return self.results.pop(0) if self.results else True
+
+
+class TestReminderScheduler(tests.database_mock.MockDatabase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.now = NOW
+        self.notifier = FakeNotifier()
+        self.scheduler = self._scheduler()
+        self.scheduler.create_tables()
+
+    def _scheduler(self) -> ReminderScheduler:
+        return ReminderScheduler(self.db_operation, self.notifier, batch_size=2, clock=lambda: self.now)
+
+    def _book(self, when: str, phone_number: str = "18005550100") -> None:
+        self.db_operation.insert_appointment(
+            Appointment(datetime.fromisoformat(when), "Estimate", phone_number, "Main St", "")
+        )
+
+    def _statuses(self) -> dict:
+        return dict(self.connection.execute(
+            "select appointment_id || ':' || kind, status from reminder_jobs"
+        ).fetchall())
+
+    def test_parse_offsets(self) -> None:
+        """
+        Tests that offsets are read as labelled seconds
+        """
+        self.assertEqual({"24h": 86400, "30m": 1800, "2d": 172800}, parse_offsets("24h, 30m,2d"))
+        with self.assertRaises(ValueError):
+            parse_offsets("soon")
+
+    def test_jobs_are_derived_once_and_resume_after_restart(self) -> None:
+        """
+        Tests that only reminders still ahead are created and a restarted scheduler only scans new appointments
+        """
+        self._book("2026-05-06T10:00:00")
+        self._book("2026-05-04T10:30:00")
+        self._book("2026-05-01T10:00:00")
+        self.assertEqual(3, self.scheduler.derive())
+        self.assertEqual({"1:24h": "pending", "1:1h": "pending", "2:1h": "pending"}, self._statuses())
+        self.assertEqual(0, self.scheduler.derive())
+
+        restarted = self._scheduler()
+        self._book("2026-05-10T10:00:00")
+        self.assertEqual(2, restarted.derive())
+        self.assertEqual(1, restarted.stats()["scanned"])
+
+    def test_due_reminders_are_sent_in_order(self) -> None:
+        """
+        Tests that the heap only holds jobs within the horizon and fires them when due
+        """
+        self._book("2026-05-04T10:30:00", "18005550101")
+        self._book("2026-05-04T10:45:00", "18005550102")
+        self._book("2026-05-20T09:00:00", "18005550103")
+        self.scheduler.derive()
+        self.assertEqual(2, self.scheduler.refill())
+        self.assertEqual(0, self.scheduler.run_due())
+
+        self.now += 45 * 60
+        self.assertEqual(2, self.scheduler.run_due())
+        self.assertEqual(["18005550101", "18005550102"], [to for to, _ in self.notifier.messages])
+        self.assertIn("Estimate at Main St on May 04 at 10:30", self.notifier.messages[0][1])
+        self.assertEqual("sent", self._statuses()["1:1h"])
+        self.assertEqual("pending", self._statuses()["3:24h"])
+
+    def test_failed_sends_are_retried_then_given_up(self) -> None:
+        """
+        Tests retry with backoff until max_attempts and that reminders after the appointment are skipped
+        """
+        self.notifier.results = [False, False, False]
+        self._book("2026-05-04T12:00:00")
+        self._book("2026-05-04T10:30:00")
+        self.scheduler.derive()
+        self.scheduler.refill()
+        self.now = datetime(2026, 5, 4, 11, 0).timestamp()
+        self.scheduler.refill()
+        self.scheduler.run_due()
+        self.assertEqual({"1:1h": "pending", "2:1h": "skipped"}, self._statuses())
+        for _ in range(2):
+            self.now += 600
+            self.scheduler.refill()
+            self.scheduler.run_due()
+        self.assertEqual("failed", self._statuses()["1:1h"])
+        self.assertEqual(3, len(self.notifier.messages))
+        self.assertEqual(2, self.scheduler.stats()["retried"])
+
+    def test_abandoned_claims_are_recovered(self) -> None:
+        """
+        Tests that jobs claimed by a worker that died are sent again after the lease expires
+        """
+        self._book("2026-05-04T10:30:00")
+        self.scheduler.derive()
+        self.connection.execute("UPDATE reminder_jobs SET status = 'sending', claimed_at = ?", (int(NOW) - 3600,))
+        self.connection.commit()
+        restarted = self._scheduler()
+        self.assertEqual(1, restarted.refill())
+        self.now += 3600
+        self.assertEqual(1, restarted.run_due())
+        self.assertEqual({"1:1h": "sent"}, self._statuses())
+
+
+if __name__ == "__main__":
+    unittest.main()
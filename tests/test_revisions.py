@@ -0,0 +1,78 @@
+"""
+This module contains tests for the page revision history.
+"""
+import random
+import unittest
+
+from src.database.revisions import decode, encode_delta, encode_snapshot, lines_page, page_lines
+from src.page import Page
+from src.routing import RouteTable
+import tests.database_mock
+
+
+class TestRevisionEncoding(unittest.TestCase):
+    def test_delta_round_trip(self) -> None:
+        """
+        Tests that a delta rebuilds the new version from the old one
+        """
+        old = page_lines(Page("faq", "FAQ", "One.\nTwo.\nThree.\n", "/uploads/a.png"))
+        new = page_lines(Page("faq", "Questions", "Zero.\nOne.\nThree.\nFour."))
+        self.assertEqual(new, decode(encode_delta(old, new), old))
+        self.assertEqual(old, decode(encode_snapshot(old), None))
+        self.assertEqual(Page("faq", "Questions", "Zero.\nOne.\nThree.\nFour."), lines_page("faq", new))
+
+
+class TestPageRevisions(tests.database_mock.MockDatabase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.db_operation.create_page_revisions_table()
+        self.db_operation.snapshot_every = 4
+        self.db_operation.insert_page(Page("about", "About", "Version 0"))
+
+    def _content(self, version: int) -> str:
+        rng = random.Random(version)
+        return "\n".join(f"Paragraph {i} {'edited ' * rng.randrange(3)}" for i in range(20)) + f"\nVersion {version}"
+
+    def test_every_revision_can_be_rebuilt(self) -> None:
+        """
+        Tests that each stored revision decodes to the page as it was written, across several snapshots
+        """
+        for version in range(1, 11):
+            self.db_operation.update_page(Page("about", "About", self._content(version)))
+        revisions = self.db_operation.get_page_revisions("about")
+        self.assertEqual(list(range(11, 0, -1)), [revision["revision"] for revision in revisions])
+        self.assertEqual([1, 5, 9], sorted(r["revision"] for r in revisions if not r["is_delta"]))
+        self.assertEqual("Version 0", self.db_operation.get_page_revision("about", 1).content)
+        for version in range(1, 11):
+            self.assertEqual(self._content(version), self.db_operation.get_page_revision("about", version + 1).content)
+        self.assertIsNone(self.db_operation.get_page_revision("about", 12))
+
+    def test_rollback_is_a_new_revision_and_updates_caches(self) -> None:
+        """
+        Tests that rolling back restores the page, bumps the pages version and patches the route table
+        """
+        route_table = RouteTable(self.db_operation, check_seconds=60)
+        route_table.load()
+        self.db_operation.update_page(Page("about", "About us", "Version 1", "/uploads/team.png"))
+        version = self.db_operation.get_cache_versions()["pages"]
+
+        self.assertTrue(self.db_operation.rollback_page("about", 1))
+        self.assertEqual(Page("about", "About", "Version 0", ""), self.db_operation.get_page_by_route("about"))
+        self.assertEqual("About", route_table.lookup("/about")[1].title)
+        self.assertEqual(version + 1, self.db_operation.get_cache_versions()["pages"])
+        self.assertEqual(3, len(self.db_operation.get_page_revisions("about")))
+        self.assertFalse(self.db_operation.rollback_page("about", 9))
+
+    def test_pages_written_before_the_history_keep_their_old_version(self) -> None:
+        """
+        Tests that the first update of a page without history records the replaced version too
+        """
+        self.connection.execute("INSERT INTO pages (route, title, content) VALUES ('legacy', 'Old', 'Old text')")
+        self.connection.commit()
+        self.db_operation.update_page(Page("legacy", "New", "New text"))
+        self.assertEqual("Old text", self.db_operation.get_page_revision("legacy", 1).content)
+        self.assertEqual("New text", self.db_operation.get_page_revision("legacy", 2).content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+This module contains tests for the in-memory page route table.
+"""
+from src.database.database import DatabaseOperation
+from src.page import Page
+from src.routing import RouteTable
+import tests.database_mock
+
+
+class TestRouteTable(tests.database_mock.MockDatabase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.db_operation.insert_page(Page("home", "Welcome", "Welcome to our website!"))
+        self.db_operation.insert_page(Page("about-us", "About", "Who we are."))
+        self.route_table = RouteTable(self.db_operation, check_seconds=0)
+        self.route_table.load()
+
+    def test_lookup_maps_paths_to_templates(self) -> None:
+        """
+        Tests that home is served at / with its own template and other pages with the generic one
+        """
+        self.assertEqual("index.html", self.route_table.lookup("/")[0])
+        template, page = self.route_table.lookup("/about-us")
+        self.assertEqual(("page.html", "About"), (template, page.title))
+        self.assertIsNone(self.route_table.lookup("/home"))
+        self.assertIsNone(self.route_table.lookup("/missing"))
+
+    def test_writes_in_this_process_patch_the_table(self) -> None:
+        """
+        Tests that insert_page and update_page are visible without a reload
+        """
+        self.db_operation.insert_page(Page("faq", "FAQ", "Questions."))
+        self.db_operation.update_page(Page("about-us", "About us", "Who we are."))
+        self.assertEqual("FAQ", self.route_table.lookup("/faq")[1].title)
+        self.assertEqual("About us", self.route_table.lookup("/about-us")[1].title)
+        self.assertEqual(3, len(self.route_table))
+
+    def test_changes_bump_the_generation(self) -> None:
+        """
+        Tests that loads and page changes move the generation on and that paths list templated pages first
+        """
+        generation = self.route_table.generation
+        self.db_operation.update_page(Page("about-us", "About us", "Who we are."))
+        self.assertEqual(generation + 1, self.route_table.generation)
+        self.route_table.load()
+        self.assertEqual(generation + 2, self.route_table.generation)
+        self.assertEqual(["/", "/about-us"], self.route_table.paths())
+
+    def test_writes_by_another_worker_trigger_a_reload(self) -> None:
+        """
+        Tests that a page inserted through another connection shows up after the version check
+        """
+        other_worker = DatabaseOperation(sqlite_connection=self.connection)
+        other_worker.insert_page(Page("blog", "Blog", "News."))
+        self.assertEqual("Blog", self.route_table.lookup("/blog")[1].title)
@@ -0,0 +1,101 @@
+"""
+This module contains tests for module search and DatabaseOperation.search_contacts
+"""
+import unittest
+
+from src.search import BlindIndex, fts_query
+import tests.database_mock
+
+
+class TestContactSearch(tests.database_mock.MockDatabase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.db_operation.create_search_tables()
+        self.db_operation.insert_contact_data({
+            "first_name": "Obi-Wan",
+            "last_name": "Kenobi",
+            "phone_number": "+1 (800) 555-0101",
+            "email": "Ben@Tatooine.net",
+            "subject": "Hermit life",
+            "message": "These aren't the droids you're looking for.",
+            "visible": 1,
+        })
+        self.db_operation.insert_contact_data({
+            "first_name": "Owen",
+            "last_name": "Lars",
+            "phone_number": "18005550202",
+            "email": "owen@moisturefarm.net",
+            "subject": "Droid purchase",
+            "message": "Needs to speak Bocce.",
+            "visible": 1,
+        })
+
+    def test_search_by_phone_ignores_formatting(self) -> None:
+        """
+        Tests exact phone lookup through the blind index
+        """
+        results = self.db_operation.search_contacts(phone_number="18005550101")
+        self.assertEqual(["Obi-Wan"], [r["first_name"] for r in results])
+        self.assertEqual("+1 (800) 555-0101", results[0]["phone_number"])
+
+    def test_search_by_email_is_case_insensitive(self) -> None:
+        """
+        Tests exact email lookup through the blind index
+        """
+        results = self.db_operation.search_contacts(email="ben@tatooine.net")
+        self.assertEqual(["Kenobi"], [r["last_name"] for r in results])
+
+    def test_full_text_prefix_search(self) -> None:
+        """
+        Tests partial word search over non sensitive columns
+        """
+        results = self.db_operation.search_contacts(query="droi")
+        self.assertEqual({"Obi-Wan", "Owen"}, {r["first_name"] for r in results})
+
+    def test_hidden_and_updated_leads(self) -> None:
+        """
+        Tests that hidden leads are excluded and updates re-index the lead
+        """
+        self.db_operation.disable_contact("owen@moisturefarm.net")
+        self.assertEqual([], self.db_operation.search_contacts(query="Lars"))
+
+        self.db_operation.update_contact({
+            "first_name": "Ben",
+            "last_name": "Kenobi",
+            "phone_number": "18005550303",
+            "email": "ben@tatooine.net",
+            "subject": "Hermit life",
+            "message": "Use the Force.",
+            "visible": 1,
+        }, "Ben@Tatooine.net")
+        self.assertEqual([], self.db_operation.search_contacts(phone_number="18005550101"))
+        self.assertEqual(["Ben"], [r["first_name"] for r in self.db_operation.search_contacts(query="force")])
+
+    def test_existing_leads_are_backfilled(self) -> None:
+        """
+        Tests that leads inserted before the search tables existed are indexed
+        """
+        self.connection.execute("DELETE FROM lead_blind_index")
+        self.connection.commit()
+        self.assertEqual(2, self.db_operation.rebuild_search_index())
+        self.assertEqual(1, len(self.db_operation.search_contacts(email="owen@moisturefarm.net")))
+
+
+class TestBlindIndex(unittest.TestCase):
+    def test_index_is_keyed(self) -> None:
+        """
+        Tests that different keys give different indexes for the same value
+        """
+        self.assertNotEqual(BlindIndex(b"a" * 32).email("x@y.z"), BlindIndex(b"b" * 32).email("x@y.z"))
+        self.assertNotEqual(BlindIndex(b"a" * 32).email("123"), BlindIndex(b"a" * 32).phone("123"))
+
+    def test_fts_query_escapes_syntax(self) -> None:
+        """
+        Tests that user input can't inject FTS5 operators
+        """
+        self.assertEqual('"droid" "OR"*', fts_query('droid" OR'))
+        self.assertEqual("", fts_query("  ** "))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+This module contains tests for the synthetic data seeder.
+"""
+import unittest
+
+from cryptography.fernet import Fernet
+
+from src.database.seed import Seeder
+from src.encryption import EncryptionService
+import tests.database_mock
+
+
+class TestParallelEncryption(tests.database_mock.MockDatabase):
+    def test_worker_processes_produce_fernet_tokens(self) -> None:
+        """
+        Tests that values encrypted by the worker pool are regular Fernet tokens in input order
+        """
+        key = Fernet.generate_key()
+        self.db_operation.encryption = EncryptionService(key)
+        seeder = Seeder(self.db_operation, workers=2)
+        self.addCleanup(seeder.close)
+        values = ["a@x.com", "", "a much longer value spanning several AES blocks of plaintext", "a@x.com", "b"]
+        tokens = seeder._encrypt(values)
+        self.assertEqual("", tokens[1])
+        self.assertNotEqual(tokens[0], tokens[3])
+        fernet = Fernet(key)
+        self.assertEqual([v for v in values if v], [fernet.decrypt(t.encode()).decode() for t in tokens if t])
+
+
+class TestSeeder(tests.database_mock.MockDatabase):
+    def _seed(self) -> Seeder:
+        seeder = Seeder(self.db_operation, seed=3, batch_size=40)
+        seeder.create_tables()
+        seeder.seed_pages(5)
+        seeder.seed_leads(100)
+        seeder.seed_appointments(50)
+        return seeder
+
+    def test_seeded_rows_are_usable_by_the_app(self) -> None:
+        """
+        Tests that seeded leads can be looked up and searched like leads inserted by the app
+        """
+        self._seed()
+        count = lambda table: self.connection.execute(f"select count(*) from {table}").fetchone()[0]
+        self.assertEqual((100, 50, 8), (count("leads"), count("appointments"), count("pages")))
+        self.assertEqual(100, count("lead_blind_index"))
+
+        first_name, email, phone_number = self.connection.execute(
+            "select first_name, email, phone_number from leads where id = 42"
+        ).fetchone()
+        email = self.db_operation.encryption.decrypt(email)
+        phone_number = self.db_operation.encryption.decrypt(phone_number)
+        self.assertEqual(first_name, self.db_operation.get_contact(email)["first_name"])
+        self.assertEqual([email], [c["email"] for c in self.db_operation.search_contacts(email=email)])
+        self.assertIn(email, [c["email"] for c in self.db_operation.search_contacts(phone_number=phone_number)])
+        self.assertIn(42, [c["id"] for c in self.db_operation.search_contacts(query=first_name, limit=100)])
+        self.assertTrue(self.db_operation.get_page_by_route("gallery").image_url)
+
+    def test_same_seed_gives_same_data(self) -> None:
+        """
+        Tests that plain text data only depends on the seed
+        """
+        self._seed()
+        first = self.connection.execute("select first_name, last_name, subject, message from leads").fetchall()
+        self.connection.execute("DELETE FROM leads")
+        self.connection.commit()
+        self.connection.execute("DELETE FROM lead_blind_index")
+        Seeder(self.db_operation, seed=3, batch_size=40).seed_leads(100)
+        second = self.connection.execute("select first_name, last_name, subject, message from leads").fetchall()
+        self.assertEqual(first, second)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+This module contains tests for coalescing concurrent loads.
+"""
+import threading
+import unittest
+
+from src.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self) -> None:
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.calls = []
+
+    def _run(self, count: int, loader) -> list:
+        """
+        Calls do("key", loader) from count threads while the first load is blocked
+        """
+        results = []
+
+        def call():
+            try:
+                results.append(self.flight.do("key", loader))
+            except ValueError as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        threads[0].start()
+        self.started.wait(1)
+        for thread in threads[1:]:
+            thread.start()
+        while self.flight.shared < count - 1:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _loader(self, result):
+        def load():
+            self.calls.append(1)
+            self.started.set()
+            self.release.wait(1)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return load
+
+    def test_concurrent_calls_share_one_load(self) -> None:
+        """
+        Tests that callers arriving during a load get its result without loading again
+        """
+        self.assertEqual(["page"] * 4, self._run(4, self._loader("page")))
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual((1, 3, 0), (self.flight.loads, self.flight.shared, self.flight.in_flight()))
+        self.assertEqual("next", self.flight.do("key", lambda: "next"))
+
+    def test_errors_reach_every_waiting_caller(self) -> None:
+        """
+        Tests that a failed load is raised in all callers and the key can be loaded again afterwards
+        """
+        error = ValueError("database is locked")
+        self.assertEqual([error] * 3, self._run(3, self._loader(error)))
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual("retried", self.flight.do("key", lambda: "retried"))
+
+
+if __name__ == "__main__":
+    unittest.main()
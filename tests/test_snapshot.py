@@ -0,0 +1,116 @@
+"""
+This module contains tests for the reporting snapshot.
+"""
+import os
+import tempfile
+import threading
+import unittest
+
+from src.database.database import DatabaseOperation
+from src.database.snapshot import ReportingSnapshot
+from src.page import Page
+
+
+class TestReportingSnapshot(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "live.db")
+        self.live = DatabaseOperation(self.path)
+        self.live.create_pages_table("pages")
+        self.live.create_cache_versions_table()
+        self.live.insert_page(Page("home", "Welcome", "Welcome to our website!"))
+
+    def tearDown(self) -> None:
+        self.live.close()
+        self.directory.cleanup()
+
+    def _check_refresh(self, snapshot: ReportingSnapshot) -> None:
+        self.assertEqual(["home"], [page.route for page in snapshot.database.get_all_pages()])
+        self.live.insert_page(Page("services", "Our Services", "Here are our services."))
+        # Writes only show up after a refresh, and a refresh without new commits is skipped
+        self.assertEqual(1, len(snapshot.database.get_all_pages()))
+        self.assertTrue(snapshot.refresh())
+        self.assertFalse(snapshot.refresh())
+        self.assertEqual(2, len(snapshot.database.get_all_pages()))
+        self.assertEqual(self.live.get_cache_versions(), snapshot.database.get_cache_versions())
+        self.assertEqual(1, snapshot.stats()["skipped"])
+
+    def test_in_memory_snapshot(self) -> None:
+        """
+        Tests that an in memory snapshot only changes on refresh
+        """
+        snapshot = ReportingSnapshot(self.path, refresh_seconds=0.01)
+        self._check_refresh(snapshot)
+        snapshot.stop()
+
+    def test_file_snapshot_is_read_only(self) -> None:
+        """
+        Tests that a file snapshot is swapped in whole and refuses writes
+        """
+        target = os.path.join(self.directory.name, "reporting.db")
+        snapshot = ReportingSnapshot(self.path, refresh_seconds=0.01, target_path=target)
+        self._check_refresh(snapshot)
+        self.assertFalse(snapshot.database.insert_page(Page("gallery", "Gallery", "Check out our work.")))
+        self.assertFalse(os.path.exists(f"{target}.building"))
+        snapshot.stop()
+
+    def test_swapped_snapshots_close_after_their_last_reader(self) -> None:
+        """
+        Tests that a refresh leaves a borrowed snapshot open until it is returned, and closes an idle one at once
+        """
+        snapshot = ReportingSnapshot(self.path, refresh_seconds=60)
+        with snapshot.reader() as borrowed:
+            self.live.insert_page(Page("services", "Our Services", "Here are our services."))
+            self.assertTrue(snapshot.refresh(force=True))
+            self.assertEqual(["home"], [page.route for page in borrowed.get_all_pages()])
+            with snapshot.reader() as current:
+                self.assertEqual(2, len(current.get_all_pages()))
+        self.assertIsNone(borrowed.connection)
+        self.assertIsNotNone(current.connection)
+        self.assertTrue(snapshot.refresh(force=True))
+        self.assertIsNone(current.connection)
+        snapshot.stop()
+
+    def test_copies_restarted_by_writes_are_abandoned(self) -> None:
+        """
+        Tests that a copy which keeps starting over because of writes gives up with an error and keeps the
+        previous snapshot, as does one taking longer than max_seconds
+        """
+        for number in range(50):
+            self.live.insert_page(Page(f"page{number}", "Title", "Content " * 200))
+        target = os.path.join(self.directory.name, "reporting.db")
+        snapshot = ReportingSnapshot(self.path, refresh_seconds=60, target_path=target, pages_per_step=1,
+                                     step_pause=0.002, max_restarts=2)
+        self.addCleanup(snapshot.stop)
+        previous = snapshot.database
+        started, stop = threading.Event(), threading.Event()
+
+        def write() -> None:
+            with DatabaseOperation(self.path) as writer:
+                while not stop.is_set():
+                    writer._bump_version("pages")
+                    writer.connection.commit()
+                    started.set()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        started.wait()
+        try:
+            with self.assertLogs("src.database.snapshot", "ERROR") as logs:
+                self.assertFalse(snapshot.refresh(force=True))
+        finally:
+            stop.set()
+            writer.join()
+        self.assertIn("restarted 3 times", logs.output[0])
+        self.assertIs(previous, snapshot.database)
+        self.assertFalse(os.path.exists(f"{target}.building"))
+
+        snapshot.max_seconds = 0
+        with self.assertLogs("src.database.snapshot", "ERROR") as logs:
+            self.assertFalse(snapshot.refresh(force=True))
+        self.assertIn("took longer than 0s", logs.output[0])
+        self.assertEqual(2, snapshot.stats()["failures"])
+
+
+if __name__ == "__main__":
+    unittest.main()
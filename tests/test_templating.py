@@ -0,0 +1,79 @@
+"""
+This module contains tests for module templating.
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask, render_template_string
+
+from src.templating import configure_templates, precompile_templates, FragmentCache, LazySequence
+
+
+class TestTemplating(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__, template_folder="../templates")
+        configure_templates(self.app, cache_dir=self.cache_dir.name)
+
+    def tearDown(self) -> None:
+        self.cache_dir.cleanup()
+
+    def test_fragment_is_reused_until_version_changes(self) -> None:
+        """
+        Tests that a cached block renders once per version
+        """
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return ["a", "b"]
+
+        source = '{% cache "items", version %}{% for i in items %}{{ i }}{% endfor %}{% endcache %}'
+        with self.app.app_context():
+            first = render_template_string(source, items=LazySequence(loader), version=1)
+            second = render_template_string(source, items=LazySequence(loader), version=1)
+            third = render_template_string(source, items=LazySequence(loader), version=2)
+
+        self.assertEqual("ab", first)
+        self.assertEqual(first, second)
+        self.assertEqual("ab", third)
+        self.assertEqual(2, len(calls))
+
+    def test_concurrent_misses_render_once(self) -> None:
+        """
+        Tests that requests missing the same fragment at once wait for one render
+        """
+        cache = FragmentCache()
+        renders = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.05)
+            return "fragment"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_render("pages:1", render)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["fragment"] * 5, results)
+        self.assertEqual(1, len(renders))
+        self.assertEqual("fragment", cache.get("pages:1"))
+        self.assertEqual(1, cache.stats()["renders"])
+
+    def test_precompile_fills_bytecode_cache(self) -> None:
+        """
+        Tests that precompiling writes bytecode for the app templates
+        """
+        compiled = precompile_templates(self.app)
+        self.assertGreater(compiled, 0)
+        self.assertTrue(os.listdir(self.cache_dir.name))
+
+
+if __name__ == "__main__":
+    unittest.main()
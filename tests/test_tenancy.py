@@ -0,0 +1,251 @@
+"""
+This module contains tests for hosting several sites from one process.
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from jinja2 import Environment
+
+from src.page import Page
+from src.tenancy import Site, SiteConfig, SiteRegistry, SiteTemplateLoader
+
+
+class FakeSite:
+    def __init__(self, config: SiteConfig) -> None:
+        self.name = config.name
+        self.closed = False
+        self.pending = False
+
+    def has_pending_work(self) -> bool:
+        return self.pending
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def configs(count: int) -> list[SiteConfig]:
+    return [
+        SiteConfig(name=f"site{i}", database=f"site{i}.db", uploads=f"site{i}", hosts=(f"site{i}.com",))
+        for i in range(count)
+    ]
+
+
+class TestSiteRegistry(unittest.TestCase):
+    def test_hosts_resolve_to_sites(self) -> None:
+        """
+        Tests that hosts are matched without port or case and unknown hosts fall back to the default
+        """
+        registry = SiteRegistry(configs(2), default=None, opener=FakeSite)
+        self.assertEqual("site1", registry.acquire("SITE1.com:8080").name)
+        self.assertIsNone(registry.acquire("unknown.com"))
+        self.assertEqual("site0", SiteRegistry(configs(2), default="site0", opener=FakeSite).resolve("unknown.com"))
+
+    def test_idle_sites_are_evicted_in_lru_order(self) -> None:
+        """
+        Tests that only idle sites are closed once more than max_open are loaded
+        """
+        registry = SiteRegistry(configs(4), max_open=2, opener=FakeSite)
+        busy = registry.acquire("site0.com")
+        idle = registry.acquire("site1.com")
+        registry.release(idle)
+        registry.release(registry.acquire("site2.com"))
+        self.assertTrue(idle.closed)
+        self.assertFalse(busy.closed)
+        # Every open site is busy, so the limit is exceeded rather than closing a site in use
+        third = registry.acquire("site3.com")
+        self.assertEqual(["site0", "site3"], registry.open_sites())
+        registry.release(busy)
+        registry.release(third)
+        self.assertEqual(2, len(registry.open_sites()))
+
+    def test_idle_timeout_closes_sites(self) -> None:
+        """
+        Tests that sites unused for idle_seconds are closed on the next release
+        """
+        registry = SiteRegistry(configs(2), idle_seconds=0.01, opener=FakeSite)
+        first = registry.acquire("site0.com")
+        registry.release(first)
+        time.sleep(0.02)
+        registry.release(registry.acquire("site1.com"))
+        self.assertTrue(first.closed)
+
+    def test_sites_with_pending_work_stay_open(self) -> None:
+        """
+        Tests that an idle site is not closed while its background workers have work left
+        """
+        registry = SiteRegistry(configs(2), idle_seconds=0.01, opener=FakeSite)
+        first = registry.acquire("site0.com")
+        first.pending = True
+        registry.release(first)
+        time.sleep(0.02)
+        registry.release(registry.acquire("site1.com"))
+        self.assertFalse(first.closed)
+        first.pending = False
+        registry.release(registry.acquire("site1.com"))
+        self.assertTrue(first.closed)
+
+    def test_concurrent_requests_open_a_site_once(self) -> None:
+        """
+        Tests that concurrent first requests share one opened site
+        """
+        opened = []
+
+        def slow_opener(config):
+            opened.append(config.name)
+            time.sleep(0.05)
+            return FakeSite(config)
+
+        registry = SiteRegistry(configs(1), opener=slow_opener)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.acquire("site0.com"))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["site0"], opened)
+        self.assertEqual(1, len({id(site) for site in results}))
+
+    def test_sites_are_warmed_up_before_use(self) -> None:
+        """
+        Tests that the warm-up hook runs once per opened site, before acquire returns it
+        """
+        warmed = []
+        registry = SiteRegistry(configs(1), opener=FakeSite, warm_up=lambda site: warmed.append(site.name))
+        registry.release(registry.acquire("site0.com"))
+        registry.release(registry.acquire("site0.com"))
+        self.assertEqual(["site0"], warmed)
+
+    def test_failed_warm_up_closes_the_site(self) -> None:
+        """
+        Tests that a site whose warm-up raises is closed and opened again by the next request
+        """
+        opened = []
+
+        def opener(config):
+            opened.append(FakeSite(config))
+            return opened[-1]
+
+        def warm_up(site):
+            if len(opened) == 1:
+                raise RuntimeError("broken template")
+
+        registry = SiteRegistry(configs(1), opener=opener, warm_up=warm_up)
+        with self.assertRaises(RuntimeError):
+            registry.acquire("site0.com")
+        self.assertTrue(opened[0].closed)
+        site = registry.acquire("site0.com")
+        self.assertIs(opened[1], site)
+
+
+class TestSite(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        root = self.directory.name
+        self.templates = os.path.join(root, "acme-templates")
+        os.makedirs(self.templates)
+        with open(os.path.join(self.templates, "index.html"), "w", encoding="utf-8") as template:
+            template.write("acme {{ page.title }}")
+        self.configs = [
+            SiteConfig(name="acme", database=os.path.join(root, "acme.db"), uploads=os.path.join(root, "acme"),
+                       hosts=("acme.com",), templates=self.templates),
+            SiteConfig(name="zenith", database=os.path.join(root, "zenith.db"), uploads=os.path.join(root, "zenith"),
+                       hosts=("zenith.com",)),
+        ]
+        self.registry = SiteRegistry(self.configs)
+
+    def tearDown(self) -> None:
+        self.registry.close()
+        self.directory.cleanup()
+
+    def test_sites_have_separate_data_and_templates(self) -> None:
+        """
+        Tests that each site gets its own database, route table and template overrides
+        """
+        acme = self.registry.acquire("acme.com")
+        zenith = self.registry.acquire("zenith.com")
+        acme.database.insert_page(Page("offers", "Offers", "Acme only."))
+        self.assertIsNotNone(acme.route_table.lookup("/offers"))
+        self.assertIsNone(zenith.route_table.lookup("/offers"))
+        self.assertTrue(os.path.isdir(self.configs[1].uploads))
+
+        self.assertEqual("sites/acme/index.html", acme.template("index.html"))
+        self.assertEqual("services.html", acme.template("services.html"))
+        self.assertEqual("index.html", zenith.template("index.html"))
+        environment = Environment(loader=SiteTemplateLoader(self.registry))
+        home = acme.route_table.lookup("/")[1]
+        self.assertEqual("acme Welcome", environment.get_template(acme.template("index.html")).render(page=home))
+        self.assertEqual(["sites/acme/index.html"], environment.list_templates())
+
+    def test_closing_a_site_closes_its_workers_connections(self) -> None:
+        """
+        Tests that the reminder scheduler and outbox relay connections are closed with the site
+        """
+        with mock.patch.dict(os.environ, {"REMINDER_OFFSETS": "1h", "DIGEST_EMAIL": "owner@example.com"}):
+            site = Site(self.configs[1])
+        self.assertIsNotNone(site.reminder_scheduler.database.connection)
+        site.close()
+        self.assertIsNone(site.reminder_scheduler.database.connection)
+        self.assertIsNone(site.outbox_relay.database.connection)
+
+    def test_every_site_traces_its_own_queries(self) -> None:
+        """
+        Tests that SLOW_QUERY_MS gives each site a tracer on its own connection
+        """
+        with mock.patch.dict(os.environ, {"SLOW_QUERY_MS": "0"}):
+            sites = [Site(config) for config in self.configs]
+        for site in sites:
+            self.addCleanup(site.close)
+        sites[1].database.get_all_pages()
+        self.assertEqual([], [entry for entry in sites[0].query_tracer.entries() if "pages" in entry["sql"]])
+        self.assertTrue([entry for entry in sites[1].query_tracer.entries() if "pages" in entry["sql"]])
+
+    def test_admin_reads_the_snapshot_and_resumes_the_feed_where_it_was_copied(self) -> None:
+        """
+        Tests that the admin page reads the reporting snapshot, that its feed position replays what the
+        snapshot misses, and that the live database is used when the feed can no longer replay it
+        """
+        with mock.patch.dict(os.environ, {"REPORTING_SNAPSHOT_SECONDS": "3600"}):
+            site = Site(self.configs[1])
+        self.addCleanup(site.close)
+        site.database.insert_page(Page("offers", "Offers", "Zenith only."))
+        site.reporting_snapshot.refresh(force=True)
+        with site.admin_database() as (database, since):
+            self.assertIsNot(site.database, database)
+            self.assertIn("offers", [page.route for page in database.get_all_pages()])
+        site.database.insert_page(Page("faq", "FAQ", "Questions"))
+        with site.admin_database() as (database, resumed):
+            self.assertEqual(since, resumed)
+            self.assertNotIn("faq", [page.route for page in database.get_all_pages()])
+            stream = site.change_feed.stream(resumed)
+            next(stream)
+            self.assertIn('"route": "faq"', next(stream))
+            stream.close()
+        with mock.patch.object(site.change_feed, "can_resume", return_value=False):
+            with site.admin_database() as (database, since):
+                self.assertIs(site.database, database)
+                self.assertEqual(site.change_feed.last_event_id(), since)
+
+    def test_warm_up_renders_pages_and_reports_readiness(self) -> None:
+        """
+        Tests that warm-up renders every page through the given callable and that failures keep the site not ready
+        """
+        site = self.registry.acquire("zenith.com")
+        self.assertFalse(site.ready())
+        rendered = []
+        stats = site.warm_up(lambda warmed, path: rendered.append(path))
+        self.assertEqual(["/", "/gallery", "/services"], sorted(rendered))
+        self.assertEqual((3, 3, 0), (stats["pages"], stats["rendered"], stats["failed"]))
+        self.assertTrue(site.ready())
+
+        site.database.insert_page(Page("offers", "Offers", "Zenith only."))
+        stats = site.warm_up(lambda warmed, path: 1 / (path != "/offers"), limit=4)
+        self.assertEqual((4, 3, 1), (stats["pages"], stats["rendered"], stats["failed"]))
+        self.assertFalse(site.ready())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+This module contains tests for module tracing.
+"""
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from src.database.backends import SqliteConnection
+from src.database.connection import InstrumentedConnection
+from src.database.tracing import QueryTracer, parameter_shape, summarize, load_log
+import tests.database_mock
+
+
+class TestQueryTracer(tests.database_mock.MockDatabase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.log_dir.name, "slow.jsonl")
+        self.tracer = QueryTracer(threshold_ms=0, log_path=self.log_path)
+        self.tracer.attach(self.db_operation.connection)
+
+    def tearDown(self) -> None:
+        self.tracer.detach(self.db_operation.connection)
+        self.log_dir.cleanup()
+        super().tearDown()
+
+    def test_records_plan_without_values(self) -> None:
+        """
+        Tests that a traced lookup records its query plan and parameter types but no values
+        """
+        self.db_operation.get_contact("secret@example.com")
+
+        entry = next(e for e in self.tracer.entries() if "from leads" in e["sql"])
+        self.assertEqual(["str", "str"], entry["params"])
+        self.assertTrue(any("email_hash" in detail for detail in entry["plan"]))
+        with open(self.log_path, encoding="utf8") as log_file:
+            self.assertNotIn("secret@example.com", log_file.read())
+
+    def test_log_can_be_summarized(self) -> None:
+        """
+        Tests that the JSON lines log groups statements for the CLI
+        """
+        self.db_operation.get_all_pages()
+        self.db_operation.get_all_pages()
+
+        groups = summarize(load_log(self.log_path))
+        pages = next(g for g in groups if g["sql"].startswith("select route"))
+        self.assertEqual(2, pages["count"])
+
+    def test_steps_are_counted_once_rows_are_fetched(self) -> None:
+        """
+        Tests that the steps of stepping through a result belong to that statement, not the next one
+        """
+        self.connection.execute("create table big(x INTEGER)")
+        self.connection.executemany("insert into big values (?)", [(i,) for i in range(5000)])
+        self.db_operation.connection.execute("select x from big").fetchall()
+        self.db_operation.connection.execute("select 1").fetchone()
+        entries = {entry["sql"]: entry for entry in self.tracer.entries()}
+        self.assertGreaterEqual(entries["select x from big"]["vm_steps"], 5000)
+        self.assertEqual(0, entries["select 1"]["vm_steps"])
+
+    def test_plans_are_bounded(self) -> None:
+        """
+        Tests that only the most recently used query plans are kept
+        """
+        self.tracer.max_plans = 2
+        for table in ("leads", "appointments", "pages"):
+            self.db_operation.connection.execute(f"select count(*) from {table} where 1 = ?", (1,)).fetchone()
+        self.assertEqual(2, len(self.tracer._plans))
+
+
+class TestTimedCursor(unittest.TestCase):
+    def test_fetch_time_is_included(self) -> None:
+        """
+        Tests that a statement is reported once, after its rows were fetched, with the fetch time
+        """
+        raw = sqlite3.connect(":memory:")
+        raw.create_function("pause", 1, lambda value: time.sleep(0.01) or value)
+        raw.execute("create table t(x INTEGER)")
+        raw.executemany("insert into t values (?)", [(i,) for i in range(10)])
+        reported = []
+        connection = InstrumentedConnection(SqliteConnection(raw), observers=[lambda *call: reported.append(call)])
+
+        cursor = connection.execute("select pause(x) from t")
+        self.assertEqual([], reported)
+        self.assertEqual(10, len(cursor.fetchall()))
+        self.assertEqual(1, len(reported))
+        self.assertGreaterEqual(reported[0][2], 0.09)
+
+        for _ in connection.execute("select x from t"):
+            pass
+        connection.execute("select x from t").fetchone()
+        self.assertEqual(3, len(reported))
+        raw.close()
+
+
+class TestParameterShape(unittest.TestCase):
+    def test_shapes(self) -> None:
+        """
+        Tests parameter shapes for positional and named parameters
+        """
+        self.assertEqual(["str", "int"], parameter_shape(("a", 1)))
+        self.assertEqual({"email": "str"}, parameter_shape({"email": "x@y.z"}))
+        self.assertIsNone(parameter_shape(None))
+
+
+if __name__ == "__main__":
+    unittest.main()